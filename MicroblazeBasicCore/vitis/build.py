@@ -13,11 +13,29 @@
 # \brief Builds the MicroBlaze .ELF using the Vitis Unified Python API.
 #        This is the Vitis 2026.1+ replacement for the XSCT-based prj.tcl/elf.tcl
 #        flow (XSCT was removed in Vitis 2026.1).
+#
+#        The platform component and its standalone domain are kept between
+#        builds while the .xsa content, EMBED_PROC and the tool version are
+#        unchanged (recorded in $VITIS_PRJ/.platform_stamp.json). Only the
+#        application sources are re-imported and the application rebuilt.
+#        VITIS_CLEAN=1 removes the workspace and rebuilds everything.
+#
+#        If VITIS_ELF_CACHE names a directory (can be shared over NFS), the
+#        built .ELF is stored there under a hash of the .xsa, the imported
+#        source and library files, the compile options and the Vitis version
+#        (VITIS_VERSION, else VIVADO_VERSION).
+#        On a hit the .ELF is copied to $VITIS_ELF without starting the Vitis
+#        server. The cache is pruned to VITIS_ELF_CACHE_MAX_GB, least recently
+#        used first.
 
 import vitis
 import os
+import json
 import glob
+import time
+import socket
 import shutil
+import hashlib
 
 # Get build system variables (exported by system_vivado.mk).
 # Resolve symlinks: the generated CMakeLists.txt collects sources from BOTH
@@ -42,36 +60,214 @@ platform_name = f'{project}_platform'
 app_name      = 'app_0'
 domain_name   = 'microblaze'
 
+stamp_file = os.path.join(vitis_prj, '.platform_stamp.json')
+app_dir    = os.path.join(vitis_prj, app_name)
+
+# Optimize for size (legacy used "Optimize for size (-Os)")
+opt_level = '-Os'
+
+elf_cache     = os.environ.get('VITIS_ELF_CACHE', '')
+elf_cache_max = float(os.environ.get('VITIS_ELF_CACHE_MAX_GB', '2')) * 1024**3
+
+# Temporary files older than this were left by an interrupted store
+elf_cache_tmp_age = 24 * 3600
+
+# Tool version of the cache key: the same on every machine, unlike the install path
+tool_version = os.environ.get('VITIS_VERSION') or os.environ.get('VIVADO_VERSION', '')
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for buf in iter(lambda: f.read(1024*1024), b''):
+            h.update(buf)
+    return h.hexdigest()
+
+
+def save_stamp(stamp):
+    with open(stamp_file + '.tmp', 'w') as f:
+        json.dump(stamp, f, indent=1)
+    os.replace(stamp_file + '.tmp', stamp_file)
+
+
+def tree_digest(h, root):
+    """Add the relative path and content hash of every file under root"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            h.update(f'{os.path.relpath(path, root)}\0{file_sha256(path)}\n'.encode())
+
+
+def imported_names():
+    """Names that import_files() creates in src/ (the entries of the source and library directories)"""
+    names = set()
+    for loc in [vitis_src] + vitis_lib:
+        names.update(os.listdir(loc))
+    return sorted(names)
+
+
+def elf_cache_key():
+    h = hashlib.sha256()
+    h.update(f'xsa {file_sha256(xsa_path)}\nproc {embed_proc}\nopt {opt_level}\n'.encode())
+    h.update(f'vitis {tool_version}\n'.encode())
+    h.update(b'src\n')
+    tree_digest(h, vitis_src)
+    # Libraries by position, their absolute paths differ between checkouts
+    for i, lib in enumerate(vitis_lib):
+        h.update(f'lib {i}\n'.encode())
+        tree_digest(h, lib)
+    return h.hexdigest()
+
+
+def elf_cache_prune():
+    """Remove the least recently used entries until the cache fits elf_cache_max, and stale temporary files"""
+    for path in glob.glob(os.path.join(elf_cache, '*', '*.tmp')):
+        try:
+            if time.time() - os.stat(path).st_mtime > elf_cache_tmp_age:
+                os.remove(path)
+        except OSError:
+            pass
+
+    entries = []
+    for path in glob.glob(os.path.join(elf_cache, '*', '*.elf')):
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+
+    total = sum([e[1] for e in entries])
+    for mtime, size, path in sorted(entries):
+        if total <= elf_cache_max:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+
+def elf_cache_store(key, elf):
+    """Publish elf under key: copy to a unique name, then rename (atomic, also on NFS)"""
+    dest = os.path.join(elf_cache, key[:2], f'{key}.elf')
+    tmp  = f'{dest}.{socket.gethostname()}.{os.getpid()}.tmp'
+    try:
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        shutil.copyfile(elf, tmp)
+        os.replace(tmp, dest)
+        elf_cache_prune()
+    except OSError as e:
+        print(f'build.py: WARNING: could not store the .ELF in {elf_cache}: {e}')
+
+
+# Shared .ELF cache: a hit skips the Vitis build entirely
+if elf_cache:
+    cache_key = elf_cache_key()
+    cache_elf = os.path.join(elf_cache, cache_key[:2], f'{cache_key}.elf')
+    if os.path.isfile(cache_elf):
+        shutil.copyfile(cache_elf, vitis_elf)
+        os.chmod(vitis_elf, 0o664)
+        # Mark the entry as recently used (atime is unreliable on NFS mounts)
+        try:
+            os.utime(cache_elf)
+        except OSError:
+            pass
+        print(f'build.py: .ELF cache hit, copied {cache_elf} -> {vitis_elf}')
+        raise SystemExit(0)
+    print(f'build.py: .ELF cache miss ({cache_key[:12]}), building')
+
+
+# The platform is reused while these inputs are unchanged
+platform_key = hashlib.sha256('\n'.join([
+    file_sha256(xsa_path), embed_proc, domain_name, os.environ.get('XILINX_VITIS', ''),
+]).encode()).hexdigest()
+
+# The application is re-created when its configuration changes
+app_key = hashlib.sha256('\n'.join([vitis_src] + vitis_lib).encode()).hexdigest()
+
+try:
+    with open(stamp_file) as f:
+        stamp = json.load(f)
+except (OSError, ValueError):
+    stamp = {}
+
+reuse_platform = (os.environ.get('VITIS_CLEAN', '0') == '0' and stamp.get('platform') == platform_key
+                  and os.path.isdir(os.path.join(vitis_prj, platform_name)))
+
 # Remove any stale Vitis workspace
-if os.path.isdir(vitis_prj):
+if not reuse_platform and os.path.isdir(vitis_prj):
     shutil.rmtree(vitis_prj, ignore_errors=True)
 
 # Create a client object and set the workspace
 client = vitis.create_client()
 client.set_workspace(vitis_prj)
 
-# Create the platform from the Vivado-exported .xsa, add a standalone
-# MicroBlaze domain, and build the platform
-platform = client.create_platform_component(name=platform_name, hw_design=xsa_path)
-platform.add_domain(name=domain_name, cpu=embed_proc, os='standalone')
-platform.build()
+platform_xpfm = None
 
-# Create an empty application component on the generated platform
-platform_xpfm = client.find_platform_in_repos(platform_name)
-app = client.create_app_component(name=app_name, platform=platform_xpfm, domain=domain_name)
+if reuse_platform:
+    platform_xpfm = client.find_platform_in_repos(platform_name)
+    if platform_xpfm:
+        print(f'build.py: .xsa, EMBED_PROC and tool version unchanged, reusing {platform_name}')
+    else:
+        reuse_platform = False
+        stamp = {}
+        print(f'build.py: {platform_name} not found in the workspace, rebuilding it')
 
-# Import the user sources into the application's src/ directory
-app.import_files(from_loc=vitis_src, dest_dir_in_cmp='src')
+if not reuse_platform:
+    # Create the platform from the Vivado-exported .xsa, add a standalone
+    # MicroBlaze domain, and build the platform
+    platform = client.create_platform_component(name=platform_name, hw_design=xsa_path)
+    platform.add_domain(name=domain_name, cpu=embed_proc, os='standalone')
+    platform.build()
 
-# Import the library sources (e.g. surf/.../sdk/common: ssi_printf.c, printf.c) so the
-# .c files get compiled, and add each library directory as an include path so headers
-# resolve. Mirrors the legacy prj.tcl include-path + source-link behavior.
-for lib in vitis_lib:
-    app.import_files(from_loc=lib, dest_dir_in_cmp='src')
-    app.append_app_config(key='USER_INCLUDE_DIRECTORIES', values=lib)
+    platform_xpfm = client.find_platform_in_repos(platform_name)
+    stamp = {'platform': platform_key}
+    save_stamp(stamp)
 
-# Optimize for size (legacy used "Optimize for size (-Os)")
-app.set_app_config(key='USER_COMPILE_OPTIMIZATION_LEVEL', values='-Os')
+if reuse_platform and stamp.get('app') == app_key and 'imported' in stamp and os.path.isdir(app_dir):
+    # Same application configuration: refresh the imported sources only.
+    # Remove just the files imported by the previous build (recorded in the
+    # stamp), src/ also holds the files generated at app creation
+    # (lscript.ld, CMakeLists.txt, UserConfig.cmake with the compile options).
+    app = client.get_component(name=app_name)
+    src_dir = os.path.join(app_dir, 'src')
+    for name in stamp['imported']:
+        path = os.path.join(src_dir, name)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        elif os.path.lexists(path):
+            os.remove(path)
+
+    app.import_files(from_loc=vitis_src, dest_dir_in_cmp='src')
+    for lib in vitis_lib:
+        app.import_files(from_loc=lib, dest_dir_in_cmp='src')
+
+    stamp['imported'] = imported_names()
+    save_stamp(stamp)
+
+else:
+    if os.path.isdir(app_dir):
+        client.delete_component(name=app_name)
+
+    # Create an empty application component on the generated platform
+    app = client.create_app_component(name=app_name, platform=platform_xpfm, domain=domain_name)
+
+    # Import the user sources into the application's src/ directory
+    app.import_files(from_loc=vitis_src, dest_dir_in_cmp='src')
+
+    # Import the library sources (e.g. surf/.../sdk/common: ssi_printf.c, printf.c) so the
+    # .c files get compiled, and add each library directory as an include path so headers
+    # resolve. Mirrors the legacy prj.tcl include-path + source-link behavior.
+    for lib in vitis_lib:
+        app.import_files(from_loc=lib, dest_dir_in_cmp='src')
+        app.append_app_config(key='USER_INCLUDE_DIRECTORIES', values=lib)
+
+    app.set_app_config(key='USER_COMPILE_OPTIMIZATION_LEVEL', values=opt_level)
+
+    stamp['app']      = app_key
+    stamp['imported'] = imported_names()
+    save_stamp(stamp)
 
 # Build the application -> produces the .ELF
 app.build()
@@ -88,5 +284,8 @@ shutil.copyfile(elf_list[0], vitis_elf)
 os.chmod(vitis_elf, 0o664)
 print(f'build.py: copied {elf_list[0]} -> {vitis_elf}')
 
+if elf_cache:
+    elf_cache_store(cache_key, vitis_elf)
+
 # Close the client connection and terminate the vitis server
 vitis.dispose()
@@ -3,6 +3,25 @@
 # Description:
 #   Script to convert the .bin file from opalkelly
 #   into a .txt file for DM160237 I2C Evaluation Kit GUI
+#
+#   Also converts arbitrary size binaries (BRAM init images, FRU EEPROMs,
+#   calibration tables) to and from memory init text formats:
+#
+#     txt  : hex bytes, 8 per line, no separators (DM160237 GUI, default)
+#     hex  : hex words, one per line ($readmemh)
+#     mem  : Vivado .mem, '@address' followed by hex words
+#     coe  : Vivado .coe, memory_initialization_vector with radix 16
+#     ihex : Intel HEX records
+#
+#   Whole blocks are formatted at once (bytes.hex, vectorized with NumPy when
+#   it is installed) and streamed to the output, so multi-MB images convert
+#   at disk speed.
+#
+#   Examples:
+#     python3 bin2txt.py --bin fru.bin --txt fru.txt
+#     python3 bin2txt.py --bin init.bin --txt init.mem --width 32 --endian little
+#     python3 bin2txt.py --bin init.bin --txt init.coe --reverse
+#     python3 bin2txt.py --bin init.bin --benchmark
 # ----------------------------------------------------------------------------
 # https://opalkelly.com/tools/fmceepromgenerator/
 # https://www.microchip.com/en-us/development-tool/DM160237
@@ -16,46 +35,439 @@
 # contained in the LICENSE.txt file.
 # ----------------------------------------------------------------------------
 
+import io
+import os
+import re
+import time
 import argparse
 
 from array import array
 
-#################################################################
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
-# Set the argument parser
-parser = argparse.ArgumentParser()
+FORMATS = ['txt', 'hex', 'mem', 'coe', 'ihex']
 
-parser.add_argument(
-    "--bin",
-    type     = str,
-    required = True,
-    help     = "path to .bin file",
-)
+# Default words per line (bytes per record for ihex)
+DEFAULT_PER_LINE = {'txt': 8, 'hex': 1, 'mem': 8, 'coe': 1, 'ihex': 16}
 
-parser.add_argument(
-    "--txt",
-    type     = str,
-    required = True,
-    help     = "path to .txt file",
-)
+# Default number of bytes converted, the DM160237 GUI expects a 256 byte EEPROM
+DEFAULT_COUNT = {'txt': 256}
 
-# Get the arguments
-args = parser.parse_args()
+# Input is read in blocks of about this many bytes (rounded to whole lines)
+BLOCK_SIZE = 1024 * 1024
 
 #################################################################
 
-if __name__ == '__main__':
+def formatFromName(path):
+    """Output format from the file extension, 'txt' if unknown"""
+    ext = os.path.splitext(path)[1].lower()
+    return {'.mem': 'mem', '.coe': 'coe', '.ihex': 'ihex', '.ihx': 'ihex'}.get(ext, 'txt')
 
-    # Load the FRU binary file into python array
-    data = array('B')
-    with open(args.bin, 'rb') as f:
-        data.fromfile(f, 256)
 
-    # Write the loaded data into a text file
-    ofd = open(args.txt, 'w')
+def _orderWords(block, wordBytes, endian):
+    """Reorder the bytes of each word so the text is written MSB first"""
+    if wordBytes == 1 or endian == 'big':
+        return block
+
+    if np is not None:
+        return np.frombuffer(block, np.uint8).reshape(-1, wordBytes)[:, ::-1].tobytes()
+
+    return b''.join([block[i:i+wordBytes][::-1] for i in range(0, len(block), wordBytes)])
+
+
+def formatLines(block, wordBytes, perLine, sep, eol, trailSep=False, endian='big'):
+    """Format a block of whole words as lines of hex text (bytes).
+
+    Each line holds perLine words separated by sep and ends with eol. With
+    trailSep the separator is also written after the last word of each line.
+    The last line may be shorter.
+    """
+    data  = _orderWords(block, wordBytes, endian)
+    hexs  = data.hex().upper().encode()
+    width = 2 * wordBytes
+    words = len(data) // wordBytes
+
+    full = words // perLine
+    rest = words - full * perLine
+    out  = []
+
+    if full and np is not None:
+        # Matrix of (lines, words, chars + separator), filled in one shot
+        src  = np.frombuffer(hexs, np.uint8, count=full * perLine * width).reshape(full, perLine, width)
+        cell = width + len(sep)
+        mat  = np.empty((full, perLine, cell), np.uint8)
+        mat[:, :, :width] = src
+        if sep:
+            mat[:, :, width:] = np.frombuffer(sep, np.uint8)
+
+        lines = mat.reshape(full, perLine * cell)
+        if sep and not trailSep:
+            lines = lines[:, :-len(sep)]
+
+        if eol:
+            lines = np.concatenate([lines, np.broadcast_to(np.frombuffer(eol, np.uint8), (full, len(eol)))], axis=1)
+
+        out.append(lines.tobytes())
+
+    elif full:
+        lineChars = perLine * width
+        for i in range(full):
+            line = hexs[i * lineChars:(i + 1) * lineChars]
+            out.append(sep.join([line[j:j+width] for j in range(0, lineChars, width)]) + (sep if trailSep else b'') + eol)
+
+    if rest:
+        line = hexs[full * perLine * width:]
+        out.append(sep.join([line[j:j+width] for j in range(0, rest * width, width)]) + (sep if trailSep else b'') + eol)
+
+    return b''.join(out)
+
+
+def _ihexRecord(rtype, addr, data):
+    rec = bytes([len(data), (addr >> 8) & 0xFF, addr & 0xFF, rtype]) + data
+    return b':' + (rec + bytes([(-sum(rec)) & 0xFF])).hex().upper().encode() + b'\n'
+
+
+def _ihexLines(block, addr, perLine):
+    """Intel HEX data records, with extended linear address records on 64 kB boundaries"""
+    out = []
+    pos = 0
+
+    while pos < len(block):
+        if (pos == 0 and addr > 0xFFFF) or (addr & 0xFFFF) == 0 and addr > 0:
+            out.append(_ihexRecord(0x04, 0, bytes([(addr >> 24) & 0xFF, (addr >> 16) & 0xFF])))
+
+        # Records do not cross a 64 kB boundary
+        n = min(perLine, len(block) - pos, 0x10000 - (addr & 0xFFFF))
+        out.append(_ihexRecord(0x00, addr & 0xFFFF, block[pos:pos+n]))
+        pos  += n
+        addr += n
+
+    return b''.join(out)
+
+
+def binToText(fin, fout, fmt='txt', width=8, endian='big', perLine=None, count=None, base=0):
+    """Stream binary data from fin to memory init text on fout.
+
+    width is the word width in bits (multiple of 8), base the start address
+    (in words for mem, in bytes for ihex). Returns the number of bytes converted.
+    """
+    if width % 8 != 0 or width <= 0:
+        raise ValueError(f"Word width must be a multiple of 8 bits: {width}")
+
+    wordBytes = width // 8 if fmt != 'ihex' else 1
+    perLine   = perLine if perLine else DEFAULT_PER_LINE[fmt]
+    lineBytes = wordBytes * perLine
+    blockSize = max(1, BLOCK_SIZE // lineBytes) * lineBytes
+    total     = 0
+    addr      = base
+    tail      = b''
+
+    if fmt == 'mem':
+        fout.write(f'@{base:08X}\n'.encode())
+    elif fmt == 'coe':
+        fout.write(b'memory_initialization_radix=16;\nmemory_initialization_vector=\n')
+
+    sep, eol, trailSep = {'txt':  (b'',  b'\n', False),
+                          'hex':  (b' ', b'\n', False),
+                          'mem':  (b' ', b'\n', False),
+                          'coe':  (b',', b'\n', True)}.get(fmt, (b'', b'', False))
+
+    last = None
+
+    while count is None or total < count:
+        size  = blockSize if count is None else min(blockSize, count - total)
+        block = fin.read(size)
+        if not block:
+            break
+
+        total += len(block)
+        block  = tail + block
+
+        # Keep a partial word for the next block
+        cut   = len(block) - (len(block) % wordBytes)
+        tail  = block[cut:]
+        block = block[:cut]
+
+        if fmt == 'ihex':
+            fout.write(_ihexLines(block, addr, perLine))
+            addr += len(block)
+
+        elif fmt == 'coe':
+            # The last ',' of the vector is replaced by ';' once the end is known
+            if last is not None:
+                fout.write(last)
+            last = formatLines(block, wordBytes, perLine, sep, eol, trailSep, endian)
+
+        else:
+            fout.write(formatLines(block, wordBytes, perLine, sep, eol, trailSep, endian))
+
+    if tail:
+        # Zero pad the last partial word
+        pad   = bytes(wordBytes - len(tail))
+        block = tail + pad
+        if fmt == 'coe':
+            if last is not None:
+                fout.write(last)
+            last = formatLines(block, wordBytes, 1, sep, eol, trailSep, endian)
+        else:
+            fout.write(formatLines(block, wordBytes, 1, sep, eol, trailSep, endian))
+
+    if fmt == 'coe':
+        if last:
+            fout.write(last[:-len(sep + eol)] + b';' + eol)
+        else:
+            fout.write(b';\n')
+
+    elif fmt == 'ihex':
+        fout.write(_ihexRecord(0x01, 0, b''))
+
+    return total
+
+
+def _parseIhex(fin, fout):
+    data = {}
+    upper = 0
+
+    for num, line in enumerate(fin, 1):
+        line = line.strip()
+        if not line:
+            continue
+
+        if not line.startswith(b':'):
+            raise ValueError(f"Line {num}: not an Intel HEX record")
+
+        rec = bytes.fromhex(line[1:].decode())
+        if sum(rec) & 0xFF != 0:
+            raise ValueError(f"Line {num}: bad checksum")
+
+        n, addr, rtype = rec[0], (rec[1] << 8) | rec[2], rec[3]
+        payload = rec[4:4+n]
+
+        if rtype == 0x00:
+            data[upper + addr] = payload
+        elif rtype == 0x01:
+            break
+        elif rtype == 0x02:
+            upper = int.from_bytes(payload, 'big') << 4
+        elif rtype == 0x04:
+            upper = int.from_bytes(payload, 'big') << 16
+
+    # Gaps are filled with zeros, the image starts at the lowest address
+    pos   = min(data) if data else 0
+    total = 0
+
+    for addr in sorted(data):
+        if addr > pos:
+            fout.write(bytes(addr - pos))
+            total += addr - pos
+        fout.write(data[addr])
+        total += len(data[addr])
+        pos = addr + len(data[addr])
+
+    return total
+
+
+def textToBin(fin, fout, fmt='txt', width=8, endian='big'):
+    """Convert memory init text from fin back to binary on fout (both binary files)"""
+    if fmt == 'ihex':
+        return _parseIhex(fin, fout)
+
+    wordBytes = width // 8
+    text = fin.read().decode()
+    total = 0
+
+    if fmt == 'coe':
+        radix = re.search(r'memory_initialization_radix\s*=\s*(\d+)', text, re.I)
+        radix = int(radix.group(1)) if radix else 16
+        text  = re.split(r'memory_initialization_vector\s*=', text, flags=re.I)[-1]
+        text  = text.split(';')[0]
+        words = [w for w in re.split(r'[\s,]+', text) if w]
+
+        if radix != 16:
+            words = [f'{int(w, radix):0{2*wordBytes}X}' for w in words]
+
+        chunks = [(None, words)]
+
+    else:
+        # Strip the comments, '@address' lines start a new chunk
+        text   = re.sub(r'//[^\n]*|#[^\n]*', '', text)
+        chunks = [(None, [])]
+
+        for tok in text.split():
+            if tok.startswith('@'):
+                chunks.append((int(tok[1:], 16), []))
+            elif fmt == 'txt':
+                # Byte stream, lines have no separators
+                chunks[-1][1].extend([tok[i:i+2*wordBytes] for i in range(0, len(tok), 2 * wordBytes)])
+            else:
+                chunks[-1][1].append(tok)
+
+    pos = None
+
+    for addr, words in chunks:
+        if addr is not None:
+            if pos is not None and addr > pos:
+                fout.write(bytes((addr - pos) * wordBytes))
+                total += (addr - pos) * wordBytes
+            pos = addr
+
+        if not words:
+            continue
+
+        data = bytes.fromhex(''.join([w.zfill(2 * wordBytes) for w in words]))
+        data = _orderWords(data, wordBytes, endian)
+
+        fout.write(data)
+        total += len(data)
+        pos = (pos or 0) + len(words)
+
+    return total
+
+
+def legacyBinToTxt(data, ofd):
+    """The original per-byte loop, kept for the benchmark"""
     for i in range(len(data)):
         byte = hex(data[i]).upper()[2:].zfill(2)
         ofd.write(byte)
         if (i%8==7):
             ofd.write('\n')
-    ofd.close()
+
+
+def benchmark(path, count=None):
+    with open(path, 'rb') as f:
+        raw = f.read() if count is None else f.read(count)
+
+    # Whole lines only, the original loop does not end a partial last line
+    raw = raw[:len(raw) - len(raw) % 8]
+
+    data = array('B')
+    data.frombytes(raw)
+
+    start = time.monotonic()
+    ofd = io.StringIO()
+    legacyBinToTxt(data, ofd)
+    tOld = time.monotonic() - start
+
+    start = time.monotonic()
+    out = io.BytesIO()
+    binToText(io.BytesIO(raw), out, 'txt', count=len(raw))
+    tNew = time.monotonic() - start
+
+    same = ofd.getvalue().encode() == out.getvalue()
+
+    print(f"{len(raw)} bytes, numpy {'enabled' if np is not None else 'not installed'}")
+    print(f"  per-byte loop : {tOld:.4f} s ({len(raw)/1e6/max(tOld,1e-9):.1f} MB/s)")
+    print(f"  block format  : {tNew:.4f} s ({len(raw)/1e6/max(tNew,1e-9):.1f} MB/s), {tOld/max(tNew,1e-9):.1f}x faster")
+    print(f"  identical     : {same}")
+
+#################################################################
+
+if __name__ == '__main__':
+
+    # Set the argument parser
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--bin",
+        type     = str,
+        required = True,
+        help     = "path to .bin file",
+    )
+
+    parser.add_argument(
+        "--txt",
+        type     = str,
+        required = False,
+        default  = None,
+        help     = "path to .txt file (or .mem, .coe, .ihex)",
+    )
+
+    parser.add_argument(
+        "--format",
+        type     = str,
+        required = False,
+        default  = None,
+        choices  = FORMATS,
+        help     = "text format (default: from the --txt extension, txt otherwise)",
+    )
+
+    parser.add_argument(
+        "--width",
+        type     = int,
+        required = False,
+        default  = 8,
+        help     = "word width in bits",
+    )
+
+    parser.add_argument(
+        "--endian",
+        type     = str,
+        required = False,
+        default  = 'big',
+        choices  = ['big', 'little'],
+        help     = "byte order of the words in the .bin file",
+    )
+
+    parser.add_argument(
+        "--perLine",
+        type     = int,
+        required = False,
+        default  = None,
+        help     = f"words per line, bytes per record for ihex (default: {DEFAULT_PER_LINE})",
+    )
+
+    parser.add_argument(
+        "--count",
+        type     = int,
+        required = False,
+        default  = None,
+        help     = "number of bytes to convert (default: 256 for txt, the whole file otherwise)",
+    )
+
+    parser.add_argument(
+        "--base",
+        type     = lambda x: int(x, 0),
+        required = False,
+        default  = 0,
+        help     = "start address (words for mem, bytes for ihex)",
+    )
+
+    parser.add_argument(
+        "--reverse",
+        action   = 'store_true',
+        default  = False,
+        help     = "convert the text file back to a .bin file",
+    )
+
+    parser.add_argument(
+        "--benchmark",
+        action   = 'store_true',
+        default  = False,
+        help     = "compare against the original per-byte loop on the .bin file",
+    )
+
+    # Get the arguments
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.bin, args.count)
+
+    else:
+        if args.txt is None:
+            parser.error("--txt is required")
+
+        fmt = args.format if args.format is not None else formatFromName(args.txt)
+
+        if args.reverse:
+            with open(args.txt, 'rb') as fin, open(args.bin, 'wb') as fout:
+                textToBin(fin, fout, fmt, args.width, args.endian)
+
+        else:
+            count = args.count if args.count is not None else DEFAULT_COUNT.get(fmt)
+
+            # Write the loaded data into a text file
+            with open(args.bin, 'rb') as fin, open(args.txt, 'wb') as fout:
+                binToText(fin, fout, fmt, args.width, args.endian, args.perLine, count, args.base)
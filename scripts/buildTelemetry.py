@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+#-----------------------------------------------------------------------------
+# Title      : Vivado build telemetry
+# ----------------------------------------------------------------------------
+# This file is part of the 'SLAC Firmware Standard Library'. It is subject to
+# the license terms in the LICENSE.txt file found in the top-level directory
+# of this distribution and at:
+#    https://confluence.slac.stanford.edu/display/ppareg/LICENSE.html.
+# No part of the 'SLAC Firmware Standard Library', including this file, may be
+# copied, modified, propagated, or distributed except according to the terms
+# contained in the LICENSE.txt file.
+# ----------------------------------------------------------------------------
+
+##
+# @file buildTelemetry.py
+# Record the step times and memory of Vivado builds in a SQLite database.
+#
+# 'collect' runs after vivado/build.tcl (system_vivado.mk). It streams the
+# runme.log of every run under $(OUT_DIR)/$(VIVADO_PROJECT).runs (synth_1,
+# impl_1 and the IP sub-runs), and stores each
+# "<command>: Time (s): cpu = ... ; elapsed = ... . Memory (MB): peak = ..."
+# line as a step of the build, keyed by PROJECT and labelled with IMAGENAME,
+# GIT_HASH_SHORT, VIVADO_VERSION and host. Logs are identified by their
+# content hash, so a run that was up to date (i.e. synth_1 of an
+# implementation-only rebuild) is not counted twice.
+#
+# 'report' prints the history of the main steps of synth_1 and impl_1 (plus
+# the total of the IP sub-runs) per project and flags the builds where a step
+# took longer than --threshold times the median of the previous --window
+# builds of the same project. IMAGENAME embeds the build time and the git
+# hash, so it only labels the builds.
+#
+#   python3 buildTelemetry.py report --project MyProject --last 10
+
+import os
+import re
+import sys
+import glob
+import socket
+import hashlib
+import sqlite3
+import argparse
+import datetime
+import statistics
+
+DEFAULT_DB = os.environ.get('BUILD_TELEMETRY_DB', os.path.join(os.path.expanduser('~'), '.cache', 'ruckus', 'build_telemetry.sqlite'))
+
+# Steps shown by the report, in flow order. 'ip' is the total of the IP sub-runs.
+REPORT_STEPS = ['ip', 'synth_design', 'opt_design', 'place_design', 'phys_opt_design', 'route_design', 'write_bitstream']
+
+MAIN_RUNS = ('synth_1', 'impl_1')
+
+# "route_design: Time (s): cpu = 00:12:34 ; elapsed = 00:05:06 . Memory (MB): peak = 4321.098 ; gain = 123.456 ; ..."
+STEP_RE = re.compile(r'^(\w+): Time \(s\): cpu = ([\d:]+) ; elapsed = ([\d:]+) \. Memory \(MB\): peak = ([\d.]+)(?: ; gain = (-?[\d.]+))?')
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS builds ('
+    'id INTEGER PRIMARY KEY, imagename TEXT NOT NULL, git_hash TEXT, vivado_version TEXT, host TEXT, '
+    'project TEXT, status INTEGER, created TEXT NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS steps ('
+    'build_id INTEGER NOT NULL REFERENCES builds(id), run TEXT NOT NULL, seq INTEGER NOT NULL, '
+    'step TEXT NOT NULL, cpu REAL, elapsed REAL, peak_mb REAL, gain_mb REAL, log_sha256 TEXT NOT NULL, '
+    'UNIQUE (log_sha256, seq))',
+    'CREATE INDEX IF NOT EXISTS builds_project ON builds (project, created)',
+]
+
+
+def hms(text):
+    """Seconds of a HH:MM:SS time (hours can exceed 24)"""
+    sec = 0
+    for part in text.split(':'):
+        sec = sec * 60 + int(part)
+    return float(sec)
+
+
+def parseLog(path):
+    """Stream a Vivado log, returns (sha256 of the log, [(step, cpu, elapsed, peakMb, gainMb)])"""
+    h     = hashlib.sha256()
+    steps = []
+
+    with open(path, 'rb') as f:
+        for raw in f:
+            h.update(raw)
+
+            # Cheap test before the regex, most lines are not step summaries
+            if b': Time (s): cpu' not in raw:
+                continue
+
+            m = STEP_RE.match(raw.decode('utf-8', 'replace'))
+            if m is not None:
+                steps.append((m.group(1), hms(m.group(2)), hms(m.group(3)), float(m.group(4)),
+                              float(m.group(5)) if m.group(5) is not None else None))
+
+    return h.hexdigest(), steps
+
+
+def findLogs(outDir, project):
+    """[(run name, log path)] of the Vivado runs of a build directory"""
+    logs = []
+    for path in sorted(glob.glob(os.path.join(outDir, f'{project}.runs', '*', 'runme.log'))):
+        logs.append((os.path.basename(os.path.dirname(path)), path))
+    return logs
+
+
+def connect(path):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    db = sqlite3.connect(path, timeout=30)
+    for stmt in SCHEMA:
+        db.execute(stmt)
+    db.commit()
+    return db
+
+
+def collect(db, outDir, vivadoProject, key, status=None):
+    """Record the steps of the logs of vivadoProject under outDir as a new build, returns (build id, new steps)"""
+    cur = db.execute('INSERT INTO builds (imagename, git_hash, vivado_version, host, project, status, created) '
+                     'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                     (key['imagename'], key['git_hash'], key['vivado_version'], key['host'], key['project'], status,
+                      datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')))
+    buildId = cur.lastrowid
+    nSteps  = 0
+
+    for run, path in findLogs(outDir, vivadoProject):
+        try:
+            sha, steps = parseLog(path)
+        except OSError as e:
+            print(f'buildTelemetry: skipping {path}: {e}')
+            continue
+
+        for seq, (step, cpu, elapsed, peak, gain) in enumerate(steps):
+            cur = db.execute('INSERT OR IGNORE INTO steps (build_id, run, seq, step, cpu, elapsed, peak_mb, gain_mb, log_sha256) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                             (buildId, run, seq, step, cpu, elapsed, peak, gain, sha))
+            nSteps += cur.rowcount
+
+    # Nothing ran (all the logs were recorded before)
+    if nSteps == 0:
+        db.execute('DELETE FROM builds WHERE id = ?', (buildId,))
+
+    db.commit()
+    return buildId, nSteps
+
+
+def buildSteps(db, buildId):
+    """{step: (elapsed, cpu, peak)} of the main runs of a build, the IP sub-runs are summed as 'ip'"""
+    rows = db.execute('SELECT CASE WHEN run IN (?, ?) THEN step ELSE \'ip\' END AS name, '
+                      'SUM(elapsed), SUM(cpu), MAX(peak_mb) FROM steps WHERE build_id = ? GROUP BY name',
+                      MAIN_RUNS + (buildId,)).fetchall()
+    return {r[0]: (r[1], r[2], r[3]) for r in rows}
+
+
+def fmtTime(sec):
+    if sec is None:
+        return '-'
+    return f'{int(sec) // 3600}:{int(sec) % 3600 // 60:02d}:{int(sec) % 60:02d}'
+
+
+def report(db, project=None, last=10, window=5, threshold=1.25):
+    """Print the step history per project, returns the list of regressions"""
+    if project is not None:
+        projects = [project]
+    else:
+        projects = [r[0] for r in db.execute('SELECT DISTINCT project FROM builds ORDER BY project')]
+
+    regressions = []
+
+    for prj in projects:
+        builds = db.execute('SELECT id, created, git_hash, vivado_version, host, status, imagename FROM builds '
+                            'WHERE project = ? ORDER BY created, id', (prj,)).fetchall()
+
+        # Builds that ran no step (all logs already recorded) carry no timing
+        history = []
+        for b in builds:
+            steps = buildSteps(db, b[0])
+            if steps:
+                history.append((b, steps))
+
+        if not history:
+            continue
+
+        print(f'\n{prj}')
+        print(f'   {"Date":20} {"Git":9} {"Vivado":8} {"Host":12} '
+              + ' '.join([f'{s.replace("_design", "").replace("write_", ""):>10}' for s in REPORT_STEPS]) + f' {"Total":>10} {"Peak MB":>9}  Image')
+
+        for i, (b, steps) in enumerate(history):
+            cols  = []
+            flags = []
+
+            for s in REPORT_STEPS:
+                elapsed = steps.get(s, (None,))[0]
+                prev    = [h[1][s][0] for h in history[max(0, i-window):i] if s in h[1]]
+                mark    = ' '
+
+                # Regression against the median of the previous builds
+                if elapsed is not None and prev and elapsed > threshold * statistics.median(prev):
+                    mark = '!'
+                    flags.append((s, elapsed, statistics.median(prev)))
+
+                cols.append(f'{fmtTime(elapsed):>9}{mark}')
+
+            total = sum([v[0] for v in steps.values() if v[0] is not None])
+            peak  = max([v[2] for v in steps.values() if v[2] is not None] or [0])
+
+            if i >= len(history) - last:
+                print(f'   {b[1][:19]:20} {str(b[2] or "-")[:9]:9} {str(b[3] or "-"):8} {str(b[4] or "-")[:12]:12} '
+                      + ' '.join(cols) + f' {fmtTime(total):>10} {peak:9.0f}  {b[6]}'
+                      + ('' if not b[5] else f'  (exit {b[5]})'))
+
+                for s, elapsed, median in flags:
+                    regressions.append((prj, b[1], b[2], s, elapsed, median))
+
+    if regressions:
+        print(f'\nRegressions (elapsed > {threshold:g} x median of the previous {window} builds):')
+        for prj, created, git, step, elapsed, median in regressions:
+            print(f'   {prj} {created[:19]} {git}: {step} {fmtTime(elapsed)} vs {fmtTime(median)} (+{100.0 * (elapsed / median - 1):.0f}%)')
+
+    return regressions
+
+
+if __name__ == "__main__":
+
+    # Set the argument parser
+    parser = argparse.ArgumentParser('Build Telemetry')
+
+    parser.add_argument(
+        "command",
+        choices  = ['collect', 'report'],
+        help     = "collect: record the logs of the build directory; report: show the history"
+    )
+
+    parser.add_argument(
+        "--db",
+        type     = str,
+        required = False,
+        default  = DEFAULT_DB,
+        help     = "SQLite database (default: $BUILD_TELEMETRY_DB or ~/.cache/ruckus/build_telemetry.sqlite)"
+    )
+
+    parser.add_argument(
+        "--out_dir",
+        type     = str,
+        required = False,
+        default  = os.getenv('OUT_DIR', os.getcwd()),
+        help     = "collect: build directory (default: $OUT_DIR)"
+    )
+
+    parser.add_argument(
+        "--status",
+        type     = int,
+        required = False,
+        default  = None,
+        help     = "collect: exit code of the Vivado build"
+    )
+
+    parser.add_argument(
+        "--project",
+        type     = str,
+        required = False,
+        default  = None,
+        help     = "report: only this PROJECT (default: all)"
+    )
+
+    parser.add_argument(
+        "--last",
+        type     = int,
+        required = False,
+        default  = 10,
+        help     = "report: number of builds shown per project"
+    )
+
+    parser.add_argument(
+        "--window",
+        type     = int,
+        required = False,
+        default  = 5,
+        help     = "report: number of previous builds of the regression baseline"
+    )
+
+    parser.add_argument(
+        "--threshold",
+        type     = float,
+        required = False,
+        default  = 1.25,
+        help     = "report: flag a step slower than this factor times the baseline median"
+    )
+
+    parser.add_argument(
+        "--fail",
+        action   = 'store_true',
+        default  = False,
+        help     = "report: exit with an error if a regression is flagged"
+    )
+
+    args = parser.parse_args()
+
+    db = connect(args.db)
+
+    if args.command == 'collect':
+        project = os.getenv('PROJECT', os.path.basename(os.path.abspath(args.out_dir)))
+        key = {
+            'project'        : project,
+            'imagename'      : os.getenv('IMAGENAME', project),
+            'git_hash'       : os.getenv('GIT_HASH_SHORT'),
+            'vivado_version' : os.getenv('VIVADO_VERSION'),
+            'host'           : socket.gethostname(),
+        }
+
+        buildId, nSteps = collect(db, args.out_dir, os.getenv('VIVADO_PROJECT', f'{project}_project'), key, args.status)
+        print(f'buildTelemetry: recorded {nSteps} steps of {key["imagename"]} in {args.db}')
+
+    else:
+        regressions = report(db, args.project, args.last, args.window, args.threshold)
+        if args.fail and regressions:
+            sys.exit(1)
+
+    db.close()
@@ -12,11 +12,17 @@
 # ----------------------------------------------------------------------------
 
 import os
-import argparse
 import time
+import argparse
+import threading
+import subprocess
+from concurrent.futures import Future, ThreadPoolExecutor
 
+import yaml
 import github # PyGithub
 
+import githubClient
+
 #############################################################################################
 
 # Convert str to bool
@@ -30,10 +36,27 @@ parser = argparse.ArgumentParser('Create New Project')
 parser.add_argument(
     '--name',
     type     = str,
-    required = True,
+    required = False,
+    default  = None,
     help     = 'New Repo name for https://github.com/ (example: slaclab/my-new-project)',
 )
 
+parser.add_argument(
+    '--manifest',
+    type     = str,
+    required = False,
+    default  = None,
+    help     = 'YAML file listing the repos to create (bulk mode, instead of --name)',
+)
+
+parser.add_argument(
+    '--jobs',
+    type     = int,
+    required = False,
+    default  = 4,
+    help     = 'Number of repos created concurrently in bulk mode (default: 4)',
+)
+
 parser.add_argument(
     '--token',
     type     = str,
@@ -133,6 +156,9 @@ parser.add_argument(
 # Get the arguments
 args = parser.parse_args()
 
+if (args.name is None) == (args.manifest is None):
+    parser.error('Exactly one of --name or --manifest is required')
+
 #############################################################################################
 
 def githubLogin():
@@ -173,31 +199,84 @@ def githubLogin():
             print('Using github token from user\'s environment.\n')
 
     # Now that you have a token, log into Github
-    gh = github.Github(token)
+    gh = githubClient.connect(token)
 
     # Return the github login object
     return gh
 
 #############################################################################################
 
-def createNewRepo(gh):
+# Organizations, teams, submodule heads and the login are looked up once and
+# shared by every permission entry and every repo of a manifest. The lock only
+# guards the table of futures: the network calls run outside of it, so lookups
+# of different keys proceed in parallel and those of one key wait for the first.
+class GithubCache(object):
+
+    def __init__(self, gh):
+        self.gh       = gh
+        self._entries = {}
+        self._lock    = threading.Lock()
+
+    def _get(self, key, fetch):
+        with self._lock:
+            fut   = self._entries.get(key)
+            owner = fut is None
+            if owner:
+                fut = self._entries[key] = Future()
+
+        if owner:
+            try:
+                fut.set_result(fetch())
+            except Exception as e:
+                # Not cached: a later lookup retries
+                with self._lock:
+                    del self._entries[key]
+                fut.set_exception(e)
+
+        return fut.result()
+
+    def login(self):
+        return self._get(('login',), lambda: self.gh.get_user().login)
+
+    def org(self, orgName):
+        return self._get(('org', orgName), lambda: self.gh.get_organization(orgName))
+
+    def team(self, orgName, teamName):
+        return self._get(('team', orgName, teamName), lambda: self.org(orgName).get_team_by_slug(teamName))
+
+    def head(self, url):
+        return self._get(('head', url), lambda: submoduleHead(self.gh, url))
+
+#############################################################################################
+
+# Team entries are [org,team_name] pairs, or 'org/team_name' strings from the command line
+def teamSpec(entry):
+    if isinstance(entry, str):
+        entry = entry.replace(',', '/').split('/')
+    if len(entry) != 2:
+        raise ValueError(f'Invalid team entry {entry}: expected [org,team_name] or org/team_name')
+    return entry
+
+#############################################################################################
+
+def createNewRepo(cache, cfg):
 
     # Check if creating repo in user's workspace
-    if args.userRepo:
+    if cfg.userRepo:
 
         # Get the user works space
-        workspace = gh.get_user()
+        workspace = cache.gh.get_user()
 
     # Else creating repo in organization space
     else:
 
         # Get the organization
-        workspace = gh.get_organization(args.org)
+        workspace = cache.org(cfg.org)
 
     # Create the repo in the workspace
     repo = workspace.create_repo(
-        name      = args.name,
-        private   = args.private,
+        name      = cfg.name,
+        private   = cfg.private,
         auto_init = True,
     )
 
@@ -209,13 +288,13 @@ def createNewRepo(gh):
 
 #############################################################################################
 
-def setPermissions(gh,repo):
+def setPermissions(cache, repo, cfg):
 
     # Inform the user that you are logging in
-    print('Setting Git repo permissions...')
+    print(f'Setting Git repo permissions of {repo.full_name}...')
 
     # Always set the current user who created the repo as admin
-    currentUser = gh.get_user().login
+    currentUser = cache.login()
     print( f'Current User Admin Permission: {currentUser}' )
     repo.add_to_collaborators(
         collaborator = currentUser,
@@ -226,60 +305,29 @@ def setPermissions(gh,repo):
     ## Adding User Permissions
     ##########################
 
-    # Check for list of users with admin permissions
-    if args.adminUser is not None:
-        for user in args.adminUser:
-            print( f'User Admin Permission: {user}' )
-            repo.add_to_collaborators(
-                collaborator = user,
-                permission   = 'admin',
-            )
-
-    # Check for list of users with write permissions
-    if args.writeUser is not None:
-        for user in args.writeUser:
-            print( f'User Write Permission: {user}' )
-            repo.add_to_collaborators(
-                collaborator = user,
-                permission   = 'push',
-            )
-
-    # Check for list of users with read permissions
-    if args.readUser is not None:
-        for user in args.readUser:
-            print( f'User Read Permission: {user}' )
-            repo.add_to_collaborators(
-                collaborator = user,
-                permission   = 'pull',
-            )
+    for users, permission, label in [(cfg.adminUser, 'admin', 'Admin'),
+                                     (cfg.writeUser, 'push',  'Write'),
+                                     (cfg.readUser,  'pull',  'Read')]:
+        if users is not None:
+            for user in users:
+                print( f'User {label} Permission: {user}' )
+                repo.add_to_collaborators(
+                    collaborator = user,
+                    permission   = permission,
+                )
 
     ##########################
     ## Adding Team Permissions
     ##########################
 
-    # Check for list of teams with admin permissions
-    if args.adminTeam is not None:
-        for [orgName, teamName] in args.adminTeam:
-            print( f'Team Admin Permission: {orgName}/{teamName}' )
-            org = gh.get_organization(orgName)
-            team = org.get_team_by_slug(teamName)
-            updateTeamRepository(team, repo, 'admin')
-
-    # Check for list of teams with write permissions
-    if args.writeTeam is not None:
-        for [orgName, teamName] in args.writeTeam:
-            print( f'Team Write Permission: {orgName}/{teamName}' )
-            org = gh.get_organization(orgName)
-            team = org.get_team_by_slug(teamName)
-            updateTeamRepository(team, repo, 'push')
-
-    # Check for list of teams with read permissions
-    if args.readTeam is not None:
-        for [orgName, teamName] in args.readTeam:
-            print( f'Team Read Permission: {orgName}/{teamName}' )
-            org = gh.get_organization(orgName)
-            team = org.get_team_by_slug(teamName)
-            updateTeamRepository(team, repo, 'pull')
+    for teams, permission, label in [(cfg.adminTeam, 'admin', 'Admin'),
+                                     (cfg.writeTeam, 'push',  'Write'),
+                                     (cfg.readTeam,  'pull',  'Read')]:
+        if teams is not None:
+            for entry in teams:
+                orgName, teamName = teamSpec(entry)
+                print( f'Team {label} Permission: {orgName}/{teamName}' )
+                updateTeamRepository(cache.team(orgName, teamName), repo, permission)
 
     print('\n')
 
@@ -294,57 +342,78 @@ def updateTeamRepository(team, repo, permission):
 
 #############################################################################################
 
-def setupNewRepoStructure(repo):
+# Commit SHA of the default branch of a submodule URL
+def submoduleHead(gh, url):
 
-    # Setting up the new Github repo's file structure and submodules
-    print('Setting up the new Github repo\'s file structure and submodules...')
+    # GitHub URLs are resolved through the API
+    for prefix in ['https://github.com/', 'git@github.com:']:
+        if url.startswith(prefix):
+            fullName = url[len(prefix):]
+            if fullName.endswith('.git'):
+                fullName = fullName[:-4]
+            sub = gh.get_repo(fullName)
+            return sub.get_branch(sub.default_branch).commit.sha
 
-    # Get the base ruckus directory
-    baseDir = os.path.realpath(__file__).split('scripts')[0]
+    # Other hosts: ask the remote for its HEAD (no clone)
+    out = subprocess.run(['git', 'ls-remote', url, 'HEAD'], capture_output=True, text=True, check=True).stdout
+    if not out.strip():
+        raise ValueError(f'Could not resolve the HEAD of {url}')
+    return out.split()[0]
 
-    # Add the LICENSE.txt
-    repo.create_file(
-        path    = 'LICENSE.txt',
-        message = 'Adding License.txt',
-        content = open(f'{baseDir}/LICENSE.txt').read(),
-    )
+#############################################################################################
 
-    # Add the .gitignore
-    repo.create_file(
-        path    = '.gitignore',
-        message = 'Adding .gitignore',
-        content = open(f'{baseDir}/.gitignore').read(),
-    )
+# The default branch created by auto_init can take a moment to appear,
+# only wait if it is not there yet
+def getDefaultRef(repo, attempts=10):
+    for attempt in range(attempts):
+        try:
+            return repo.get_git_ref(f'heads/{repo.default_branch}')
+        except github.GithubException:
+            if attempt == attempts-1:
+                raise
+            time.sleep(0.5 * (attempt+1))
 
-    # Add the .gitattributes
-    repo.create_file(
-        path    = '.gitattributes',
-        message = 'Adding .gitattributes',
-        content = open(f'{baseDir}/.gitattributes').read(),
-    )
+#############################################################################################
 
-    # Add the .flake8
-    repo.create_file(
-        path    = '.flake8',
-        message = 'Adding .flake8',
-        content = open(f'{baseDir}/.flake8').read(),
-    )
+def setupNewRepoStructure(cache, repo, cfg):
 
-    # Check if submodule path(s) exist
-    if args.submodules is not None:
-
-        #####################################################
-        # I couldn't find a python API for submodules ...
-        # so I am going to do this step using an actual clone
-        # A.K.A. "brute force method"
-        #####################################################
-        time.sleep(10)
-        os.system(f'git clone --recursive https://github.com/{repo.full_name}')
-        os.system(f'cd {args.name}; mkdir firmware; cd firmware; mkdir submodules; git pull')
-        for submodule in args.submodules:
-            os.system(f'cd {args.name}/firmware/submodules; git submodule add {submodule}')
-        os.system(f'cd {args.name}; git commit -m \"adding submdoules\"; git push')
-        os.system(f'rm -rf {args.name}')
+    # Setting up the new Github repo's file structure and submodules
+    print(f'Setting up the file structure and submodules of {repo.full_name}...')
+
+    # Get the base ruckus directory
+    baseDir = os.path.realpath(__file__).split('scripts')[0]
+
+    # Files copied from ruckus
+    tree = []
+    for fileName in ['LICENSE.txt', '.gitignore', '.gitattributes', '.flake8']:
+        with open(f'{baseDir}/{fileName}') as f:
+            tree.append(github.InputGitTreeElement(path=fileName, mode='100644', type='blob', content=f.read()))
+
+    # Submodules are gitlinks to the current head of each submodule, plus their .gitmodules entries
+    if cfg.submodules:
+        gitmodules = ''
+        for url in cfg.submodules:
+            name = os.path.basename(url.rstrip('/'))
+            if name.endswith('.git'):
+                name = name[:-4]
+            path = f'firmware/submodules/{name}'
+            sha  = cache.head(url)
+
+            print(f'Submodule {path} -> {url} ({sha[:8]})')
+            tree.append(github.InputGitTreeElement(path=path, mode='160000', type='commit', sha=sha))
+            gitmodules += f'[submodule "{path}"]\n\tpath = {path}\n\turl = {url}\n'
+
+        tree.append(github.InputGitTreeElement(path='.gitmodules', mode='100644', type='blob', content=gitmodules))
+
+    # One commit on top of the initial commit (README.md) created with the repo
+    ref    = getDefaultRef(repo)
+    parent = repo.get_git_commit(ref.object.sha)
+    commit = repo.create_git_commit(
+        message = 'Adding LICENSE.txt, .gitignore, .gitattributes, .flake8 and submodules',
+        tree    = repo.create_git_tree(tree, base_tree=parent.tree),
+        parents = [parent],
+    )
+    ref.edit(sha=commit.sha)
 
     print('\n')
 
@@ -352,25 +421,22 @@ def setupNewRepoStructure(repo):
 
 def setBranchProtection(repo):
     # Creating Setting Branch Protection for main
-    print('Creating Setting Branch Protection for main...\n')
+    print(f'Creating Setting Branch Protection for {repo.full_name} main...\n')
     for idx in ['main']:
         repo.get_branch(idx).edit_protection()
 
 #############################################################################################
 
-if __name__ == '__main__':
-
-    # Log into Github
-    gh   = githubLogin()
+def provision(cache, cfg):
 
     # Create a new Github repo
-    repo = createNewRepo(gh)
+    repo = createNewRepo(cache, cfg)
 
     # Set the User/Team permissions
-    setPermissions(gh,repo)
+    setPermissions(cache, repo, cfg)
 
     # Setup the new repo's structure
-    setupNewRepoStructure(repo)
+    setupNewRepoStructure(cache, repo, cfg)
 
     # Set the branch protections
     setBranchProtection(repo)
@@ -383,4 +449,68 @@ if __name__ == '__main__':
         draft   =False,
     )
 
+    return repo
+
+#############################################################################################
+
+# Repo settings of the manifest: the command line arguments, overridden by the
+# manifest 'defaults' and then by each 'repos' entry. Entries may be a name string.
+#
+#   defaults:
+#     private: true
+#     writeTeam: [[slaclab, tid-id-es]]
+#   repos:
+#     - my-new-project
+#     - name: other-project
+#       submodules: [https://github.com/slaclab/ruckus.git]
+def loadManifest(path):
+    with open(path) as f:
+        manifest = yaml.safe_load(f) or {}
+
+    base = dict(vars(args))
+    base.update(manifest.get('defaults') or {})
+
+    ret = []
+    for entry in manifest.get('repos') or []:
+        cfg = dict(base)
+        cfg.update({'name': entry} if isinstance(entry, str) else entry)
+
+        if not cfg.get('name'):
+            raise ValueError(f'{path}: repo entry without a name: {entry}')
+
+        ret.append(argparse.Namespace(**cfg))
+
+    return ret
+
+#############################################################################################
+
+if __name__ == '__main__':
+
+    # Log into Github
+    gh    = githubLogin()
+    cache = GithubCache(gh)
+
+    # Single repo
+    if args.manifest is None:
+        provision(cache, args)
+
+    # Bulk mode
+    else:
+        configs = loadManifest(args.manifest)
+        failed  = []
+
+        print(f'Creating {len(configs)} repos, {args.jobs} at a time\n')
+
+        with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+            futs = [(cfg.name, pool.submit(provision, cache, cfg)) for cfg in configs]
+            for name, fut in futs:
+                try:
+                    fut.result()
+                except Exception as e:
+                    print(f'ERROR: {name}: {e}')
+                    failed.append(name)
+
+        if failed:
+            raise SystemExit(f'Failed to create: {", ".join(failed)}')
+
     print("Success!")
@@ -11,57 +11,128 @@
 # ----------------------------------------------------------------------------
 
 import os
-import requests
-from github import Github # PyGithub
+import time
+import fnmatch
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+import githubClient
+import releaseDownload
 
 # Set up argument parsing
 parser = argparse.ArgumentParser(description="Download assets from GitHub releases in private repositories.")
-parser.add_argument("--repo_name", type=str, required=True, help="Repository name, e.g., 'slaclab/epix-hr-m-320k'")
-parser.add_argument("--asset_name", type=str, required=True, help="Asset name to download, e.g., 'ePixHRM320k-0x01000400-20240323061941-dnajjar-ff123db.mcs'")
-parser.add_argument("--release_tag", type=str, required=True, help="Release tag, e.g., 'v1.1.4'")
+parser.add_argument("--repo_name", type=str, required=False, help="Repository name, e.g., 'slaclab/epix-hr-m-320k'")
+parser.add_argument("--asset_name", type=str, required=False, nargs='+', help="Asset names or glob patterns to download, e.g., 'ePixHRM320k-0x01000400-20240323061941-dnajjar-ff123db.mcs' or '*.mcs'")
+parser.add_argument("--release_tag", type=str, required=False, help="Release tag, e.g., 'v1.1.4'")
+parser.add_argument("--manifest", type=str, required=False, default=None, help="YAML manifest of the assets to download (list of repo, tag, assets and optional dest entries)")
+parser.add_argument("--dest", type=str, required=False, default='.', help="Destination directory")
+parser.add_argument("--parallel", type=int, required=False, default=4, help="Number of assets downloaded concurrently")
+parser.add_argument("--jobs", type=int, required=False, default=4, help="Number of parallel range segments per asset (1 for a single stream)")
+parser.add_argument("--segment_mb", type=int, required=False, default=16, help="Range segment size in MB")
+parser.add_argument("--retries", type=int, required=False, default=5, help="Number of retries per segment")
+parser.add_argument("--cache_dir", type=str, required=False, default=releaseDownload.DEFAULT_CACHE_DIR, help="Shared content-addressed asset cache, assets are copied from it into place")
+parser.add_argument("--cache_max_gb", type=float, required=False, default=releaseDownload.DEFAULT_CACHE_MAX_GB, help="Size limit of the asset cache, least recently used assets are removed first")
+parser.add_argument("--no_cache", action='store_true', default=False, help="Download directly to the destination without the asset cache")
 
 args = parser.parse_args()
 
+if args.manifest is None and (args.repo_name is None or args.asset_name is None or args.release_tag is None):
+    parser.error("--repo_name, --asset_name and --release_tag are required without --manifest")
+
 # Ensure GITHUB_TOKEN is set in your environment variables
 GITHUB_TOKEN = os.getenv('GITHUB_TOKEN')
 if GITHUB_TOKEN is None:
     raise ValueError("GITHUB_TOKEN environment variable not set.")
 
 # Initialize PyGithub with the GitHub token for authentication
-g = Github(GITHUB_TOKEN)
+g = githubClient.connect(GITHUB_TOKEN)
 
-# Use the arguments for the repository name, asset name, and release tag
-repo_name = args.repo_name
-asset_name = args.asset_name
-release_tag = args.release_tag
+# List of (repo, tag, patterns, dest) to download
+if args.manifest is not None:
+    # - repo: slaclab/epix-hr-m-320k
+    #   tag: v1.1.4
+    #   assets: ['*.mcs', 'rogue_*.zip']
+    #   dest: images
+    with open(args.manifest) as f:
+        entries = [(e['repo'], e['tag'], e['assets'] if isinstance(e['assets'], list) else [e['assets']], e.get('dest', args.dest))
+                   for e in yaml.safe_load(f)]
+else:
+    entries = [(args.repo_name, args.release_tag, args.asset_name, args.dest)]
 
-# Get the repository object
-repo = g.get_repo(repo_name)
+# Resolve the patterns against the release asset lists, one listing per release
+downloads = []
+missing   = []
+releases  = {}
+digests   = {}
 
-# Get the release by tag
-release = repo.get_release(release_tag)
+for repo_name, release_tag, patterns, dest in entries:
+    if (repo_name, release_tag) not in releases:
+        release = g.get_repo(repo_name).get_release(release_tag)
+        releases[(repo_name, release_tag)] = list(release.get_assets())
 
-# Find the correct asset by name
-asset_to_download = None
-for asset in release.get_assets():
-    if asset.name == asset_name:
-        asset_to_download = asset
-        break
+        # The release payload lists the asset digests, reading them from the
+        # asset objects would fetch every asset again
+        for a in release.raw_data.get('assets', []):
+            digests[a['id']] = a.get('digest')
 
-if asset_to_download is not None:
-    # The API provides an authenticated URL for assets in private repositories
-    asset_url = asset_to_download.url
+    assets = releases[(repo_name, release_tag)]
+
+    for pattern in patterns:
+        matches = [a for a in assets if fnmatch.fnmatchcase(a.name, pattern)]
+
+        if not matches:
+            missing.append(f'{repo_name} {release_tag} {pattern}')
+
+        for asset in matches:
+            path = os.path.join(dest, asset.name)
+            if path not in [d[1] for d in downloads]:
+                downloads.append((asset, path))
+
+for m in missing:
+    print(f"Asset not found in the release: {m}")
+
+downloader = releaseDownload.AssetDownloader(
+    token       = GITHUB_TOKEN,
+    jobs        = args.jobs,
+    segmentSize = args.segment_mb * 1024 * 1024,
+    retries     = args.retries,
+)
+
+cache = None if args.no_cache else releaseDownload.AssetCache(downloader, args.cache_dir, args.cache_max_gb)
 
-    headers = {'Authorization': f'token {GITHUB_TOKEN}', 'Accept': 'application/octet-stream'}
-    response = requests.get(asset_url, headers=headers, stream=True)
 
-    if response.status_code == 200:
-        with open(asset_name, 'wb') as file:
-            for chunk in response.iter_content(chunk_size=128):
-                file.write(chunk)
-        print(f"Downloaded {asset_name}")
+def fetch(asset, path):
+    # The API provides an authenticated URL for assets in private repositories
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    if cache is None:
+        # An interrupted download resumes from path.part
+        downloader.download(asset.url, path, asset.size)
     else:
-        print(f"Failed to download {asset_name}: {response.status_code}")
-else:
-    print("Asset not found in the release.")
+        cache.fetch(asset.url, asset.id, asset.size, str(asset.updated_at), path, digests.get(asset.id))
+
+
+start  = time.monotonic()
+failed = []
+
+with ThreadPoolExecutor(max_workers=max(1, args.parallel)) as pool:
+    futs = [(path, pool.submit(fetch, asset, path)) for asset, path in downloads]
+
+    for path, fut in futs:
+        try:
+            fut.result()
+        except releaseDownload.DownloadError as e:
+            failed.append(path)
+            print(f"Failed to download {path}: {e} (run again to resume)")
+
+nBytes = sum([a.size for a, p in downloads if p not in failed])
+hits   = 0 if cache is None else cache.hitBytes
+
+if len(downloads) > 1:
+    print(f"\n{len(downloads) - len(failed)} assets ({nBytes/1e6:.1f} MB, {hits/1e6:.1f} MB from cache) "
+          f"in {time.monotonic() - start:.1f} s, {len(failed)} failed")
+
+if failed or missing:
+    exit(1)
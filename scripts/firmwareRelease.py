@@ -18,15 +18,20 @@
 import os
 import yaml
 import argparse
-import zipfile
+import time
 import tarfile
 
 import git    # GitPython
-import github # PyGithub
 
 import re
 # from getpass import getpass
 import releaseNotes
+import releaseNotesCache
+import releasePackager
+import releaseImages
+import releaseCompress
+import releaseUpload
+import githubClient
 
 # Set the argument parser
 parser = argparse.ArgumentParser('Release Generation')
@@ -79,6 +84,75 @@ parser.add_argument(
     help     = "Token for github"
 )
 
+parser.add_argument(
+    "--jobs",
+    type     = int,
+    required = False,
+    default  = None,
+    help     = "Number of threads used to read files ahead of the archive writer (default: cpu count + 4, max 32)"
+)
+
+parser.add_argument(
+    "--cacheDir",
+    type     = str,
+    required = False,
+    default  = None,
+    help     = "Directory of the incremental packaging cache (default: .release_cache in the current directory)"
+)
+
+parser.add_argument(
+    "--noCache",
+    action   = 'store_true',
+    help     = "Add --noCache arg to rebuild the release archives from scratch and re-fetch all the release notes pull requests"
+)
+
+parser.add_argument(
+    "--compress",
+    type     = str,
+    required = False,
+    default  = 'gzip',
+    choices  = releaseCompress.METHODS,
+    help     = "Compression method of the CPSW tarball (zstd requires the zstandard package)"
+)
+
+parser.add_argument(
+    "--compressLevel",
+    type     = int,
+    required = False,
+    default  = None,
+    help     = "Compression level of the CPSW tarball (default: gzip=9, xz=6, zstd=10)"
+)
+
+parser.add_argument(
+    "--compressThreads",
+    type     = int,
+    required = False,
+    default  = None,
+    help     = "Number of compression threads (default: cpu count)"
+)
+
+parser.add_argument(
+    "--uploadJobs",
+    type     = int,
+    required = False,
+    default  = 4,
+    help     = "Number of concurrent release attachment uploads"
+)
+
+parser.add_argument(
+    "--uploadRetries",
+    type     = int,
+    required = False,
+    default  = 5,
+    help     = "Number of retries (with backoff) per release attachment upload"
+)
+
+parser.add_argument(
+    "--submoduleNotes",
+    action   = 'store_true',
+    help     = "Add --submoduleNotes arg to append the release notes of the submodules bumped since the previous tag"
+)
+
 parser.add_argument(
     "--push",
     action   = 'count',
@@ -185,9 +259,21 @@ def selectRelease(cfg):
 
     return relName, relData
 
+def getCacheDir():
+    if args.cacheDir is not None:
+        return args.cacheDir
+
+    return os.path.join(os.getcwd(),'.release_cache')
+
 def selectBuildImages(cfg, relName, relData):
     retList = []
 
+    # Image directories are parsed once and cached until their mtime changes
+    if args.noCache:
+        index = releaseImages.ImageIndex()
+    else:
+        index = releaseImages.ImageIndex(os.path.join(getCacheDir(),'images.json'))
+
     for target in relData['Targets']:
 
         if not target in cfg['Targets']:
@@ -203,27 +289,14 @@ def selectBuildImages(cfg, relName, relData):
         imageDir = os.path.join(FirmwareDir,cfg['Targets'][target]['ImageDir'])
 
         buildName = args.build
-        dirList = [f for f in os.listdir(imageDir) if os.path.isfile(os.path.join(imageDir,f))]
 
         print(f"\nFinding builds for target {target}:")
 
-        # Get a list of build names with the format:
+        # Get a sorted list of build names with the format:
         #   buildName = $(PROJECT)-$(PRJ_VERSION)-$(BUILD_TIME)-$(USER)-$(GIT_HASH_SHORT)
-        # File name will either be:
-        #   buildName.extension
-        # or
-        #   buildName_subType.extension
-        baseList = set()
-
-        for fn in dirList:
-            if target in fn:
-                fileName = fn[len(target):]
-                if '_' in fileName:
-                    baseList.add(target+fileName.split('_')[0])
-                else:
-                    baseList.add(target+fileName.split('.')[0])
-
-        sortList = sorted(baseList)
+        index.addTarget(target, imageDir)
+        sortList = index.builds(target)
+
         if not sortList:
             raise Exception(
                 f"No builds found for target {target}. "
@@ -233,13 +306,13 @@ def selectBuildImages(cfg, relName, relData):
             print(f"    {idx}: {val}")
 
         if buildName == 'latest':
-            buildName = sortList[-1]
+            buildName = index.latest(target)
             print(f"\nAuto selecting latest build: {buildName}")
 
         elif buildName is not None:
             print(f"\nUsing command line arg build: {buildName}")
 
-            if buildName not in sortList:
+            if not index.hasBuild(target, buildName):
                 raise Exception(f"Invalid command line build arg: {buildName}")
 
         else:
@@ -251,15 +324,12 @@ def selectBuildImages(cfg, relName, relData):
             else:
                 buildName = sortList[idx]
 
-        tarExp = [re.compile(f'{buildName}\.{ext}$') for ext in extensions]
-        tarExp.extend([re.compile(f'{buildName}_.\w*\.{ext}$') for ext in extensions])
-
         print(f"\nFinding images for target {target}, build {buildName}...")
-        for f in dirList:
-            for exp in tarExp:
-                if exp.match(f):
-                    print(f"    Found: {f}")
-                    retList.append(os.path.join(imageDir,f))
+        for f in index.images(target, buildName, extensions):
+            print(f"    Found: {os.path.basename(f)}")
+            retList.append(f)
+
+    index.save()
 
     return retList
 
@@ -450,12 +520,23 @@ def buildSetupPy(zipFile,ver,relName,packList,sList,relData):
         sf.write(setupPy.encode('utf-8'))
 
 
+def openCache(key):
+    if args.noCache:
+        return None
+
+    return releasePackager.PackageCache(getCacheDir(), key)
+
 def buildRogueFile(zipName, cfg, ver, relName, relData, imgList):
+    timer = releasePackager.PhaseTimer()
+    start = time.monotonic()
+
     print("\nFinding Rogue Files...")
+    timer.start('collect')
     pList = selectDirectories(cfg, 'RoguePackages')
     cList = selectDirectories(cfg, 'RogueConfig')
     sList = selectFiles(cfg,       'RogueScripts')
     lList = selectDirectories(relData, 'LibDir')
+    timer.stop()
 
     if len(pList) == 0:
         raise Exception("Invalid release config. Rogue packages list is empty!")
@@ -468,12 +549,17 @@ def buildRogueFile(zipName, cfg, ver, relName, relData, imgList):
     packList = []
 
     # zipimport does not support compression: https://bugs.python.org/issue21751
-    with zipfile.ZipFile(file=zipName, mode='w', compression=zipfile.ZIP_STORED, compresslevel=None) as zf:
+    # Files are only queued here, they are read ahead by a thread pool and
+    # written in the order below when the generated files are added.
+    # Unchanged files are copied raw from the previous archive (if cached)
+    cache = openCache(f'rogue_{relName}')
+
+    with releasePackager.ZipPackager(zipName, jobs=args.jobs, timer=timer, cache=cache) as zf:
         print(f"\nCreating Rogue zipfile {zipName}")
 
         # Add license file, should be at top level
         lFile = os.path.join(args.project,cfg['GitBase'],'LICENSE.txt')
-        zf.write(lFile,'LICENSE.txt')
+        zf.addFile(lFile,'LICENSE.txt')
 
         # Walk through collected python list
         for e in pList:
@@ -484,7 +570,7 @@ def buildRogueFile(zipName, cfg, ver, relName, relData, imgList):
             if dst == topInit:
                 topPath = e['fullPath']
             else:
-                zf.write(e['fullPath'],dst)
+                zf.addFile(e['fullPath'],dst)
 
             # Add all package folders to setup.py file
             if e['type'] == 'folder':
@@ -493,7 +579,7 @@ def buildRogueFile(zipName, cfg, ver, relName, relData, imgList):
         # Walk through collected configuration list
         for e in cList:
             dst = 'python/' + cfg['TopRoguePackage'] + '/config/' + e['subPath']
-            zf.write(e['fullPath'],dst)
+            zf.addFile(e['fullPath'],dst)
 
         # Walk through collected image list
         for e in imgList:
@@ -507,17 +593,17 @@ def buildRogueFile(zipName, cfg, ver, relName, relData, imgList):
             dst = 'python/' + cfg['TopRoguePackage'] + '/images/' + os.path.basename(img)
 
             # Check that the file does NOT already exists
-            if dst not in zf.namelist():
-                zf.write(img,dst)
+            if dst not in zf:
+                zf.addFile(img,dst)
 
         # Walk through collected script list
         for e in sList:
             dst = 'scripts/' + os.path.basename(e)
-            zf.write(e,dst)
+            zf.addFile(e,dst)
 
         # Walk through collected library directories
         for e in lList:
-            zf.write(e['fullPath'],'lib/' + e['subPath'])
+            zf.addFile(e['fullPath'],'lib/' + e['subPath'])
 
         if topPath is None:
             raise Exception(f"Failed to find file: firmware/python/{topInit}")
@@ -541,15 +627,22 @@ def buildRogueFile(zipName, cfg, ver, relName, relData, imgList):
         newInit += "ImageDir  = os.path.dirname(__file__) + '/images'\n"
         newInit += "#################################################################\n"
 
+        # Opening the first generated file writes all the queued files
         with zf.open(topInit,'w') as f:
             f.write(newInit.encode('utf-8'))
 
+        timer.start('generated files')
+
         # Add setup.py file
         buildSetupPy(zf,ver,relName,packList,sList,relData)
 
         # Add conda files
         buildCondaFiles(cfg,zf,ver,relName,relData)
 
+        timer.stop()
+
+    zf.report(time.monotonic() - start)
+
 
 def buildCpswFile(tarName, cfg, ver, relName, relData, imgList):
     print("\nFinding CPSW Files...")
@@ -561,16 +654,46 @@ def buildCpswFile(tarName, cfg, ver, relName, relData, imgList):
     if len(sList) == 0:
         raise Exception("Invalid release config. Cpsw packages list is empty!")
 
-    with tarfile.open(tarName,'w:gz') as tf:
+    # List of (arcname, fullPath) in tarfile order
+    fList = [(baseDir+'/'+e['subPath'], e['fullPath']) for e in sList if e['type'] == 'file']
+    fList.extend([(baseDir+'/config/'+e['subPath'], e['fullPath']) for e in cList if e['type'] == 'file'])
+
+    # The tarfile does not contain the version, reuse the previous one if nothing changed
+    cache = openCache(f'cpsw_{relName}_{args.compress}{args.compressLevel or ""}')
+
+    if cache is not None and cache.unchanged(fList):
+        print(f"\nCPSW sources unchanged, reusing {cache.archive} for {tarName}")
+        releasePackager.reuseArchive(cache.archive, tarName)
+        cache.save(tarName)
+        return
+
+    start = time.monotonic()
+
+    # The tar stream is compressed by a multi-threaded backend
+    with open(tarName,'wb') as f, \
+         releaseCompress.openWriter(f, args.compress, args.compressLevel, args.compressThreads,
+                                    name=os.path.splitext(os.path.basename(tarName))[0]) as cf, \
+         tarfile.open(fileobj=cf, mode='w|') as tf:
         print(f"\nCreating CPSW tarfile {tarName}")
 
-        for e in sList:
-            if e['type'] == 'file':
-                tf.add(name=e['fullPath'],arcname=baseDir+'/'+e['subPath'],recursive=False)
+        for arcname, fullPath in fList:
+            tarinfo = tf.gettarinfo(name=fullPath, arcname=arcname)
 
-        for e in cList:
-            if e['type'] == 'file':
-                tf.add(name=e['fullPath'],arcname=baseDir+'/config/'+e['subPath'],recursive=False)
+            if tarinfo.isreg():
+                with open(fullPath,'rb') as f:
+                    tf.addfile(tarinfo, fileobj=f)
+            else:
+                tf.addfile(tarinfo)
+
+            if cache is not None:
+                cache.record(arcname, fullPath, os.stat(fullPath))
+
+    elapsed = time.monotonic() - start
+    print(f"Compressed {cf.inBytes} -> {cf.outBytes} bytes with {args.compress} "
+          f"in {elapsed:.3f} s ({cf.inBytes / max(elapsed, 1e-9) / 1e6:.1f} MB/s)")
+
+    if cache is not None:
+        cache.save(tarName)
 
 def pushRelease(cfg, relName, relData, ver, tagAttach, prev):
     gitDir = os.path.join(args.project,cfg['GitBase'])
@@ -604,26 +727,9 @@ def pushRelease(cfg, relName, relData, ver, tagAttach, prev):
 
     print("\nLogging into github....\n")
 
-    if args.token is not None:
-        print("Using github token from command line arg.")
-        token = args.token
-    else:
-        token = os.environ.get('GITHUB_TOKEN')
-
-        if token is None:
-            print("Enter your github token. If you do no have one you can generate it here:")
-            print("    https://github.com/settings/tokens")
-            print("You may set it in your environment as GITHUB_TOKEN")
-            token = input("\nGithub token: ")
-        else:
-            print("Using github token from user's environment.")
-
-    try:
-        # Try the new syntax (PyGithub >= 2.0)
-        gh = github.Github(auth=github.Auth.Token(token))
-    except AttributeError:
-        # Fallback for older PyGithub versions
-        gh = github.Github(token)
+    token   = githubClient.getToken(args.token)
+    gh      = githubClient.connect(token)
+    rest    = githubClient.RestClient(token)
     remRepo = gh.get_repo(f'slaclab/{project}')
 
     # Check if old and new tag exist in local repo
@@ -639,14 +745,9 @@ def pushRelease(cfg, relName, relData, ver, tagAttach, prev):
     if newTagExist:
         raise (Exception(f'local repo: newTag={relNew} already does exist'))
 
-    # Check if old and new tag exist in remote repo
-    oldTagExist = False
-    newTagExist = False
-    for tagIdx in remRepo.get_tags():
-        if tagIdx.name == relOld:
-            oldTagExist = True
-        if tagIdx.name == relNew:
-            newTagExist = True
+    # Check if old and new tag exist in remote repo (direct ref lookups, no tag list pagination)
+    oldTagExist = (relOld != '') and rest.tagExists(remRepo.full_name, relOld)
+    newTagExist = rest.tagExists(remRepo.full_name, relNew)
     if not oldTagExist and (relOld != ''):
         raise (Exception(f'remote repo: oldTag={relOld} does NOT exist'))
     if newTagExist:
@@ -659,12 +760,26 @@ def pushRelease(cfg, relName, relData, ver, tagAttach, prev):
     if prev != "":
         print("\nGenerating release notes ...")
         try:
+            cache = None if args.noCache else releaseNotesCache.PullCache()
+
             md = releaseNotes.getReleaseNotes(
                 locRepo = git.Git(gitDir),
                 remRepo = remRepo,
                 oldTag  = relOld,
                 newTag  = relNew,
+                client  = rest,
+                cache   = cache,
             )
+
+            if args.submoduleNotes:
+                md += '\n' + releaseNotes.getSubmoduleNotes(
+                    locRepo = git.Git(gitDir),
+                    oldTag  = relOld,
+                    newTag  = relNew,
+                    getRepo = gh.get_repo,
+                    client  = rest,
+                    cache   = cache,
+                )
         except ValueError as e:
             # Delete the new tag if an error occurs
             git.Git(gitDir).tag('-d', relNew)
@@ -682,8 +797,19 @@ def pushRelease(cfg, relName, relData, ver, tagAttach, prev):
     remRel = remRepo.create_git_release(tag=tag,name=msg, message=md, draft=False)
 
     print("\nUploading attachments ...")
-    for t in tagAttach:
-        remRel.upload_asset(t)
+    uploader = releaseUpload.AssetUploader(
+        releaseUrl = remRel.url,
+        uploadUrl  = remRel.upload_url,
+        token      = token,
+        jobs       = args.uploadJobs,
+        retries    = args.uploadRetries,
+        session    = rest.session,
+    )
+
+    try:
+        uploader.upload(tagAttach)
+    except releaseUpload.UploadError as e:
+        raise releaseUpload.UploadError(f'{e}\nResume with: python3 releaseUpload.py --repo {remRepo.full_name} --tag {tag} <files>')
 
 
 if __name__ == "__main__":
@@ -711,10 +837,11 @@ if __name__ == "__main__":
 
     # Determine if we generate a CPSW tarball
     if 'CPSW' in relData['Types']:
+        tarExt = '.tar' + releaseCompress.EXTENSIONS[args.compress]
         if relData['Primary']:
-            tarName = f'cpsw_{ver}.tar.gz'
+            tarName = f'cpsw_{ver}{tarExt}'
         else:
-            tarName = f'cpsw_{relName}_{ver}.tar.gz'
+            tarName = f'cpsw_{relName}_{ver}{tarExt}'
         buildCpswFile(tarName,cfg,ver,relName,relData,imgList)
         tagAttach.append(tarName)
 
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+#-----------------------------------------------------------------------------
+# Title      : Shared GitHub API client
+# ----------------------------------------------------------------------------
+# This file is part of the 'SLAC Firmware Standard Library'. It is subject to
+# the license terms in the LICENSE.txt file found in the top-level directory
+# of this distribution and at:
+#    https://confluence.slac.stanford.edu/display/ppareg/LICENSE.html.
+# No part of the 'SLAC Firmware Standard Library', including this file, may be
+# copied, modified, propagated, or distributed except according to the terms
+# contained in the LICENSE.txt file.
+# ----------------------------------------------------------------------------
+
+##
+# @file githubClient.py
+# GitHub login and REST helpers shared by the ruckus release scripts.
+#
+# connect() returns a PyGithub session with a larger connection pool and 100
+# items per page. RestClient is a pooled requests session for the calls that
+# PyGithub can only do through full pagination (i.e. checking if a tag exists).
+# GET responses are cached on disk with their ETag and revalidated with
+# If-None-Match; a 304 Not Modified does not count against the rate limit.
+#
+# GraphQL queries can be recorded to a JSON file with RecordingClient and
+# served back offline by ReplayClient (i.e. to test the release notes).
+
+import os
+import json
+import hashlib
+import threading
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import github # PyGithub
+
+DEFAULT_API_URL   = 'https://api.github.com'
+DEFAULT_CACHE_DIR = os.environ.get('RUCKUS_GITHUB_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'ruckus', 'github'))
+DEFAULT_POOL_SIZE = 16
+
+
+def getToken(token=None, envVar='GITHUB_TOKEN'):
+    """Return the token from the command line arg, the environment or a prompt"""
+    if token is not None:
+        print("Using github token from command line arg.")
+        return token
+
+    token = os.environ.get(envVar)
+
+    if token is None:
+        print("Enter your github token. If you do no have one you can generate it here:")
+        print("    https://github.com/settings/tokens")
+        print(f"You may set it in your environment as {envVar}")
+        token = input("\nGithub token: ")
+    else:
+        print("Using github token from user's environment.")
+
+    return token
+
+
+def connect(token, poolSize=DEFAULT_POOL_SIZE):
+    """Return a PyGithub session for the token"""
+    try:
+        # Try the new syntax (PyGithub >= 2.0)
+        auth = github.Auth.Token(token)
+    except AttributeError:
+        # Fallback for older PyGithub versions
+        return github.Github(token, per_page=100)
+
+    try:
+        return github.Github(auth=auth, per_page=100, pool_size=poolSize)
+    except TypeError:
+        return github.Github(auth=auth, per_page=100)
+
+
+class GraphqlError(Exception):
+    pass
+
+
+def _queryKey(query, variables):
+    return hashlib.sha256(json.dumps([' '.join(query.split()), variables], sort_keys=True).encode()).hexdigest()
+
+
+class RestClient(object):
+    """Pooled GitHub REST session with an ETag-conditional response cache"""
+
+    def __init__(self, token, apiUrl=DEFAULT_API_URL, cacheDir=DEFAULT_CACHE_DIR, poolSize=DEFAULT_POOL_SIZE):
+        self.apiUrl   = apiUrl.rstrip('/')
+        self.cacheDir = cacheDir
+        self.hits     = 0
+        self.misses   = 0
+        self.queries  = 0
+        self._lock    = threading.Lock()
+
+        # The cache is partitioned by token so private data is never shared between users
+        self._ident = hashlib.sha256(token.encode()).hexdigest()[:16] if token else 'anonymous'
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=poolSize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Accept': 'application/vnd.github+json',
+                                     'X-GitHub-Api-Version': '2022-11-28'})
+        if token:
+            self.session.headers['Authorization'] = f'token {token}'
+
+    def url(self, path):
+        if path.startswith('http://') or path.startswith('https://'):
+            return path
+        return self.apiUrl + '/' + path.lstrip('/')
+
+    def _cachePath(self, url):
+        key = hashlib.sha256(f'{self._ident} {url}'.encode()).hexdigest()
+        return os.path.join(self.cacheDir, self._ident, key[:2], key + '.json')
+
+    def _loadCache(self, url):
+        if self.cacheDir is None:
+            return None
+        try:
+            with open(self._cachePath(url)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _saveCache(self, url, etag, body, links):
+        if self.cacheDir is None or etag is None:
+            return
+
+        path = self._cachePath(url)
+        tmp  = f'{path}.{os.getpid()}.{threading.get_ident()}'
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp, 'w') as f:
+                json.dump({'etag': etag, 'body': body, 'links': links}, f)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+    def request(self, method, path, **kwargs):
+        """Uncached request, returns the requests.Response"""
+        kwargs.setdefault('timeout', 60)
+        return self.session.request(method, self.url(path), **kwargs)
+
+    def getResponse(self, path, params=None):
+        """Conditional GET, returns (status, body, links). 404 returns (404, None, {})"""
+        url = requests.Request('GET', self.url(path), params=params).prepare().url
+        ent = self._loadCache(url)
+        headers = {}
+
+        if ent is not None:
+            headers['If-None-Match'] = ent['etag']
+
+        resp = self.session.get(url, headers=headers, timeout=60)
+
+        if resp.status_code == 304 and ent is not None:
+            with self._lock:
+                self.hits += 1
+            return 200, ent['body'], ent['links']
+
+        with self._lock:
+            self.misses += 1
+
+        if resp.status_code == 404:
+            return 404, None, {}
+
+        resp.raise_for_status()
+
+        body  = resp.json()
+        links = {k: v['url'] for k, v in resp.links.items()}
+        self._saveCache(url, resp.headers.get('ETag'), body, links)
+
+        return resp.status_code, body, links
+
+    def get(self, path, params=None):
+        """Cached GET of a JSON document, None if not found"""
+        return self.getResponse(path, params)[1]
+
+    def getPaged(self, path, params=None):
+        """Cached GET of all the pages of a JSON list"""
+        params = dict(params or {})
+        params.setdefault('per_page', 100)
+        ret = []
+
+        status, body, links = self.getResponse(path, params)
+
+        while body is not None:
+            ret.extend(body)
+
+            if 'next' not in links:
+                break
+
+            status, body, links = self.getResponse(links['next'])
+
+        return ret
+
+    def refExists(self, repo, ref):
+        """Check a single ref (i.e. 'tags/v1.2.3') without listing all of them"""
+        return self.get(f'repos/{repo}/git/ref/{quote(ref)}') is not None
+
+    def tagExists(self, repo, tag):
+        return self.refExists(repo, f'tags/{tag}')
+
+    def getReleaseByTag(self, repo, tag):
+        return self.get(f'repos/{repo}/releases/tags/{quote(tag)}')
+
+    def graphql(self, query, variables=None):
+        """Run a GraphQL query, returns the 'data' member of the response"""
+        if self.apiUrl.endswith('/v3'):
+            url = self.apiUrl[:-3] + '/graphql'  # GitHub Enterprise
+        else:
+            url = self.apiUrl + '/graphql'
+
+        resp = self.session.post(url, json={'query': query, 'variables': variables or {}}, timeout=120)
+        resp.raise_for_status()
+        ret = resp.json()
+
+        with self._lock:
+            self.queries += 1
+
+        if ret.get('errors'):
+            raise GraphqlError('; '.join([e.get('message', str(e)) for e in ret['errors']]))
+
+        return ret['data']
+
+
+class RecordingClient(object):
+    """Pass the GraphQL queries to client and record the responses to a JSON file"""
+
+    def __init__(self, client, path):
+        self.client    = client
+        self.path      = path
+        self.responses = {}
+        self._lock     = threading.Lock()
+
+    def graphql(self, query, variables=None):
+        data = self.client.graphql(query, variables)
+
+        with self._lock:
+            self.responses[_queryKey(query, variables or {})] = data
+
+            with open(self.path, 'w') as f:
+                json.dump(self.responses, f, indent=1, sort_keys=True)
+
+        return data
+
+
+class ReplayClient(object):
+    """Serve GraphQL responses from a file written by RecordingClient"""
+
+    def __init__(self, path):
+        with open(path) as f:
+            self.responses = json.load(f)
+
+    def graphql(self, query, variables=None):
+        key = _queryKey(query, variables or {})
+
+        if key not in self.responses:
+            raise GraphqlError(f'Query not found in recorded responses {key}')
+
+        return self.responses[key]
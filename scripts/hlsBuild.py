@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+#-----------------------------------------------------------------------------
+# Title      : Parallel Vitis HLS build
+# ----------------------------------------------------------------------------
+# This file is part of the 'SLAC Firmware Standard Library'. It is subject to
+# the license terms in the LICENSE.txt file found in the top-level directory
+# of this distribution and at:
+#    https://confluence.slac.stanford.edu/display/ppareg/LICENSE.html.
+# No part of the 'SLAC Firmware Standard Library', including this file, may be
+# copied, modified, propagated, or distributed except according to the terms
+# contained in the LICENSE.txt file.
+# ----------------------------------------------------------------------------
+
+##
+# @file hlsBuild.py
+# Build several Vitis Unified HLS projects in parallel.
+#
+# Each project directory (containing hls_config.cfg) is built the way
+# system_vitis_unified_hls.mk does it: create_proj.py, build.py and, with
+# vivado.syn_dcp=1, dcp_rename_ref.tcl, each in its own $(PROJ_DIR)/build
+# workspace with its own vitis server. The number of concurrent builds is
+# limited by the CPU count and the memory budget per build. The output of each
+# build is streamed with a [project] prefix and written to
+# $(PROJ_DIR)/build/hls_build.log. The stage durations reported by build.py
+# are collected into a summary table.
+#
+#   python3 hlsBuild.py --mem_gb 12 shared/hls/*/
+#
+# The vitis and vivado commands are configurable, so the flow can be run with
+# the stand-in vitis module of scripts/vitisStandin (no Vitis installed):
+#   PYTHONPATH=vitisStandin python3 hlsBuild.py --vitis python3 --vivado true ...
+
+import os
+import re
+import sys
+import time
+import shlex
+import argparse
+import threading
+import subprocess
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+RUCKUS_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+HLS_DIR    = os.path.join(RUCKUS_DIR, 'vitis', 'hls')
+
+# "   SYNTHESIS        ran            12.3 s" lines of the build.py stage summary
+STAGE_RE = re.compile(r'^\s+([A-Z_]+)\s+(ran|reused)\s+([\d.]+) s$')
+
+# "vivado v2025.2 (64-bit)" line of vivado -version
+VERSION_RE = re.compile(r'v((\d+\.)+\d+)')
+
+STAGES = ['C_SIMULATION', 'SYNTHESIS', 'CO_SIMULATION', 'PACKAGE', 'IMPLEMENTATION']
+
+_printLock = threading.Lock()
+
+
+def memoryBytes():
+    """Physical memory of the host, None if unknown"""
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def poolSize(nProjects, cpusPerJob, memPerJobGb, jobs=None):
+    """Number of concurrent builds from the CPU count and the memory budget"""
+    if jobs is not None:
+        return max(1, min(jobs, nProjects))
+
+    size = max(1, (os.cpu_count() or 1) // max(1, cpusPerJob))
+    mem  = memoryBytes()
+
+    if mem is not None and memPerJobGb > 0:
+        size = min(size, max(1, int(mem // (memPerJobGb * 1024**3))))
+
+    return max(1, min(size, nProjects))
+
+
+@functools.lru_cache(maxsize=None)
+def vivadoVersion(vivadoCmd=('vivado',)):
+    """Vivado version (i.e. 2025.2) the way system_vitis_unified_hls.mk gets it, '' if unknown"""
+    try:
+        out = subprocess.run(list(vivadoCmd) + ['-version'], stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL, text=True, errors='replace').stdout
+    except OSError:
+        return ''
+
+    m = VERSION_RE.search(out)
+    return m.group(1) if m is not None else ''
+
+
+class HlsProject(object):
+    """One HLS project directory and the results of its build"""
+
+    def __init__(self, path, name=None):
+        self.projDir = os.path.abspath(path.rstrip('/'))
+        self.name    = name if name is not None else os.path.basename(self.projDir)
+        self.label   = os.path.basename(self.projDir)
+        self.outDir  = os.path.join(self.projDir, 'build')
+        self.stages  = {}
+        self.steps   = []
+        self.error   = None
+        self.seconds = 0.0
+
+    def env(self, base, vivadoCmd=None):
+        env = dict(base)
+        env['PROJECT']  = self.name
+        env['PROJ_DIR'] = self.projDir
+        env['OUT_DIR']  = self.outDir
+
+        # Part of the stage cache key of build.py, exported by the makefile
+        if not env.get('VIVADO_VERSION'):
+            env['VIVADO_VERSION'] = vivadoVersion(tuple(vivadoCmd or ['vivado']))
+
+        env.setdefault('ALL_XIL_FAMILY', '1')
+        env.setdefault('SKIP_CSIM', '0')
+        env.setdefault('SKIP_COSIM', '0')
+        env.setdefault('HLS_STAGE_CACHE', '1')
+        return env
+
+    def synDcp(self):
+        with open(os.path.join(self.projDir, 'hls_config.cfg')) as f:
+            return 'vivado.syn_dcp=1' in f.read()
+
+
+def _run(project, step, cmd, env, log):
+    """Run one step of a project build, streaming its output with the project prefix"""
+    start = time.monotonic()
+    log.write(f'#### {step}: {" ".join(cmd)}\n')
+
+    proc = subprocess.Popen(cmd, cwd=project.outDir, env=env, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, text=True, errors='replace', bufsize=1)
+
+    for line in proc.stdout:
+        log.write(line)
+        line = line.rstrip('\n')
+
+        m = STAGE_RE.match(line)
+        if m is not None:
+            project.stages[m.group(1)] = (m.group(2), float(m.group(3)))
+
+        with _printLock:
+            print(f'[{project.label}] {line}', flush=True)
+
+    rc = proc.wait()
+    project.steps.append((step, time.monotonic() - start, rc))
+
+    if rc != 0:
+        raise RuntimeError(f'{step} failed with exit code {rc}')
+
+
+def buildProject(project, vitisCmd, vivadoCmd, env, mode='build'):
+    """Create and build a project, mode is 'build', 'csim' or 'synth' (build.py --csim/--synth)"""
+    start = time.monotonic()
+    env   = project.env(env, vivadoCmd)
+
+    os.makedirs(project.outDir, exist_ok=True)
+    os.makedirs(os.path.join(project.projDir, 'ip'), exist_ok=True)
+
+    with open(os.path.join(project.outDir, 'hls_build.log'), 'w') as log:
+        try:
+            _run(project, 'proj', vitisCmd + [os.path.join(HLS_DIR, 'create_proj.py')], env, log)
+
+            if mode != 'build':
+                _run(project, mode, vitisCmd + [os.path.join(HLS_DIR, 'build.py'), f'--{mode}'], env, log)
+            else:
+                _run(project, 'build', vitisCmd + [os.path.join(HLS_DIR, 'build.py')], env, log)
+
+                if project.synDcp():
+                    _run(project, 'dcp', vivadoCmd + ['-mode', 'batch', '-source', os.path.join(HLS_DIR, 'dcp_rename_ref.tcl')], env, log)
+
+        except (OSError, RuntimeError) as e:
+            project.error = str(e)
+            log.write(f'ERROR: {e}\n')
+
+    project.seconds = time.monotonic() - start
+
+    with _printLock:
+        print(f'[{project.label}] {"FAILED: " + project.error if project.error else "done"} ({project.seconds:.1f} s)', flush=True)
+
+    return project
+
+
+def summary(projects):
+    """Table of the stage durations of every project"""
+    width = max([len(p.label) for p in projects] + [7])
+    lines = [f'{"Project":{width}}  ' + ' '.join([f'{s:>14}' for s in STAGES]) + f' {"Total":>9}  Status']
+
+    for p in projects:
+        cols = []
+        for s in STAGES:
+            if s not in p.stages:
+                cols.append(f'{"-":>14}')
+            else:
+                status, sec = p.stages[s]
+                cols.append(f'{sec:13.1f}' + ('r' if status == 'reused' else ' '))
+
+        lines.append(f'{p.label:{width}}  ' + ' '.join(cols) + f' {p.seconds:9.1f}  ' + ('FAILED' if p.error else 'ok'))
+
+    lines.append('(r: reused from the stage cache, time of the original run)')
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+
+    # Set the argument parser
+    parser = argparse.ArgumentParser('HLS Build')
+
+    parser.add_argument(
+        "projects",
+        nargs    = '+',
+        help     = "HLS project directories (containing hls_config.cfg)"
+    )
+
+    parser.add_argument(
+        "--jobs",
+        type     = int,
+        required = False,
+        default  = None,
+        help     = "Number of concurrent builds (default: from --cpus and --mem_gb)"
+    )
+
+    parser.add_argument(
+        "--cpus",
+        type     = int,
+        required = False,
+        default  = 2,
+        help     = "CPUs per build for the default number of concurrent builds"
+    )
+
+    parser.add_argument(
+        "--mem_gb",
+        type     = float,
+        required = False,
+        default  = 8.0,
+        help     = "Memory budget per build in GB for the default number of concurrent builds"
+    )
+
+    parser.add_argument(
+        "--vitis",
+        type     = str,
+        required = False,
+        default  = os.getenv('VITIS_CMD', 'vitis -s'),
+        help     = "Command running a vitis python script (default: 'vitis -s', or $VITIS_CMD)"
+    )
+
+    parser.add_argument(
+        "--vivado",
+        type     = str,
+        required = False,
+        default  = os.getenv('VIVADO_CMD', 'vivado'),
+        help     = "Vivado command for the DCP rename (default: 'vivado', or $VIVADO_CMD)"
+    )
+
+    parser.add_argument(
+        "--csim",
+        action   = 'store_true',
+        default  = False,
+        help     = "Only run the C-simulation"
+    )
+
+    args = parser.parse_args()
+
+    projects = []
+    for path in args.projects:
+        if not os.path.isfile(os.path.join(path, 'hls_config.cfg')):
+            parser.error(f'{path}: no hls_config.cfg')
+        projects.append(HlsProject(path))
+
+    names = [p.name for p in projects]
+    if len(set(names)) != len(names):
+        parser.error('Project directory names must be unique (they are the component names)')
+
+    jobs = poolSize(len(projects), args.cpus, args.mem_gb, args.jobs)
+    print(f'Building {len(projects)} HLS projects, {jobs} at a time')
+
+    env = dict(os.environ)
+    env['RUCKUS_DIR'] = RUCKUS_DIR
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futs = [pool.submit(buildProject, p, shlex.split(args.vitis), shlex.split(args.vivado), env, 'csim' if args.csim else 'build') for p in projects]
+        for f in futs:
+            f.result()
+
+    print('\n' + summary(projects))
+
+    if any([p.error for p in projects]):
+        sys.exit(1)
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+#-----------------------------------------------------------------------------
+# Title      : Vitis HLS design space sweep
+# ----------------------------------------------------------------------------
+# This file is part of the 'SLAC Firmware Standard Library'. It is subject to
+# the license terms in the LICENSE.txt file found in the top-level directory
+# of this distribution and at:
+#    https://confluence.slac.stanford.edu/display/ppareg/LICENSE.html.
+# No part of the 'SLAC Firmware Standard Library', including this file, may be
+# copied, modified, propagated, or distributed except according to the terms
+# contained in the LICENSE.txt file.
+# ----------------------------------------------------------------------------
+
+##
+# @file hlsSweep.py
+# Synthesize the variants of a grid of hls_config.cfg settings in parallel.
+#
+# Each --param KEY=V1,V2,... is a cfg key and its values. One variant is
+# generated per combination in $(OUT_DIR)/sweep/vNNN/ with its own
+# hls_config.cfg (source paths and -I directories made absolute) and build
+# workspace, and is synthesized with build.py --synth through hlsBuild.py.
+# A syn.directive.* value replaces the directive of the same location (first
+# word), other keys replace every line with that key. The csynth.xml reports
+# are collected into a table ranked by the --rank columns, also written to
+# sweep.csv.
+#
+#   python3 hlsSweep.py --param clock=3.2,4 \
+#       --param "syn.directive.pipeline=loop1 II=1,loop1 II=2" --rank latency lut
+
+import os
+import csv
+import sys
+import glob
+import shlex
+import argparse
+import itertools
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+import hlsBuild
+
+COLUMNS = ['latency', 'latencyWorst', 'ii', 'period', 'lut', 'ff', 'dsp', 'bram', 'uram']
+
+# csynth.xml element of each column
+REPORT_PATHS = {
+    'latency'      : 'PerformanceEstimates/SummaryOfOverallLatency/Best-caseLatency',
+    'latencyWorst' : 'PerformanceEstimates/SummaryOfOverallLatency/Worst-caseLatency',
+    'ii'           : 'PerformanceEstimates/SummaryOfOverallLatency/Interval-max',
+    'period'       : 'PerformanceEstimates/SummaryOfTimingAnalysis/EstimatedClockPeriod',
+    'lut'          : 'AreaEstimates/Resources/LUT',
+    'ff'           : 'AreaEstimates/Resources/FF',
+    'dsp'          : 'AreaEstimates/Resources/DSP',
+    'bram'         : 'AreaEstimates/Resources/BRAM_18K',
+    'uram'         : 'AreaEstimates/Resources/URAM',
+}
+
+# Keys holding file paths relative to the project directory
+PATH_KEYS = ('syn.file', 'tb.file')
+
+# Keys holding compiler flags, their include directories are relative to the project directory
+CFLAGS_KEYS = ('syn.cflags', 'tb.cflags', 'csim.cflags')
+
+INCLUDE_FLAGS = ('-I', '-iquote', '-isystem', '-idirafter')
+
+
+def parseGrid(params):
+    """[(key, [values])] from the KEY=V1,V2 arguments"""
+    grid = []
+    for p in params:
+        if '=' not in p:
+            raise ValueError(f'{p}: expected KEY=V1,V2,...')
+        key, values = p.split('=', 1)
+        grid.append((key.strip(), [v.strip() for v in values.split(',')]))
+    return grid
+
+
+def _sameSetting(line, key, value):
+    k, _, v = line.partition('=')
+    if k.strip() != key:
+        return False
+    if key.startswith('syn.directive.'):
+        return v.split()[:1] == value.split()[:1]
+    return True
+
+
+def setCfg(text, key, value):
+    """Set key=value in the cfg text, replacing the existing setting"""
+    lines = text.splitlines()
+    out   = []
+    done  = False
+
+    for line in lines:
+        if _sameSetting(line.strip(), key, value):
+            if not done:
+                out.append(f'{key}={value}')
+                done = True
+        else:
+            out.append(line)
+
+    if not done:
+        out.append(f'{key}={value}')
+
+    return '\n'.join(out) + '\n'
+
+
+def absoluteIncludes(flags, projDir):
+    """Make the include directories of compiler flags absolute, returns None if unchanged"""
+    try:
+        words = shlex.split(flags)
+    except ValueError:
+        return None
+
+    out     = []
+    changed = False
+    i       = 0
+
+    while i < len(words):
+        word = words[i]
+        flag = next((f for f in INCLUDE_FLAGS if word.startswith(f)), None)
+
+        # "-Idir" or "-I dir" (kept in the same form)
+        if flag is not None and (word != flag or i + 1 < len(words)):
+            if word == flag:
+                out.append(flag)
+                i   += 1
+                word = words[i]
+                flag = ''
+            path = word[len(flag):]
+            if not os.path.isabs(path):
+                word    = flag + os.path.normpath(os.path.join(projDir, path))
+                changed = True
+
+        out.append(word)
+        i += 1
+
+    return ' '.join([shlex.quote(w) for w in out]) if changed else None
+
+
+def absolutePaths(text, projDir):
+    """Make the source paths and include directories of the cfg absolute (the variant cfg lives in another directory)"""
+    out = []
+    for line in text.splitlines():
+        key, sep, value = line.partition('=')
+        if sep and key.strip() in PATH_KEYS and not os.path.isabs(value.strip()):
+            line = f'{key.strip()}={os.path.normpath(os.path.join(projDir, value.strip()))}'
+        elif sep and key.strip() in CFLAGS_KEYS:
+            flags = absoluteIncludes(value.strip(), projDir)
+            if flags is not None:
+                line = f'{key.strip()}={flags}'
+        out.append(line)
+    return '\n'.join(out) + '\n'
+
+
+def makeVariants(projDir, sweepDir, grid):
+    """Write the variant directories, returns [(directory, {key: value})]"""
+    with open(os.path.join(projDir, 'hls_config.cfg')) as f:
+        base = absolutePaths(f.read(), projDir)
+
+    keys     = [k for k, v in grid]
+    variants = []
+
+    for i, values in enumerate(itertools.product(*[v for k, v in grid])):
+        varDir = os.path.join(sweepDir, f'v{i:03d}')
+        os.makedirs(varDir, exist_ok=True)
+
+        text = base
+        for key, value in zip(keys, values):
+            text = setCfg(text, key, value)
+
+        # Rewrite only on change, the stage stamps of build.py key on the cfg contents
+        cfgFile = os.path.join(varDir, 'hls_config.cfg')
+        old = open(cfgFile).read() if os.path.exists(cfgFile) else None
+        if old != text:
+            with open(cfgFile, 'w') as f:
+                f.write(text)
+
+        variants.append((varDir, dict(zip(keys, values))))
+
+    return variants
+
+
+def _number(text):
+    try:
+        return float(text) if '.' in text else int(text)
+    except (TypeError, ValueError):
+        return None
+
+
+def parseCsynth(path):
+    """Columns of a csynth.xml report"""
+    root = ET.parse(path).getroot()
+    ret  = {}
+    for col, xpath in REPORT_PATHS.items():
+        el = root.find(xpath)
+        ret[col] = _number(el.text.strip()) if el is not None and el.text else None
+    return ret
+
+
+def findCsynth(varDir, name):
+    """csynth.xml of the top function of a variant build"""
+    found = sorted(glob.glob(os.path.join(varDir, 'build', name, '**', 'syn', 'report', 'csynth.xml'), recursive=True))
+    return found[0] if found else None
+
+
+def rankKey(row, rank):
+    # Missing values (failed variants, undef latency) rank last
+    return [(row.get(c) is None, row.get(c) or 0) for c in rank]
+
+
+if __name__ == "__main__":
+
+    # Set the argument parser
+    parser = argparse.ArgumentParser('HLS Sweep')
+
+    parser.add_argument(
+        "--param",
+        action   = 'append',
+        required = True,
+        help     = "hls_config.cfg key and the values to sweep: KEY=V1,V2,... (repeatable)"
+    )
+
+    parser.add_argument(
+        "--proj_dir",
+        type     = str,
+        required = False,
+        default  = os.getenv('PROJ_DIR', os.getcwd()),
+        help     = "HLS project directory (default: $PROJ_DIR or the current directory)"
+    )
+
+    parser.add_argument(
+        "--out_dir",
+        type     = str,
+        required = False,
+        default  = os.getenv('OUT_DIR'),
+        help     = "Build directory, the variants go to <out_dir>/sweep (default: $OUT_DIR or <proj_dir>/build)"
+    )
+
+    parser.add_argument(
+        "--rank",
+        nargs    = '+',
+        default  = ['latency', 'lut'],
+        choices  = COLUMNS,
+        help     = "Columns to rank the variants by, smallest first"
+    )
+
+    parser.add_argument(
+        "--jobs",
+        type     = int,
+        required = False,
+        default  = None,
+        help     = "Number of concurrent synthesis runs (default: from --cpus and --mem_gb)"
+    )
+
+    parser.add_argument(
+        "--cpus",
+        type     = int,
+        required = False,
+        default  = 2,
+        help     = "CPUs per run for the default number of concurrent runs"
+    )
+
+    parser.add_argument(
+        "--mem_gb",
+        type     = float,
+        required = False,
+        default  = 8.0,
+        help     = "Memory budget per run in GB for the default number of concurrent runs"
+    )
+
+    parser.add_argument(
+        "--vitis",
+        type     = str,
+        required = False,
+        default  = os.getenv('VITIS_CMD', 'vitis -s'),
+        help     = "Command running a vitis python script (default: 'vitis -s', or $VITIS_CMD)"
+    )
+
+    args = parser.parse_args()
+
+    projDir  = os.path.abspath(args.proj_dir)
+    name     = os.getenv('PROJECT', os.path.basename(projDir))
+    outDir   = os.path.abspath(args.out_dir or os.path.join(projDir, 'build'))
+    sweepDir = os.path.join(outDir, 'sweep')
+
+    if not os.path.isfile(os.path.join(projDir, 'hls_config.cfg')):
+        parser.error(f'{projDir}: no hls_config.cfg')
+
+    try:
+        grid = parseGrid(args.param)
+    except ValueError as e:
+        parser.error(str(e))
+
+    variants = makeVariants(projDir, sweepDir, grid)
+    projects = [hlsBuild.HlsProject(d, name) for d, p in variants]
+    jobs     = hlsBuild.poolSize(len(projects), args.cpus, args.mem_gb, args.jobs)
+
+    print(f'Synthesizing {len(projects)} variants of {name}, {jobs} at a time')
+
+    env = dict(os.environ)
+    env['RUCKUS_DIR'] = hlsBuild.RUCKUS_DIR
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futs = [pool.submit(hlsBuild.buildProject, p, shlex.split(args.vitis), [], env, 'synth') for p in projects]
+        for f in futs:
+            f.result()
+
+    # Collect the reports
+    rows = []
+    for (varDir, params), proj in zip(variants, projects):
+        row = {'variant': os.path.basename(varDir)}
+        row.update(params)
+
+        report = findCsynth(varDir, name) if proj.error is None else None
+        if report is not None:
+            row.update(parseCsynth(report))
+        else:
+            row['error'] = proj.error or 'no csynth.xml'
+
+        rows.append(row)
+
+    rows.sort(key=lambda r: rankKey(r, args.rank))
+
+    keys   = [k for k, v in grid]
+    header = ['variant'] + keys + COLUMNS
+
+    with open(os.path.join(sweepDir, 'sweep.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=header + ['error'], restval='')
+        writer.writeheader()
+        writer.writerows(rows)
+
+    widths = [max([len(h)] + [len(str(r.get(h, ''))) for r in rows]) for h in header]
+    print('\n' + '  '.join([f'{h:>{w}}' for h, w in zip(header, widths)]))
+
+    for r in rows:
+        cols = [f'{"-" if r.get(h) is None else r[h]!s:>{w}}' for h, w in zip(header, widths)]
+        print('  '.join(cols) + (f'  ERROR: {r["error"]}' if 'error' in r else ''))
+
+    print(f'\nRanked by {", ".join(args.rank)}; table written to {os.path.join(sweepDir, "sweep.csv")}')
+
+    if any(['error' in r for r in rows]):
+        sys.exit(1)
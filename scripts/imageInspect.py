@@ -0,0 +1,525 @@
+#!/usr/bin/env python3
+#-----------------------------------------------------------------------------
+# Title      : Firmware image inspection
+# ----------------------------------------------------------------------------
+# This file is part of the 'SLAC Firmware Standard Library'. It is subject to
+# the license terms in the LICENSE.txt file found in the top-level directory
+# of this distribution and at:
+#    https://confluence.slac.stanford.edu/display/ppareg/LICENSE.html.
+# No part of the 'SLAC Firmware Standard Library', including this file, may be
+# copied, modified, propagated, or distributed except according to the terms
+# contained in the LICENSE.txt file.
+# ----------------------------------------------------------------------------
+
+##
+# @file imageInspect.py
+# Inspect, checksum and diff the .bit, .bin, .mcs and .pdi files of images/.
+#
+# Files are memory mapped. The .bit header (design name, part, date) is
+# parsed and the configuration packets are walked to report IDCODE,
+# USR_ACCESS (decoded as a timestamp when built with USR_ACCESS TIMESTAMP),
+# the CRC check values and the frame data (FDRI) size. The file sha256/crc32
+# and the configuration data sha256/crc32 are computed in a single pass, so a
+# .bit, its .bin and its (single interface) .mcs report the same data hash.
+# MCS files are decoded record by record into a temporary file, never loaded
+# whole. The diff compares the frame data of two builds with NumPy and lists
+# the frames that differ.
+#
+#   python3 imageInspect.py images/                  # whole tree, one line per image
+#   python3 imageInspect.py --json images/MyTarget-*.bit
+#   python3 imageInspect.py --diff old.bit new.bit
+
+import os
+import re
+import sys
+import json
+import mmap
+import zlib
+import hashlib
+import argparse
+import tempfile
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import promgen
+
+EXTENSIONS = ['.bit', '.bin', '.mcs', '.pdi']
+
+SYNC_WORD  = b'\xAA\x99\x55\x66'
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# Configuration registers
+REG_CRC    = 0x00
+REG_FDRI   = 0x02
+REG_CMD    = 0x04
+REG_COR0   = 0x09
+REG_MFWR   = 0x0A
+REG_IDCODE = 0x0C
+REG_AXSS   = 0x0D
+REG_WBSTAR = 0x10
+
+# Versal PDI boot header image identification word ('XNLX')
+PDI_IDENT = b'XNLX'
+
+
+def frameWords(part):
+    """Words per configuration frame of a part family, None if unknown"""
+    if not part:
+        return None
+
+    # The .bit header part has no 'xc' prefix (i.e. 7k325tffg900)
+    part = part.lower()
+    if part.startswith('xc'):
+        part = part[2:]
+
+    if part.startswith('7'):
+        return 101
+
+    # UltraScale+ (zu, au, ku5p, vu9p, ...)
+    if part.startswith('zu') or part.startswith('au'):
+        return 93
+
+    # The package may follow the device without a dash (i.e. ku15pffve1517)
+    m = re.match(r'(ku|vu)\d+(p?)', part)
+    if m is not None:
+        return 93 if m.group(2) else 123
+
+    return None
+
+
+def _wordArray(buf, offset, count):
+    """Big-endian 32-bit word view of buf (a byte swapped copy without numpy)"""
+    if np is not None:
+        return np.frombuffer(buf, dtype='>u4', count=count, offset=offset)
+
+    words = array('I', bytes(buf[offset:offset + 4 * count]))
+    if sys.byteorder == 'little':
+        words.byteswap()
+    return words
+
+
+def _diffIndices(wa, wb, n, chunk=4096):
+    """Indices below n where wa and wb differ"""
+    if np is not None:
+        return np.flatnonzero(wa[:n] != wb[:n])
+
+    # Compare in chunks (in C), only scan the chunks that differ
+    ret = []
+    for pos in range(0, n, chunk):
+        end = min(pos + chunk, n)
+        if wa[pos:end] != wb[pos:end]:
+            ret.extend([i for i in range(pos, end) if wa[i] != wb[i]])
+    return ret
+
+
+def decodeTimestamp(value):
+    """Decode a USR_ACCESS TIMESTAMP value, None if it is not a valid date"""
+    day   = (value >> 27) & 0x1F
+    month = (value >> 23) & 0x0F
+    year  = (value >> 17) & 0x3F
+    hour  = (value >> 12) & 0x1F
+    mins  = (value >> 6) & 0x3F
+    secs  = value & 0x3F
+
+    if not (1 <= day <= 31 and 1 <= month <= 12 and hour < 24 and mins < 60 and secs < 60):
+        return None
+
+    return f'{2000 + year:04d}-{month:02d}-{day:02d} {hour:02d}:{mins:02d}:{secs:02d}'
+
+
+def walkPackets(buf, offset, length):
+    """Walk the configuration packets of the data at offset.
+
+    Returns (words, writes): the big-endian word view of the data from the
+    first sync word and a list of (register, word index, word count) of the
+    register writes.
+    """
+    sync = buf.find(SYNC_WORD, offset, offset + length)
+    if sync < 0:
+        return None, []
+
+    count = (offset + length - sync) // 4
+    words = _wordArray(buf, sync, count)
+    writes = []
+    reg = None
+    i = 1
+
+    while i < count:
+        w = int(words[i])
+        i += 1
+        kind = w >> 29
+
+        if kind == 1:
+            op  = (w >> 27) & 0x3
+            reg = (w >> 13) & 0x3FFF
+            cnt = w & 0x7FF
+        elif kind == 2:
+            op  = (w >> 27) & 0x3
+            cnt = w & 0x7FFFFFF
+        else:
+            # Padding after the desync or between SLR streams, look for the next sync word
+            nxt = buf.find(SYNC_WORD, sync + 4 * i, offset + length)
+            if nxt < 0 or (nxt - sync) % 4:
+                break
+            i = (nxt - sync) // 4 + 1
+            continue
+
+        if op == 2 and reg is not None:
+            writes.append((reg, i, min(cnt, count - i)))
+
+        i += cnt
+
+    return words, writes
+
+
+def _hashPass(buf, dataStart, dataEnd, info):
+    """File and configuration data sha256/crc32 in a single pass"""
+    fileSha = hashlib.sha256()
+    dataSha = hashlib.sha256()
+    fileCrc = 0
+    dataCrc = 0
+
+    for pos in range(0, len(buf), CHUNK_SIZE):
+        chunk = buf[pos:pos+CHUNK_SIZE]
+        fileSha.update(chunk)
+        fileCrc = zlib.crc32(chunk, fileCrc)
+
+        a = max(pos, dataStart)
+        b = min(pos + len(chunk), dataEnd)
+
+        if a < b:
+            part = chunk[a-pos:b-pos]
+            dataSha.update(part)
+            dataCrc = zlib.crc32(part, dataCrc)
+
+    info['sha256']     = fileSha.hexdigest()
+    info['crc32']      = f'{fileCrc:08X}'
+    info['dataSha256'] = dataSha.hexdigest()
+    info['dataCrc32']  = f'{dataCrc:08X}'
+
+
+def decodeMcs(path, fout):
+    """Stream an MCS file into fout (binary, 0xFF filled gaps from the first record address).
+
+    Records may come out of order, but not below the address of the first one.
+
+    Returns a dictionary with the record counts and the address range.
+    """
+    data  = {'records': 0, 'checksumErrors': 0, 'start': None, 'end': 0}
+    upper = 0
+    pos   = None
+
+    with open(path, 'rb') as f:
+        for line in f:
+            line = line.strip()
+            if not line.startswith(b':'):
+                continue
+
+            rec = bytes.fromhex(line[1:].decode())
+            if sum(rec) & 0xFF != 0:
+                data['checksumErrors'] += 1
+
+            n, addr, rtype = rec[0], (rec[1] << 8) | rec[2], rec[3]
+            payload = rec[4:4+n]
+
+            if rtype == 0x00:
+                addr += upper
+                data['records'] += 1
+
+                if pos is None:
+                    data['start'] = pos = addr
+
+                if addr < data['start']:
+                    raise ValueError(f"{path}: record at 0x{addr:08x} below the first record address 0x{data['start']:08x}")
+
+                if addr < pos:
+                    # Out of order records, write in place (may run past the current end)
+                    fout.seek(addr - data['start'])
+                    fout.write(payload)
+                    fout.seek(0, os.SEEK_END)
+                    pos = max(pos, addr + n)
+                else:
+                    if addr > pos:
+                        fout.write(b'\xff' * (addr - pos))
+                    fout.write(payload)
+                    pos = addr + n
+
+                data['end'] = max(data['end'], addr + n)
+
+            elif rtype == 0x01:
+                break
+            elif rtype == 0x02:
+                upper = int.from_bytes(payload, 'big') << 4
+            elif rtype == 0x04:
+                upper = int.from_bytes(payload, 'big') << 16
+
+    fout.flush()
+    return data
+
+
+class Image(object):
+    """Memory mapped image file with its parsed information"""
+
+    def __init__(self, path):
+        self.path = path
+        self.ext  = os.path.splitext(path)[1].lower()
+        self.info = {'file': path, 'type': self.ext[1:], 'size': os.path.getsize(path)}
+        self._tmp = None
+
+        if self.ext == '.mcs':
+            # Decoded to a temporary file, the configuration data is the whole decoded image
+            self._tmp = tempfile.TemporaryFile()
+            self.info.update(decodeMcs(path, self._tmp))
+            self._file = self._tmp
+        else:
+            self._file = open(path, 'rb')
+
+        size = os.fstat(self._file.fileno()).st_size
+        self.buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+        self.dataStart = 0
+        self.dataEnd   = len(self.buf)
+
+        if self.ext == '.bit':
+            fields, pos, length = promgen.parseBitHeader(self.buf, path)
+            self.dataStart = pos
+            self.dataEnd   = pos + length
+            self.info['design'] = fields.get('a')
+            self.info['part']   = fields.get('b')
+            self.info['date']   = f"{fields.get('c')} {fields.get('d')}"
+
+        elif self.ext == '.pdi':
+            self.info['pdiIdent'] = self.buf[0x14:0x18] == PDI_IDENT
+
+        self.words, self.writes = (None, [])
+
+        if self.ext != '.pdi':
+            self.words, self.writes = walkPackets(self.buf, self.dataStart, self.dataEnd - self.dataStart)
+            self._parseWrites()
+
+    def close(self):
+        self.words = None
+        if isinstance(self.buf, mmap.mmap):
+            try:
+                self.buf.close()
+            except BufferError:
+                # Array views still held (exception traceback), unmapped when released
+                pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _value(self, reg):
+        for r, i, n in self.writes:
+            if r == reg and n >= 1:
+                return int(self.words[i])
+        return None
+
+    def _parseWrites(self):
+        idcode = self._value(REG_IDCODE)
+        axss   = self._value(REG_AXSS)
+        wbstar = self._value(REG_WBSTAR)
+
+        if idcode is not None:
+            self.info['idcode'] = f'{idcode:08X}'
+
+        if axss is not None:
+            self.info['usrAccess'] = f'{axss:08X}'
+            self.info['usrAccessTimestamp'] = decodeTimestamp(axss)
+
+        if wbstar is not None:
+            self.info['wbstar'] = f'{wbstar:08X}'
+
+        self.info['crcChecks']  = [f'{int(self.words[i]):08X}' for r, i, n in self.writes if r == REG_CRC and n >= 1]
+        self.info['fdriWords']  = sum([n for r, i, n in self.writes if r == REG_FDRI])
+        self.info['compressed'] = any([r == REG_MFWR for r, i, n in self.writes])
+        self.info['syncWords']  = len(self.writes) > 0
+
+    def frameData(self):
+        """List of the FDRI payloads as word arrays"""
+        return [self.words[i:i+n] for r, i, n in self.writes if r == REG_FDRI and n > 0]
+
+    def inspect(self):
+        _hashPass(self.buf, self.dataStart, self.dataEnd, self.info)
+        return self.info
+
+
+def inspectFile(path):
+    try:
+        with Image(path) as img:
+            return img.inspect()
+    except Exception as e:
+        return {'file': path, 'error': str(e)}
+
+
+def diffImages(pathA, pathB, fw=None, maxList=20):
+    """Frame level diff of the configuration data of two images"""
+    with Image(pathA) as a, Image(pathB) as b:
+        if fw is None:
+            fw = frameWords(a.info.get('part')) or frameWords(b.info.get('part'))
+
+        # The array views of the mapped files are released before the files are closed
+        return _diff(a, b, fw, maxList)
+
+
+def _diff(a, b, fw, maxList):
+    ret = {'a': a.path, 'b': b.path}
+    fa = a.frameData()
+    fb = b.frameData()
+
+    if fa and fb:
+        if np is not None:
+            wa = np.concatenate(fa) if len(fa) > 1 else fa[0]
+            wb = np.concatenate(fb) if len(fb) > 1 else fb[0]
+        else:
+            wa = fa[0] if len(fa) == 1 else sum(fa[1:], fa[0])
+            wb = fb[0] if len(fb) == 1 else sum(fb[1:], fb[0])
+        ret['unit'] = 'FDRI words'
+    else:
+        # No frame data (encrypted, pdi or raw data), compare the configuration data bytes
+        if np is not None:
+            wa = np.frombuffer(a.buf, np.uint8, count=a.dataEnd - a.dataStart, offset=a.dataStart)
+            wb = np.frombuffer(b.buf, np.uint8, count=b.dataEnd - b.dataStart, offset=b.dataStart)
+        else:
+            wa = memoryview(a.buf)[a.dataStart:a.dataEnd]
+            wb = memoryview(b.buf)[b.dataStart:b.dataEnd]
+        ret['unit'] = 'data bytes'
+        fw = None
+
+    n = min(len(wa), len(wb))
+    diff = _diffIndices(wa, wb, n)
+
+    ret['lengthA']    = int(len(wa))
+    ret['lengthB']    = int(len(wb))
+    ret['different']  = int(len(diff)) + abs(len(wa) - len(wb))
+    ret['frameWords'] = fw
+
+    if fw:
+        frames = np.unique(diff // fw) if np is not None else sorted(set([d // fw for d in diff]))
+        ret['framesTotal']     = int(max(len(wa), len(wb)) // fw)
+        ret['framesDifferent'] = int(len(frames)) + int(abs(len(wa) - len(wb)) // fw)
+        ret['frames']          = [int(f) for f in frames[:maxList]]
+    else:
+        ret['offsets'] = [int(o) for o in diff[:maxList]]
+
+    return ret
+
+
+def _summary(info):
+    if 'error' in info:
+        return f"{info['file']}: ERROR {info['error']}"
+
+    ret = f"{info['file']}: {info['type']} {info['size']} bytes, data sha256 {info['dataSha256'][:16]} crc32 {info['dataCrc32']}"
+
+    for key in ['design', 'part', 'date', 'idcode', 'usrAccess', 'usrAccessTimestamp', 'wbstar']:
+        if info.get(key) is not None:
+            ret += f"\n    {key:20} {info[key]}"
+
+    if info.get('syncWords'):
+        ret += f"\n    {'fdriWords':20} {info['fdriWords']}{' (compressed)' if info['compressed'] else ''}"
+        ret += f"\n    {'crcChecks':20} {' '.join(info['crcChecks']) or 'none'}"
+
+    if info['type'] == 'mcs':
+        ret += f"\n    {'records':20} {info['records']} ({info['checksumErrors']} checksum errors), address {info['start'] or 0:#x}-{info['end']:#x}"
+
+    return ret
+
+
+def findImages(paths):
+    ret = []
+    for p in paths:
+        if os.path.isdir(p):
+            for root, dirs, files in os.walk(p):
+                dirs.sort()
+                ret += [os.path.join(root, f) for f in sorted(files) if os.path.splitext(f)[1].lower() in EXTENSIONS]
+        else:
+            ret.append(p)
+    return ret
+
+
+if __name__ == "__main__":
+
+    # Set the argument parser
+    parser = argparse.ArgumentParser('Image Inspect')
+
+    parser.add_argument(
+        "paths",
+        nargs    = '*',
+        help     = "Image files or directories (searched recursively)"
+    )
+
+    parser.add_argument(
+        "--diff",
+        nargs    = 2,
+        default  = None,
+        metavar  = ('OLD', 'NEW'),
+        help     = "Frame level diff of two images"
+    )
+
+    parser.add_argument(
+        "--frameWords",
+        type     = int,
+        required = False,
+        default  = None,
+        help     = "Words per frame for the diff (default: from the part, 101 7-series, 123 UltraScale, 93 UltraScale+)"
+    )
+
+    parser.add_argument(
+        "--jobs",
+        type     = int,
+        required = False,
+        default  = os.cpu_count(),
+        help     = "Number of worker processes for directories"
+    )
+
+    parser.add_argument(
+        "--json",
+        action   = 'store_true',
+        default  = False,
+        help     = "JSON output"
+    )
+
+    args = parser.parse_args()
+
+    if args.diff is not None:
+        ret = diffImages(args.diff[0], args.diff[1], args.frameWords)
+
+        if args.json:
+            print(json.dumps(ret, indent=2))
+        else:
+            print(f"{ret['a']} vs {ret['b']}: {ret['different']} {ret['unit']} differ ({ret['lengthA']} vs {ret['lengthB']})")
+            if 'frames' in ret:
+                print(f"    {ret['framesDifferent']} of {ret['framesTotal']} frames ({ret['frameWords']} words) differ, first: {ret['frames']}")
+            else:
+                print(f"    first offsets: {ret['offsets']}")
+
+        sys.exit(1 if ret['different'] else 0)
+
+    files = findImages(args.paths)
+
+    if not files:
+        parser.error("No image files")
+
+    if len(files) > 1 and args.jobs > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            infos = list(pool.map(inspectFile, files))
+    else:
+        infos = [inspectFile(f) for f in files]
+
+    if args.json:
+        print(json.dumps(infos, indent=2))
+    else:
+        for info in infos:
+            print(_summary(info))
+
+    if any(['error' in i for i in infos]):
+        sys.exit(1)
@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+#-----------------------------------------------------------------------------
+# Title      : PROM image generation
+# ----------------------------------------------------------------------------
+# This file is part of the 'SLAC Firmware Standard Library'. It is subject to
+# the license terms in the LICENSE.txt file found in the top-level directory
+# of this distribution and at:
+#    https://confluence.slac.stanford.edu/display/ppareg/LICENSE.html.
+# No part of the 'SLAC Firmware Standard Library', including this file, may be
+# copied, modified, propagated, or distributed except according to the terms
+# contained in the LICENSE.txt file.
+# ----------------------------------------------------------------------------
+
+##
+# @file promgen.py
+# Write .mcs (Intel HEX) and .bin PROM images from a .bit file without Vivado.
+#
+# Takes the same options as the write_cfgmem call of vivado/promgen.tcl:
+#   --format    MCS or BIN
+#   --interface SPIx1, SPIx2, SPIx4, SPIx8, BPIx8, BPIx16, SMAPx8, ...
+#   --size      PROM size in MB
+#   --loadbit   "up 0x0 file.bit [up|down addr file.bit ...]"
+#   --loaddata  "up 0x400000 data.bin [...]"
+#
+# The bitstream is the .bit file data following the header (the same bytes
+# as the .bin file from write_bitstream). BPI and SMAP images are bit swapped
+# (--disableBitSwap to turn off), SPI images are written as is. For SPIx8 the
+# image is split between the two x4 flashes: the FPGA reads D[3:0] from the
+# primary flash and D[7:4] from the secondary flash, so each flash byte holds
+# the nibbles of two consecutive image bytes (first byte in the upper nibble),
+# written to <file>_primary and <file>_secondary.
+#
+# Bulk mode converts every .bit file of an images/ directory on a process
+# pool, skipping the images with an up to date PROM file. It runs outside of
+# Vivado, so regenerating the PROM images of many targets or flash sizes does
+# not pay the Vivado start-up per image:
+#   python3 promgen.py --imagesDir images --interface SPIx4 --size 128
+#
+# This is a standalone tool, the build (vivado/promgen.tcl) still uses
+# write_cfgmem. The output is NOT verified to be identical to write_cfgmem:
+# the SPIx8 nibble order, the default BPI/SMAP bit swap, the MCS record
+# length and line endings and the 'down' placement were not compared against
+# Vivado-generated images. cmp the output against a write_cfgmem reference
+# image of the same interface before using it to program hardware.
+
+import os
+import sys
+import glob
+import time
+import struct
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+INTERFACES = ['SMAPx8', 'SMAPx16', 'SMAPx32', 'SERIALx1', 'SPIx1', 'SPIx2', 'SPIx4', 'SPIx8', 'BPIx8', 'BPIx16']
+
+# Bit reversal of each byte value
+BITSWAP = bytes([int(f'{i:08b}'[::-1], 2) for i in range(256)])
+
+# .bit header magic: length 9, 0ff00ff00ff00ff000, length 1, 'a'
+BIT_MAGIC = b'\x00\x09\x0f\xf0\x0f\xf0\x0f\xf0\x0f\xf0\x00\x00\x01'
+
+MCS_RECORD = 16
+
+
+def parseBitHeader(buf, path=''):
+    """Parse the header of a .bit file held in buf (bytes or mmap).
+
+    Returns (fields, offset, length): the header fields ('a' design name,
+    'b' part, 'c' date, 'd' time) and the offset and length of the
+    configuration data.
+    """
+    if buf[:len(BIT_MAGIC)] != BIT_MAGIC:
+        raise ValueError(f"{path}: not a .bit file")
+
+    pos = len(BIT_MAGIC)
+    fields = {}
+
+    while pos < len(buf):
+        key = buf[pos:pos+1].decode(errors='replace')
+        pos += 1
+
+        if key == 'e':
+            length = struct.unpack('>I', buf[pos:pos+4])[0]
+            pos += 4
+
+            if pos + length > len(buf):
+                raise ValueError(f"{path}: truncated bitstream, expected {length} bytes, got {len(buf) - pos}")
+
+            return fields, pos, length
+
+        length = struct.unpack('>H', buf[pos:pos+2])[0]
+        pos += 2
+        fields[key] = bytes(buf[pos:pos+length]).rstrip(b'\x00').decode(errors='replace')
+        pos += length
+
+    raise ValueError(f"{path}: no bitstream data field")
+
+
+class BitFile(object):
+    """Parsed .bit file: header fields and the configuration data"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            raw = f.read()
+
+        fields, pos, length = parseBitHeader(raw, path)
+
+        self.path   = path
+        self.data   = raw[pos:pos+length]
+        self.design = fields.get('a')
+        self.part   = fields.get('b')
+        self.date   = fields.get('c')
+        self.time   = fields.get('d')
+
+
+def parseLoad(spec):
+    """Split a write_cfgmem -loadbit/-loaddata string into (direction, address, file) tuples"""
+    words = spec.split()
+
+    if len(words) % 3 != 0:
+        raise ValueError(f"Load spec must be 'up|down address file' triples: {spec}")
+
+    ret = []
+    for i in range(0, len(words), 3):
+        direction, addr, path = words[i:i+3]
+        if direction not in ('up', 'down'):
+            raise ValueError(f"Load direction must be up or down: {direction}")
+        ret.append((direction, int(addr, 0), path))
+
+    return ret
+
+
+def buildRegions(loadbit, loaddata, interface, bitSwap=True, size=None):
+    """Return the sorted list of (address, bytes) regions of the PROM image"""
+    swap = bitSwap and (interface.startswith('BPI') or interface.startswith('SMAP'))
+    regions = []
+
+    for direction, addr, path in loadbit:
+        data = BitFile(path).data
+        if swap:
+            data = data.translate(BITSWAP)
+        regions.append((direction, addr, data, path))
+
+    for direction, addr, path in loaddata:
+        with open(path, 'rb') as f:
+            regions.append((direction, addr, f.read(), path))
+
+    ret = []
+    for direction, addr, data, path in regions:
+        start = addr if direction == 'up' else addr - len(data) + 1
+        if start < 0:
+            raise ValueError(f"{path}: does not fit below address {addr:#x}")
+        ret.append((start, data, path))
+
+    ret.sort(key=lambda r: r[0])
+
+    # Check for overlaps and the PROM size
+    for (a, da, pa), (b, db, pb) in zip(ret, ret[1:]):
+        if a + len(da) > b:
+            raise ValueError(f"{pa} ({a:#x}-{a+len(da)-1:#x}) overlaps {pb} ({b:#x})")
+
+    if size is not None and ret:
+        end = ret[-1][0] + len(ret[-1][1])
+        if end > int(size * 1024 * 1024):
+            raise ValueError(f"Image ends at {end:#x}, larger than the {size} MB PROM")
+
+    return [(a, d) for a, d, p in ret]
+
+
+def splitSpix8(regions):
+    """Split SPIx8 regions into the (primary, secondary) x4 flash regions"""
+    pri = []
+    sec = []
+
+    for addr, data in regions:
+        if addr % 2:
+            raise ValueError(f"SPIx8 regions must start on an even address: {addr:#x}")
+
+        if len(data) % 2:
+            data += b'\xff'
+
+        if np is not None:
+            arr = np.frombuffer(data, np.uint8).reshape(-1, 2)
+            p = ((arr[:, 0] & 0x0F) << 4) | (arr[:, 1] & 0x0F)
+            s = (arr[:, 0] & 0xF0) | (arr[:, 1] >> 4)
+            p, s = p.astype(np.uint8).tobytes(), s.astype(np.uint8).tobytes()
+        else:
+            p = bytes([((data[i] & 0x0F) << 4) | (data[i+1] & 0x0F) for i in range(0, len(data), 2)])
+            s = bytes([(data[i] & 0xF0) | (data[i+1] >> 4) for i in range(0, len(data), 2)])
+
+        pri.append((addr // 2, p))
+        sec.append((addr // 2, s))
+
+    return pri, sec
+
+
+def _record(rtype, addr, data):
+    rec = bytes([len(data), (addr >> 8) & 0xFF, addr & 0xFF, rtype]) + data
+    return b':' + (rec + bytes([(-sum(rec)) & 0xFF])).hex().upper().encode() + b'\n'
+
+
+def _dataRecords(addr, data):
+    """Data records of a chunk inside one 64 kB segment"""
+    full = len(data) // MCS_RECORD
+
+    if np is not None and full:
+        # Whole records at once: (count, addrHi, addrLo, type, data[16], checksum)
+        body = np.frombuffer(data, np.uint8, count=full * MCS_RECORD).reshape(full, MCS_RECORD)
+        offs = (addr & 0xFFFF) + MCS_RECORD * np.arange(full, dtype=np.uint32)
+
+        rec = np.empty((full, MCS_RECORD + 5), np.uint8)
+        rec[:, 0] = MCS_RECORD
+        rec[:, 1] = offs >> 8
+        rec[:, 2] = offs & 0xFF
+        rec[:, 3] = 0
+        rec[:, 4:-1] = body
+        rec[:, -1] = (-rec[:, :-1].sum(axis=1, dtype=np.uint32)) & 0xFF
+
+        hexs = np.frombuffer(rec.tobytes().hex().upper().encode(), np.uint8).reshape(full, -1)
+        line = np.empty((full, hexs.shape[1] + 2), np.uint8)
+        line[:, 0] = ord(':')
+        line[:, 1:-1] = hexs
+        line[:, -1] = ord('\n')
+
+        out = [line.tobytes()]
+    else:
+        out = [_record(0x00, (addr + i) & 0xFFFF, data[i:i+MCS_RECORD]) for i in range(0, full * MCS_RECORD, MCS_RECORD)]
+
+    if len(data) > full * MCS_RECORD:
+        out.append(_record(0x00, (addr + full * MCS_RECORD) & 0xFFFF, data[full * MCS_RECORD:]))
+
+    return b''.join(out)
+
+
+def writeMcs(regions, path):
+    """Intel HEX records, with an extended linear address record for each 64 kB segment"""
+    with open(path, 'wb') as f:
+        upper = None
+
+        for addr, data in regions:
+            pos = 0
+
+            while pos < len(data):
+                a = addr + pos
+                if (a >> 16) != upper:
+                    upper = a >> 16
+                    f.write(_record(0x04, 0, struct.pack('>H', upper)))
+
+                n = min(len(data) - pos, 0x10000 - (a & 0xFFFF))
+                f.write(_dataRecords(a, data[pos:pos+n]))
+                pos += n
+
+        f.write(b':00000001FF\n')
+
+
+def writeBin(regions, path):
+    """Raw image from address 0, gaps filled with 0xFF"""
+    with open(path, 'wb') as f:
+        pos = 0
+        for addr, data in regions:
+            if addr > pos:
+                f.write(b'\xff' * (addr - pos))
+            f.write(data)
+            pos = addr + len(data)
+
+
+def writeCfgmem(output, fmt, interface, loadbit, loaddata='', size=None, bitSwap=True):
+    """Write the PROM image of the -loadbit/-loaddata regions, returns the list of files written"""
+    fmt = fmt.lower()
+    if fmt not in ('mcs', 'bin'):
+        raise ValueError(f"Format must be MCS or BIN: {fmt}")
+
+    # Case insensitive, like the write_cfgmem options
+    names = {i.lower(): i for i in INTERFACES}
+    if interface.lower() not in names:
+        raise ValueError(f"Interface must be one of {INTERFACES}: {interface}")
+    interface = names[interface.lower()]
+
+    regions = buildRegions(parseLoad(loadbit), parseLoad(loaddata), interface, bitSwap, size)
+    writer  = writeMcs if fmt == 'mcs' else writeBin
+
+    if interface == 'SPIx8':
+        root, ext = os.path.splitext(output)
+        pri, sec  = splitSpix8(regions)
+        files     = [f'{root}_primary{ext}', f'{root}_secondary{ext}']
+        writer(pri, files[0])
+        writer(sec, files[1])
+    else:
+        files = [output]
+        writer(regions, output)
+
+    return files
+
+
+def _bulkOne(bit, fmt, interface, size, loaddata, bitSwap, force):
+    output = os.path.splitext(bit)[0] + '.' + fmt.lower()
+
+    if interface.lower() == 'spix8':
+        root, ext = os.path.splitext(output)
+        check = f'{root}_primary{ext}'
+    else:
+        check = output
+
+    if not force and os.path.exists(check) and os.path.getmtime(check) >= os.path.getmtime(bit):
+        return bit, []
+
+    return bit, writeCfgmem(output, fmt, interface, f'up 0x0 {bit}', loaddata, size, bitSwap)
+
+
+if __name__ == "__main__":
+
+    # Set the argument parser
+    parser = argparse.ArgumentParser('PROM Generation')
+
+    parser.add_argument(
+        "--file",
+        type     = str,
+        required = False,
+        default  = None,
+        help     = "Output file (SPIx8 writes <file>_primary and <file>_secondary)"
+    )
+
+    parser.add_argument(
+        "--format",
+        type     = str,
+        required = False,
+        default  = 'MCS',
+        help     = "MCS or BIN"
+    )
+
+    parser.add_argument(
+        "--interface",
+        type     = str,
+        required = True,
+        help     = f"PROM interface {INTERFACES}"
+    )
+
+    parser.add_argument(
+        "--size",
+        type     = float,
+        required = False,
+        default  = None,
+        help     = "PROM size in MB"
+    )
+
+    parser.add_argument(
+        "--loadbit",
+        type     = str,
+        required = False,
+        default  = '',
+        help     = "Bit files, i.e. 'up 0x0 top.bit'"
+    )
+
+    parser.add_argument(
+        "--loaddata",
+        type     = str,
+        required = False,
+        default  = '',
+        help     = "User data files, i.e. 'up 0x400000 data.bin'"
+    )
+
+    parser.add_argument(
+        "--disableBitSwap",
+        action   = 'store_true',
+        default  = False,
+        help     = "Do not bit swap BPI and SMAP images"
+    )
+
+    parser.add_argument(
+        "--imagesDir",
+        type     = str,
+        required = False,
+        default  = None,
+        help     = "Bulk mode: write a PROM file beside every .bit file of the directory"
+    )
+
+    parser.add_argument(
+        "--jobs",
+        type     = int,
+        required = False,
+        default  = os.cpu_count(),
+        help     = "Bulk mode: number of worker processes"
+    )
+
+    parser.add_argument(
+        "--force",
+        action   = 'store_true',
+        default  = False,
+        help     = "Bulk mode: rewrite the PROM files that are already up to date"
+    )
+
+    args = parser.parse_args()
+    start = time.monotonic()
+
+    if args.imagesDir is not None:
+        bits = sorted(glob.glob(os.path.join(args.imagesDir, '*.bit')))
+
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            futs = [pool.submit(_bulkOne, b, args.format, args.interface, args.size, args.loaddata,
+                                not args.disableBitSwap, args.force) for b in bits]
+            errors = 0
+
+            for fut in futs:
+                try:
+                    bit, files = fut.result()
+                    print(f"{bit}: " + (', '.join(files) if files else 'up to date'))
+                except Exception as e:
+                    errors += 1
+                    print(f"Error: {e}")
+
+        print(f"{len(bits)} images in {time.monotonic() - start:.1f} s")
+
+        if errors:
+            sys.exit(1)
+
+    else:
+        if args.file is None or not args.loadbit:
+            parser.error("--file and --loadbit are required without --imagesDir")
+
+        files = writeCfgmem(args.file, args.format, args.interface, args.loadbit, args.loaddata, args.size, not args.disableBitSwap)
+
+        for f in files:
+            print(f"PROM file written to {f}")
+        print(f"Done in {time.monotonic() - start:.2f} s")
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+#-----------------------------------------------------------------------------
+# Title      : Release compression backends
+# ----------------------------------------------------------------------------
+# This file is part of the 'SLAC Firmware Standard Library'. It is subject to
+# the license terms in the LICENSE.txt file found in the top-level directory
+# of this distribution and at:
+#    https://confluence.slac.stanford.edu/display/ppareg/LICENSE.html.
+# No part of the 'SLAC Firmware Standard Library', including this file, may be
+# copied, modified, propagated, or distributed except according to the terms
+# contained in the LICENSE.txt file.
+# ----------------------------------------------------------------------------
+
+##
+# @file releaseCompress.py
+# Multi-threaded compression writers used by the release scripts.
+#
+#   gzip : block-parallel deflate (same scheme as pigz). Each block is primed
+#          with the last 32 kB of the previous block and ends on a sync flush,
+#          so the blocks concatenate into a single standard gzip member that
+#          plain gunzip decompresses.
+#   xz   : blocks compressed independently into concatenated .xz streams
+#          (supported by xz, unxz and Python lzma).
+#   zstd : native multi-threaded zstd through the optional 'zstandard' package.
+#
+# Can also be run as a script to compress files beside the originals, i.e.
+#   python3 releaseCompress.py --method gzip --level 9 --threads 64 image.bit
+
+import os
+import sys
+import time
+import zlib
+import lzma
+import struct
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+METHODS = ['gzip', 'xz', 'zstd']
+
+EXTENSIONS = {'gzip': '.gz',
+              'xz':   '.xz',
+              'zstd': '.zst'}
+
+DEFAULT_LEVEL = {'gzip': 9,
+                 'xz':   6,
+                 'zstd': 10}
+
+# Deflate history window size
+GZIP_WINDOW = 32 * 1024
+
+
+def defaultThreads():
+    return os.cpu_count() or 1
+
+
+class BlockWriter(object):
+    """Base class for the block-parallel writers.
+
+    Data written is cut into fixed size blocks that are compressed on a
+    thread pool (zlib and lzma release the GIL) and written to the output in
+    order. At most 2 * threads blocks are in flight.
+    """
+
+    blockSize = 1024 * 1024
+
+    def __init__(self, fileobj, level, threads):
+        self.fileobj  = fileobj
+        self.level    = level
+        self.threads  = threads if threads else defaultThreads()
+        self.pool     = ThreadPoolExecutor(max_workers=self.threads)
+        self.pending  = deque()
+        self.buf      = bytearray()
+        self.inBytes  = 0
+        self.outBytes = 0
+        self.closed   = False
+        self._prev    = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _compress(self, block, prev):
+        raise NotImplementedError
+
+    def _submit(self, block):
+        self.pending.append(self.pool.submit(self._compress, block, self._prev))
+        self._prev = block
+
+        while len(self.pending) > 2 * self.threads:
+            self._drain(self.pending.popleft())
+
+    def _drain(self, fut):
+        data = fut.result()
+        self.fileobj.write(data)
+        self.outBytes += len(data)
+
+    def write(self, data):
+        self.inBytes += len(data)
+        self.buf += data
+
+        while len(self.buf) >= self.blockSize:
+            block = bytes(self.buf[:self.blockSize])
+            del self.buf[:self.blockSize]
+            self._submit(block)
+
+        return len(data)
+
+    def _finish(self):
+        pass
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+
+        try:
+            if self.buf:
+                self._submit(bytes(self.buf))
+                self.buf = bytearray()
+
+            while self.pending:
+                self._drain(self.pending.popleft())
+
+            self._finish()
+
+        finally:
+            self.pool.shutdown()
+
+
+class ParallelGzipWriter(BlockWriter):
+    """Single member gzip stream compressed in parallel blocks"""
+
+    def __init__(self, fileobj, level=9, threads=None, name=None, mtime=None):
+        super().__init__(fileobj, level, threads)
+        self.crc = 0
+
+        # gzip header with FNAME, same layout as gzip.GzipFile
+        flags = 0x08 if name else 0x00
+        mtime = int(time.time()) if mtime is None else int(mtime)
+        xfl   = 2 if level == 9 else (4 if level == 1 else 0)
+
+        hdr = b'\x1f\x8b\x08' + bytes([flags]) + struct.pack('<L', mtime) + bytes([xfl, 255])
+        if name:
+            hdr += name.encode('latin-1') + b'\x00'
+
+        self.fileobj.write(hdr)
+        self.outBytes += len(hdr)
+
+    def write(self, data):
+        self.crc = zlib.crc32(data, self.crc)
+        return super().write(data)
+
+    def _compress(self, block, prev):
+        if prev is None:
+            comp = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS, 9)
+        else:
+            comp = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS, 9, zdict=prev[-GZIP_WINDOW:])
+
+        return comp.compress(block) + comp.flush(zlib.Z_SYNC_FLUSH)
+
+    def _finish(self):
+        # Empty final deflate block followed by the gzip trailer
+        comp = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS, 9)
+        data = comp.flush(zlib.Z_FINISH) + struct.pack('<LL', self.crc, self.inBytes & 0xFFFFFFFF)
+        self.fileobj.write(data)
+        self.outBytes += len(data)
+
+
+class ParallelXzWriter(BlockWriter):
+    """Concatenated .xz streams, one per block"""
+
+    blockSize = 8 * 1024 * 1024
+
+    def __init__(self, fileobj, level=6, threads=None):
+        super().__init__(fileobj, level, threads)
+
+    def _compress(self, block, prev):
+        return lzma.compress(block, format=lzma.FORMAT_XZ, check=lzma.CHECK_CRC64, preset=self.level)
+
+
+class ZstdWriter(object):
+    """Multi-threaded zstd writer (requires the 'zstandard' package)"""
+
+    def __init__(self, fileobj, level=10, threads=None):
+        if zstandard is None:
+            raise Exception("zstd compression requires the 'zstandard' python package: pip install zstandard")
+
+        self.threads  = threads if threads else defaultThreads()
+        self.inBytes  = 0
+        self.counter  = _CountingWriter(fileobj)
+        self.stream   = zstandard.ZstdCompressor(level=level, threads=self.threads).stream_writer(self.counter, closefd=False)
+
+    @property
+    def outBytes(self):
+        return self.counter.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, data):
+        self.inBytes += len(data)
+        return self.stream.write(data)
+
+    def close(self):
+        self.stream.close()
+
+
+class _CountingWriter(object):
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.count   = 0
+
+    def write(self, data):
+        self.count += len(data)
+        return self.fileobj.write(data)
+
+    def flush(self):
+        if hasattr(self.fileobj, 'flush'):
+            self.fileobj.flush()
+
+
+def openWriter(fileobj, method='gzip', level=None, threads=None, name=None):
+    """Return a compressing writer for fileobj.
+
+    name is the original file name stored in the gzip header (FNAME).
+    """
+    if method not in METHODS:
+        raise Exception(f"Invalid compression method {method}, must be one of {METHODS}")
+
+    if level is None:
+        level = DEFAULT_LEVEL[method]
+
+    if method == 'gzip':
+        return ParallelGzipWriter(fileobj, level=level, threads=threads, name=name)
+    elif method == 'xz':
+        return ParallelXzWriter(fileobj, level=level, threads=threads)
+    else:
+        return ZstdWriter(fileobj, level=level, threads=threads)
+
+
+def compressFile(src, dst=None, method='gzip', level=None, threads=None):
+    """Compress src to dst (default: src + extension), returns (inBytes, outBytes)"""
+    if dst is None:
+        dst = src + EXTENSIONS[method]
+
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        with openWriter(fout, method, level, threads, name=os.path.basename(src)) as w:
+            while True:
+                buf = fin.read(4 * 1024 * 1024)
+                if not buf:
+                    break
+                w.write(buf)
+
+    return w.inBytes, w.outBytes
+
+
+if __name__ == "__main__":
+
+    # Set the argument parser
+    parser = argparse.ArgumentParser('Release Compression')
+
+    parser.add_argument(
+        "files",
+        nargs    = '+',
+        help     = "Files to compress, output is written beside each file"
+    )
+
+    parser.add_argument(
+        "--method",
+        type     = str,
+        required = False,
+        default  = 'gzip',
+        choices  = METHODS,
+        help     = "Compression method"
+    )
+
+    parser.add_argument(
+        "--level",
+        type     = int,
+        required = False,
+        default  = None,
+        help     = f"Compression level (default: {DEFAULT_LEVEL})"
+    )
+
+    parser.add_argument(
+        "--threads",
+        type     = int,
+        required = False,
+        default  = None,
+        help     = "Number of compression threads (default: cpu count)"
+    )
+
+    parser.add_argument(
+        "--output",
+        type     = str,
+        required = False,
+        default  = None,
+        help     = "Output file name (single input file only)"
+    )
+
+    args = parser.parse_args()
+
+    if args.output is not None and len(args.files) != 1:
+        sys.exit("--output requires a single input file")
+
+    for f in args.files:
+        start = time.monotonic()
+        inBytes, outBytes = compressFile(f, args.output, args.method, args.level, args.threads)
+        elapsed = time.monotonic() - start
+        rate = inBytes / elapsed / 1e6 if elapsed > 0 else 0.0
+
+        print(f"{f}: {inBytes} -> {outBytes} bytes ({100.0 * outBytes / max(inBytes, 1):.1f}%) in {elapsed:.2f} s ({rate:.1f} MB/s)")
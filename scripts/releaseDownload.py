@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+#-----------------------------------------------------------------------------
+# Title      : Release asset download
+# ----------------------------------------------------------------------------
+# This file is part of the 'SLAC Firmware Standard Library'. It is subject to
+# the license terms in the LICENSE.txt file found in the top-level directory
+# of this distribution and at:
+#    https://confluence.slac.stanford.edu/display/ppareg/LICENSE.html.
+# No part of the 'SLAC Firmware Standard Library', including this file, may be
+# copied, modified, propagated, or distributed except according to the terms
+# contained in the LICENSE.txt file.
+# ----------------------------------------------------------------------------
+
+##
+# @file releaseDownload.py
+# Ranged, resumable download of GitHub release assets.
+#
+# The asset is cut into segments that are fetched with HTTP Range requests on
+# a pool of worker threads and written in place into a preallocated
+# '<name>.part' file. The progress of each segment is kept in
+# '<name>.part.json', so an interrupted transfer resumes where it stopped. The
+# file is renamed to its final name only after its size matches the size
+# reported by the release API.
+#
+# AssetCache keeps the downloaded assets in a shared content-addressed
+# directory (sha256/<ab>/<sha256>), indexed by the GitHub asset id, and
+# copies them into place, so fetching the same asset again costs no network
+# transfer. The cache is pruned to a size limit, least recently used first.
+
+import os
+import json
+import shutil
+import hashlib
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# HTTP status codes worth retrying
+RETRY_STATUS = (408, 429, 500, 502, 503, 504)
+
+DEFAULT_CACHE_DIR    = os.environ.get('RUCKUS_ASSET_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'ruckus', 'assets'))
+DEFAULT_CACHE_MAX_GB = 20.0
+DEFAULT_SEGMENT_SIZE = 16 * 1024 * 1024
+BUFFER_SIZE          = 1024 * 1024
+
+# Progress is saved after this many bytes
+SAVE_INTERVAL = 4 * 1024 * 1024
+
+
+class DownloadError(Exception):
+    pass
+
+
+class _Segment(object):
+    __slots__ = ('start', 'end', 'done')
+
+    def __init__(self, start, end, done):
+        self.start = start
+        self.end   = end
+        self.done  = done
+
+
+class AssetDownloader(object):
+    """Download release assets with parallel Range requests"""
+
+    def __init__(self, token, jobs=4, segmentSize=DEFAULT_SEGMENT_SIZE, retries=5, backoff=2.0, session=None):
+        self.jobs        = max(1, jobs)
+        self.segmentSize = segmentSize
+        self.retries     = retries
+        self.backoff     = backoff
+        self.headers     = {'Accept': 'application/octet-stream'}
+        self.lock        = threading.Lock()
+
+        if token:
+            self.headers['Authorization'] = f'token {token}'
+
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.jobs)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+
+        self.session = session
+
+    def _sleep(self, attempt):
+        time.sleep(self.backoff * (2 ** attempt) * (1.0 + 0.25 * random.random()))
+
+    def _resolve(self, url):
+        """Follow the API redirect once, returns the storage URL (or url if not redirected).
+
+        The Authorization header is only sent to the API, not to the storage host.
+        """
+        resp = self.session.get(url, headers=self.headers, allow_redirects=False, stream=True, timeout=60)
+        resp.close()
+
+        if resp.status_code in (301, 302, 303, 307, 308) and 'Location' in resp.headers:
+            return resp.headers['Location'], {'Accept': 'application/octet-stream'}
+
+        return url, self.headers
+
+    def _loadState(self, stateFile, size):
+        try:
+            with open(stateFile) as f:
+                state = json.load(f)
+
+            if state['size'] == size and state['segmentSize'] == self.segmentSize:
+                return state['done']
+
+        except (OSError, ValueError, KeyError):
+            pass
+
+        return {}
+
+    def _saveState(self, stateFile, size, segments):
+        tmp = stateFile + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'size': size, 'segmentSize': self.segmentSize,
+                       'done': {str(s.start): s.done for s in segments}}, f)
+        os.replace(tmp, stateFile)
+
+    def _fetch(self, fd, seg, target, stateFile, size, segments, ranged):
+        """Download one segment into the file, retrying from its current offset"""
+        error = None
+
+        for attempt in range(self.retries + 1):
+            if seg.start + seg.done >= seg.end:
+                return
+
+            url, headers = target[0]
+            headers = dict(headers)
+
+            if ranged:
+                headers['Range'] = f'bytes={seg.start + seg.done}-{seg.end - 1}'
+            else:
+                seg.done = 0
+
+            try:
+                with self.session.get(url, headers=headers, stream=True, timeout=(60, 300)) as resp:
+
+                    # Signed storage URLs expire, resolve again
+                    if resp.status_code in (401, 403) and attempt < self.retries:
+                        with self.lock:
+                            target[0] = self._resolve(target[1])
+                        error = f'HTTP {resp.status_code}'
+                        continue
+
+                    if resp.status_code not in (200, 206):
+                        if resp.status_code not in RETRY_STATUS:
+                            raise DownloadError(f'HTTP {resp.status_code}')
+                        error = f'HTTP {resp.status_code}'
+                        self._sleep(attempt)
+                        continue
+
+                    if ranged and resp.status_code != 206:
+                        raise DownloadError('Server ignored the range request')
+
+                    pending = 0
+                    for chunk in resp.iter_content(chunk_size=BUFFER_SIZE):
+                        chunk = chunk[:seg.end - seg.start - seg.done]
+                        os.pwrite(fd, chunk, seg.start + seg.done)
+                        seg.done += len(chunk)
+                        pending  += len(chunk)
+
+                        if pending >= SAVE_INTERVAL:
+                            pending = 0
+                            with self.lock:
+                                self._saveState(stateFile, size, segments)
+
+                if seg.start + seg.done >= seg.end:
+                    return
+
+                error = 'connection closed early'
+
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                error = str(e)
+
+            if attempt < self.retries:
+                self._sleep(attempt)
+
+        raise DownloadError(f'segment {seg.start}-{seg.end - 1} failed after {self.retries+1} attempts ({error})')
+
+    def download(self, url, dest, size):
+        """Download url to dest, size is the asset size reported by the release API"""
+        part      = dest + '.part'
+        stateFile = part + '.json'
+        start     = time.monotonic()
+
+        done = self._loadState(stateFile, size) if os.path.exists(part) else {}
+
+        # Check if the server supports ranges, needed for resume and parallel segments
+        target = [self._resolve(url), url]
+        ranged = True
+
+        if size > 0:
+            headers = dict(target[0][1])
+            headers['Range'] = 'bytes=0-0'
+            with self.session.get(target[0][0], headers=headers, stream=True, timeout=60) as resp:
+                ranged = resp.status_code == 206
+
+        if ranged:
+            segments = [_Segment(s, min(s + self.segmentSize, size), done.get(str(s), 0))
+                        for s in range(0, size, self.segmentSize)]
+        else:
+            segments = [_Segment(0, size, 0)]
+
+        resumed = sum([s.done for s in segments])
+
+        # Preallocate the file, the segments are written in place
+        fd = os.open(part, os.O_RDWR | os.O_CREAT, 0o644)
+
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+
+            jobs = self.jobs if ranged else 1
+            self._saveState(stateFile, size, segments)
+
+            with ThreadPoolExecutor(max_workers=jobs) as pool:
+                futs = [pool.submit(self._fetch, fd, s, target, stateFile, size, segments, ranged)
+                        for s in segments if s.start + s.done < s.end]
+
+                try:
+                    for f in futs:
+                        f.result()
+                finally:
+                    with self.lock:
+                        self._saveState(stateFile, size, segments)
+
+            os.fsync(fd)
+
+        finally:
+            os.close(fd)
+
+        got = os.path.getsize(part)
+        if got != size or sum([s.done for s in segments]) != size:
+            raise DownloadError(f'{dest}: size mismatch, expected {size} bytes, got {sum([s.done for s in segments])}')
+
+        os.replace(part, dest)
+        os.remove(stateFile)
+
+        elapsed = time.monotonic() - start
+        nBytes  = size - resumed
+        print(f"Downloaded {os.path.basename(dest)}: {nBytes/1e6:.1f} MB in {elapsed:.1f} s "
+              f"({nBytes/1e6/max(elapsed,1e-9):.1f} MB/s, {jobs} connections"
+              + (f", resumed at {resumed/1e6:.1f} MB" if resumed else '') + ")")
+
+        return nBytes, elapsed
+
+
+def sha256File(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            buf = f.read(BUFFER_SIZE)
+            if not buf:
+                break
+            h.update(buf)
+    return h.hexdigest()
+
+
+def copyFile(src, dst):
+    """Copy src to dst, replacing dst. The copy is a new (writable) file, not the read-only cache blob"""
+    tmp = f'{dst}.{os.getpid()}.{threading.get_ident()}.tmp'
+    shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+class AssetCache(object):
+    """Content-addressed store of downloaded release assets.
+
+    <cacheDir>/sha256/<ab>/<sha256> : asset contents (read-only)
+    <cacheDir>/ids/<asset id>.json  : {'sha256', 'size', 'updated'} of an asset
+
+    The blob mtime is the last use time, the blobs are pruned to maxGb by it.
+    """
+
+    def __init__(self, downloader, cacheDir=DEFAULT_CACHE_DIR, maxGb=DEFAULT_CACHE_MAX_GB):
+        self.downloader = downloader
+        self.cacheDir   = cacheDir
+        self.maxBytes   = maxGb * 1024**3
+        self.hits       = 0
+        self.hitBytes   = 0
+        self.lock       = threading.Lock()
+        self._idLocks   = {}
+
+        os.makedirs(os.path.join(cacheDir, 'ids'), exist_ok=True)
+        os.makedirs(os.path.join(cacheDir, 'tmp'), exist_ok=True)
+
+    def blobPath(self, sha):
+        return os.path.join(self.cacheDir, 'sha256', sha[:2], sha)
+
+    def _idPath(self, assetId):
+        return os.path.join(self.cacheDir, 'ids', f'{assetId}.json')
+
+    def lookup(self, assetId, size, updated, digest=None):
+        """Return the blob path of an asset already in the cache, None otherwise"""
+        if digest is not None and digest.startswith('sha256:'):
+            sha = digest[7:]
+        else:
+            try:
+                with open(self._idPath(assetId)) as f:
+                    ent = json.load(f)
+            except (OSError, ValueError):
+                return None
+
+            if ent['size'] != size or ent['updated'] != updated:
+                return None
+
+            sha = ent['sha256']
+
+        path = self.blobPath(sha)
+
+        if os.path.isfile(path) and os.path.getsize(path) == size:
+            # Mark as recently used for the pruning
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            return path
+
+        return None
+
+    def prune(self, keep=None):
+        """Remove the least recently used blobs (except keep), and their id entries, until the cache fits maxBytes"""
+        blobs = []
+        for sub in os.scandir(os.path.join(self.cacheDir, 'sha256')) if os.path.isdir(os.path.join(self.cacheDir, 'sha256')) else []:
+            for ent in os.scandir(sub.path):
+                try:
+                    st = ent.stat()
+                except OSError:
+                    continue
+                blobs.append((st.st_mtime, st.st_size, ent.path))
+
+        total   = sum([b[1] for b in blobs])
+        removed = set()
+
+        for mtime, size, path in sorted(blobs):
+            if total <= self.maxBytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                removed.add(os.path.basename(path))
+            except OSError:
+                pass
+            total -= size
+
+        if not removed:
+            return
+
+        for ent in os.scandir(os.path.join(self.cacheDir, 'ids')):
+            try:
+                with open(ent.path) as f:
+                    if json.load(f)['sha256'] in removed:
+                        os.remove(ent.path)
+            except (OSError, ValueError, KeyError):
+                pass
+
+    def fetch(self, url, assetId, size, updated, dest, digest=None):
+        """Place the asset at dest, downloading it only if it is not in the cache"""
+
+        # The same asset requested for two destinations is only downloaded once
+        with self.lock:
+            idLock = self._idLocks.setdefault(assetId, threading.Lock())
+
+        with idLock:
+            blob = self._fetch(url, assetId, size, updated, digest, os.path.basename(dest))
+
+        if os.path.dirname(dest):
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+
+        copyFile(blob, dest)
+        return blob
+
+    def _fetch(self, url, assetId, size, updated, digest, name):
+        blob = self.lookup(assetId, size, updated, digest)
+
+        if blob is not None:
+            with self.lock:
+                self.hits     += 1
+                self.hitBytes += size
+            print(f"Cached {name}: {size/1e6:.1f} MB")
+
+        else:
+            # Downloads resume from the .part file in the cache tmp directory
+            tmp = os.path.join(self.cacheDir, 'tmp', f'{assetId}_{name}')
+            self.downloader.download(url, tmp, size)
+
+            sha = sha256File(tmp)
+            if digest is not None and digest.startswith('sha256:') and digest[7:] != sha:
+                os.remove(tmp)
+                raise DownloadError(f'asset {assetId}: sha256 mismatch, expected {digest[7:]}, got {sha}')
+
+            blob = self.blobPath(sha)
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.chmod(tmp, 0o444)
+            os.replace(tmp, blob)
+
+            idPath = self._idPath(assetId)
+            with open(idPath + '.tmp', 'w') as f:
+                json.dump({'sha256': sha, 'size': size, 'updated': updated}, f)
+            os.replace(idPath + '.tmp', idPath)
+
+            with self.lock:
+                self.prune(keep=blob)
+
+        return blob
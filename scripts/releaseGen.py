@@ -11,9 +11,10 @@
 # ----------------------------------------------------------------------------
 import os
 import git                 # GitPython
-from github import Github  # PyGithub
 import re
 import releaseNotes
+import releaseNotesCache
+import githubClient
 
 ghRepo = os.environ.get('TRAVIS_REPO_SLUG')
 token  = os.environ.get('GH_REPO_TOKEN')
@@ -35,14 +36,15 @@ if vpat.match(newTag) is None:
     exit("Not a release version")
 
 # Git server
-gh = Github(token)
+gh = githubClient.connect(token)
 remRepo = gh.get_repo(ghRepo)
 
 # Find previous tag
 oldTag = git.Git('.').describe('--abbrev=0','--tags',newTag + '^')
 
 # Get release notes
-md = releaseNotes.getReleaseNotes(locRepo = git.Git('.'), remRepo = remRepo, oldTag = oldTag, newTag = newTag)
+md = releaseNotes.getReleaseNotes(locRepo = git.Git('.'), remRepo = remRepo, oldTag = oldTag, newTag = newTag,
+                                  client = githubClient.RestClient(token), cache = releaseNotesCache.PullCache())
 md += releaseNotes.getCompareUrl(remRepo, oldTag, newTag)
 
 def releaseType(ver):
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+#-----------------------------------------------------------------------------
+# Title      : Release build image index
+# ----------------------------------------------------------------------------
+# This file is part of the 'SLAC Firmware Standard Library'. It is subject to
+# the license terms in the LICENSE.txt file found in the top-level directory
+# of this distribution and at:
+#    https://confluence.slac.stanford.edu/display/ppareg/LICENSE.html.
+# No part of the 'SLAC Firmware Standard Library', including this file, may be
+# copied, modified, propagated, or distributed except according to the terms
+# contained in the LICENSE.txt file.
+# ----------------------------------------------------------------------------
+
+##
+# @file releaseImages.py
+# Index of the build images found in the target image directories.
+#
+# Each image directory is read with a single os.scandir pass and the file
+# names are parsed once per target into (target, build, subType, extension)
+# keys. The parsed table is cached on disk and reused as long as the
+# directory mtime is unchanged (adding, removing or renaming an image always
+# updates the directory mtime).
+
+import os
+import json
+import time
+
+# A directory modified less than this many seconds before it was scanned
+# could still be changing within the mtime resolution, so it is not cached.
+RACY_SECONDS = 2.0
+
+
+def parseImageName(target, fn):
+    """Split an image file name into (build, subType, extension).
+
+    Build names have the format:
+        buildName = $(PROJECT)-$(PRJ_VERSION)-$(BUILD_TIME)-$(USER)-$(GIT_HASH_SHORT)
+    File name will either be:
+        buildName.extension
+    or
+        buildName_subType.extension
+
+    Returns None if the file does not belong to the target. The extension is
+    None if the file name does not match either format, the build is still
+    listed in that case.
+    """
+    if not fn.startswith(target):
+        return None
+
+    rest = fn[len(target):]
+
+    if '_' in rest:
+        build = target + rest.split('_')[0]
+    else:
+        build = target + rest.split('.')[0]
+
+    suffix  = fn[len(build):]
+    subType = ''
+    ext     = None
+
+    if suffix.startswith('.'):
+        ext = suffix[1:]
+
+    elif suffix.startswith('_'):
+        subType, sep, ext = suffix[1:].partition('.')
+
+        # subType is one character followed by word characters
+        if not sep or not subType or not (subType[1:] == '' or subType[1:].replace('_','').isalnum()):
+            subType, ext = '', None
+
+    if ext == '':
+        ext = None
+
+    return build, subType, ext
+
+
+class ImageIndex(object):
+    """Index of build images keyed by (target, build, subType, extension)"""
+
+    VERSION = 1
+
+    def __init__(self, cacheFile=None):
+        self.cacheFile = cacheFile
+        self.dirs      = {}
+        self._builds   = {}
+        self._buildSet = {}
+        self._images   = {}
+        self._dirty    = False
+
+        if cacheFile is not None:
+            try:
+                with open(cacheFile) as f:
+                    cache = json.load(f)
+
+                if cache['version'] == self.VERSION:
+                    self.dirs = cache['dirs']
+
+            except (OSError, ValueError, KeyError):
+                pass
+
+    def _scan(self, imageDir):
+        """Return the cached directory entry, rescanning if the mtime changed"""
+        imageDir = os.path.abspath(imageDir)
+        mtime = os.stat(imageDir).st_mtime_ns
+        ent   = self.dirs.get(imageDir)
+
+        if ent is None or ent['mtime'] != mtime:
+            with os.scandir(imageDir) as it:
+                files = [e.name for e in it if e.is_file()]
+
+            ent = {'mtime': mtime, 'files': files, 'targets': {}}
+
+            if (time.time_ns() - mtime) / 1e9 > RACY_SECONDS:
+                self.dirs[imageDir] = ent
+                self._dirty = True
+
+        return imageDir, ent
+
+    def addTarget(self, target, imageDir):
+        """Index the images of target located in imageDir"""
+        imageDir, ent = self._scan(imageDir)
+        rows = ent['targets'].get(target)
+
+        if rows is None:
+            rows = []
+            for fn in ent['files']:
+                key = parseImageName(target, fn)
+                if key is not None:
+                    rows.append([fn, *key])
+
+            ent['targets'][target] = rows
+
+            if imageDir in self.dirs:
+                self._dirty = True
+
+        builds = set()
+        images = {}
+
+        for fn, build, subType, ext in rows:
+            builds.add(build)
+
+            if ext is not None:
+                images.setdefault(build, {})[(subType, ext)] = os.path.join(imageDir, fn)
+
+        self._builds[target]   = sorted(builds)
+        self._buildSet[target] = builds
+        self._images[target]   = images
+
+    def builds(self, target):
+        """Sorted list of the build names of a target"""
+        return self._builds[target]
+
+    def latest(self, target):
+        builds = self._builds[target]
+        return builds[-1] if builds else None
+
+    def hasBuild(self, target, build):
+        return build in self._buildSet[target]
+
+    def images(self, target, build, extensions):
+        """Paths of the images of a build matching the extension list"""
+        exts = set([str(e) for e in extensions])
+        imgs = self._images[target].get(build, {})
+
+        return [imgs[k] for k in sorted(imgs, key=lambda k: os.path.basename(imgs[k])) if k[1] in exts]
+
+    def save(self):
+        if self.cacheFile is None or not self._dirty:
+            return
+
+        os.makedirs(os.path.dirname(self.cacheFile), exist_ok=True)
+
+        tmp = self.cacheFile + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'version': self.VERSION, 'dirs': self.dirs}, f)
+        os.replace(tmp, self.cacheFile)
+
+        self._dirty = False
@@ -16,13 +16,266 @@
 # Generate release notes for pull requests relative to a tag.
 
 from collections import OrderedDict as odict
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
 import re
 
+import git   # https://gitpython.readthedocs.io/en/stable/tutorial.html
+
+# Number of pull requests per batched GraphQL query
+GRAPHQL_BATCH = 25
+
+ISSUE_PATTERN = re.compile(r'(#\d+)')
 
-def getReleaseNotes(locRepo, remRepo, oldTag, newTag):
+_PR_FIELDS = """
+    number updatedAt title body additions deletions changedFiles
+    baseRefName headRefName
+    baseRepository { owner { login } }
+    headRepositoryOwner { login }
+    labels(first: 100, orderBy: {field: NAME, direction: ASC}) { nodes { name } }
+    comments(first: 100) { nodes { body } pageInfo { hasNextPage endCursor } }
+"""
 
-    # Get logs
-    loginfo = locRepo.log(f"{oldTag}...{newTag}", '--grep', "Merge pull request")
+_COMMENTS_QUERY = """
+query($owner: String!, $name: String!, $number: Int!, $cursor: String) {
+  repository(owner: $owner, name: $name) {
+    pullRequest(number: $number) {
+      comments(first: 100, after: $cursor) { nodes { body } pageInfo { hasNextPage endCursor } }
+    }
+  }
+}
+"""
+
+
+def _updatedAt(req):
+    # Same format as the GraphQL updatedAt
+    return req.updated_at.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def getPullInfo(remRepo, number, cache=None):
+    """PR information through the REST API (PyGithub), three or more calls per PR.
+
+    With a cache, the label and comment calls are skipped if the PR is unchanged.
+    """
+    req = remRepo.get_pull(number)
+
+    if cache is not None:
+        rec = cache.lookup(remRepo.full_name, number, _updatedAt(req))
+        if rec is not None:
+            return rec
+
+    return {'updatedAt':    _updatedAt(req),
+            'title':        req.title,
+            'body':         req.body,
+            'additions':    req.additions,
+            'deletions':    req.deletions,
+            'changedFiles': req.changed_files,
+            'baseLabel':    req.base.label,
+            'headLabel':    req.head.label,
+            'labels':       [lbl.name for lbl in req.get_labels()],
+            'comments':     [c.body for c in req.get_issue_comments()]}
+
+
+def getPullInfoBatch(client, repoName, numbers, batch=GRAPHQL_BATCH):
+    """PR information for a list of PR numbers through batched GraphQL queries.
+
+    client is a githubClient.RestClient (or a Recording/ReplayClient). Returns a
+    dictionary of PR number to the same record as getPullInfo().
+    """
+    owner, name = repoName.split('/')
+    numbers = sorted(set(numbers))
+    ret = {}
+
+    for i in range(0, len(numbers), batch):
+        sub = numbers[i:i+batch]
+
+        query  = 'query($owner: String!, $name: String!) {\n  repository(owner: $owner, name: $name) {\n'
+        query += ''.join([f'    pr{n}: pullRequest(number: {n}) {{ ...pr }}\n' for n in sub])
+        query += '  }\n}\nfragment pr on PullRequest {' + _PR_FIELDS + '}\n'
+
+        data = client.graphql(query, {'owner': owner, 'name': name})['repository']
+
+        for n in sub:
+            pr = data.get(f'pr{n}')
+
+            if pr is None:
+                raise ValueError(f"Pull request #{n} not found in {repoName}")
+
+            comments = [c['body'] for c in pr['comments']['nodes']]
+            page     = pr['comments']['pageInfo']
+
+            # More than 100 comments, page through the rest for this PR only
+            while page['hasNextPage']:
+                more = client.graphql(_COMMENTS_QUERY, {'owner': owner, 'name': name, 'number': n, 'cursor': page['endCursor']})
+                more = more['repository']['pullRequest']['comments']
+                comments += [c['body'] for c in more['nodes']]
+                page = more['pageInfo']
+
+            headOwner = pr['headRepositoryOwner']['login'] if pr['headRepositoryOwner'] else 'unknown'
+
+            ret[n] = {'updatedAt':    pr['updatedAt'],
+                      'title':        pr['title'],
+                      'body':         pr['body'],
+                      'additions':    pr['additions'],
+                      'deletions':    pr['deletions'],
+                      'changedFiles': pr['changedFiles'],
+                      'baseLabel':    f"{pr['baseRepository']['owner']['login']}:{pr['baseRefName']}",
+                      'headLabel':    f"{headOwner}:{pr['headRefName']}",
+                      'labels':       [lbl['name'] for lbl in pr['labels']['nodes']],
+                      'comments':     comments}
+
+    return ret
+
+
+def getPullUpdated(client, repoName, numbers, batch=100):
+    """Return a dictionary of PR number to updatedAt, batched GraphQL queries"""
+    owner, name = repoName.split('/')
+    numbers = sorted(set(numbers))
+    ret = {}
+
+    for i in range(0, len(numbers), batch):
+        sub = numbers[i:i+batch]
+
+        query  = 'query($owner: String!, $name: String!) {\n  repository(owner: $owner, name: $name) {\n'
+        query += ''.join([f'    pr{n}: pullRequest(number: {n}) {{ updatedAt }}\n' for n in sub])
+        query += '  }\n}\n'
+
+        data = client.graphql(query, {'owner': owner, 'name': name})['repository']
+
+        for n in sub:
+            if data.get(f'pr{n}') is None:
+                raise ValueError(f"Pull request #{n} not found in {repoName}")
+
+            ret[n] = data[f'pr{n}']['updatedAt']
+
+    return ret
+
+
+def getPulls(remRepo, numbers, client=None, cache=None, offline=False):
+    """Return a dictionary of PR number to PR record.
+
+    client : githubClient.RestClient (or Recording/ReplayClient) for batched
+             GraphQL queries, None for the REST API
+    cache  : releaseNotesCache.PullCache, only new or updated PRs are fetched
+    offline: records are only taken from the cache
+    """
+    repoName = remRepo.full_name
+    hits     = 0 if cache is None else cache.hits
+    ret      = {}
+
+    if offline:
+        if cache is None:
+            raise ValueError("Offline release notes require a pull request cache")
+
+        for n in numbers:
+            ret[n] = cache.get(repoName, n)
+
+        missing = [f'#{n}' for n in numbers if ret[n] is None]
+        if missing:
+            raise ValueError(f"Pull requests not in the cache {cache.path}: {', '.join(missing)}")
+
+        return ret
+
+    if client is None:
+        for n in numbers:
+            ret[n] = getPullInfo(remRepo, n, cache)
+
+    elif cache is None:
+        ret = getPullInfoBatch(client, repoName, numbers)
+
+    else:
+        # Cheap updatedAt query first, full records only for new or changed PRs
+        updated = getPullUpdated(client, repoName, numbers)
+        stale   = []
+
+        for n in numbers:
+            ret[n] = cache.lookup(repoName, n, updated[n])
+            if ret[n] is None:
+                stale.append(n)
+
+        if stale:
+            ret.update(getPullInfoBatch(client, repoName, stale))
+
+    if cache is not None:
+        for n in numbers:
+            cache.put(repoName, n, ret[n])
+        cache.commit()
+
+        print(f"Release notes {repoName}: {len(set(numbers))} pull requests, {cache.hits - hits} from cache {cache.path}")
+
+    return ret
+
+
+class PullRecord(object):
+    """One merged pull request of the release notes"""
+
+    __slots__ = ('PR', 'Branch', 'Author', 'Date', 'Title', 'body', 'changes',
+                 'Pull', 'Jira', 'Labels', 'Issues', 'IsRC')
+
+    def __init__(self, pr, branch, author, date):
+        self.PR     = pr
+        self.Branch = branch
+        self.Author = author
+        self.Date   = date
+        self.IsRC   = False
+
+
+# Fields of each commit in the NUL delimited log: author, date and message
+LOG_FORMAT = '%aN <%aE>%x00%ad%x00%B'
+
+
+def iterMergeLog(locRepo, oldTag, newTag, chunkSize=64*1024):
+    """Stream the PR merge commits of the range, yields PullRecord objects.
+
+    The log is read incrementally from the git process as NUL delimited
+    fields (-z separates the commits with a NUL as well), so the full log is
+    never held in memory.
+    """
+    proc = locRepo.log(f"{oldTag}...{newTag}", '-z', f'--format={LOG_FORMAT}',
+                       '--grep', "Merge pull request", as_process=True)
+    fields = []
+    tail   = b''
+
+    try:
+        while True:
+            chunk = proc.stdout.read(chunkSize)
+            tail += chunk
+            parts = tail.split(b'\0')
+
+            # Last part is incomplete until the end of the stream
+            tail = parts.pop() if chunk else b''
+            if not chunk and parts and parts[-1] == b'':
+                parts.pop()
+
+            for part in parts:
+                fields.append(part.decode('utf-8', errors='replace'))
+
+                if len(fields) == 3:
+                    author, date, message = fields
+                    fields = []
+
+                    for line in message.splitlines():
+                        if 'Merge pull request' in line:
+                            words = line.split()
+                            yield PullRecord(words[3], words[5], author, date)
+
+            if not chunk:
+                break
+
+    finally:
+        proc.wait()
+
+
+def getReleaseNotes(locRepo, remRepo, oldTag, newTag, client=None, cache=None, offline=False):
+    """Generate the release notes markdown.
+
+    By default the PR information is fetched with PyGithub, one PR at a time.
+    When client is set (githubClient.RestClient, RecordingClient or
+    ReplayClient) the PR numbers are collected from the git log first and
+    fetched with a few batched GraphQL queries instead. See getPulls() for the
+    cache and offline arguments.
+    """
 
     # Grouping of recors
     records = odict({'Bug': [],
@@ -32,131 +285,109 @@ def getReleaseNotes(locRepo, remRepo, oldTag, newTag):
                      'Unlabeled': []})
 
     details = []
-    entry = {}
 
     # Parse the log entries
-    for line in loginfo.splitlines():
-
-        if line.startswith('Author:'):
-            entry['Author'] = line[7:].lstrip()
-
-        elif line.startswith('Date:'):
-            entry['Date'] = line[5:].lstrip()
-
-        elif 'Merge pull request' in line:
-            entry['PR'] = line.split()[3].lstrip()
-            entry['Branch'] = line.split()[5].lstrip()
-
-            # Get PR info from github
-            req = remRepo.get_pull(int(entry['PR'][1:]))
-
-            # Check for empty PR description
-            if not req.body or req.body.strip() == "":
-                pr_url = f"https://github.com/{remRepo.full_name}/pull/{entry['PR'][1:]}"
-                raise ValueError(f"Pull request {entry['PR']} has an empty description. Please open your web browser, go to this PR, and fill in the description: {pr_url}")
-
-            # Detect Release Candidate PRs
-            if ('main' in req.base.label or 'master' in req.base.label) and 'pre-release' in req.head.label:
-                entry['IsRC'] = True
-
-            entry['Title'] = req.title
-            entry['body'] = req.body
-
-            entry['changes'] = req.additions + req.deletions
-            entry['Pull'] = entry['PR'] + f" ({req.additions} additions, {req.deletions} deletions, {req.changed_files} files changed)"
-
-            # Detect JIRA entry
-            if entry['Branch'].lower().startswith('slaclab/es'):
-                url = 'https://jira.slac.stanford.edu/issues/{}'.format(entry['Branch'].split('/')[1])
-                entry['Jira'] = url
-            else:
-                entry['Jira'] = None
-
-            entry['Labels'] = None
-            for lbl in req.get_labels():
-                if entry['Labels'] is None:
-                    entry['Labels'] = lbl.name.lower()
-                else:
-                    entry['Labels'] += ', ' + lbl.name.lower()
-
-            # Attempt to locate any issues mentioned in the body and comments
-            entry['Issues'] = None
-
-            # Generate a list with the bodies of the PR and all its comments
-            bodies = [entry['body']]
-            for c in req.get_issue_comments():
-                bodies.append(c.body)
-
-            # Look for the pattern '#\d+' in all the bodies, and add then to the
-            # entry['Issues'] list, avoiding duplications
-            for body in bodies:
-                iList = re.compile(r'(#\d+)').findall(body)
-                if iList is not None:
-                    for issue in iList:
-                        if entry['Issues'] is None:
-                            entry['Issues'] = issue
-                        elif issue not in entry['Issues']:
-                            entry['Issues'] += ', ' + issue
-
-            # Add both to details list and sectioned summary list
-            found = False
-            if entry['Labels'] is not None:
-                for label in records.keys():
-
-                    if label.lower() in entry['Labels']:
-                        records[label].append(entry)
-                        found = True
-
-            if not found:
-                records['Unlabeled'].append(entry)
-
-            details.append(entry)
-            entry = {}
+    prList = list(iterMergeLog(locRepo, oldTag, newTag))
+
+    # Get PR info from github
+    prInfo = getPulls(remRepo, [int(e.PR[1:]) for e in prList], client, cache, offline)
+
+    for entry in prList:
+        req = prInfo[int(entry.PR[1:])]
+
+        # Check for empty PR description
+        if not req['body'] or req['body'].strip() == "":
+            pr_url = f"https://github.com/{remRepo.full_name}/pull/{entry.PR[1:]}"
+            raise ValueError(f"Pull request {entry.PR} has an empty description. Please open your web browser, go to this PR, and fill in the description: {pr_url}")
+
+        # Detect Release Candidate PRs
+        if ('main' in req['baseLabel'] or 'master' in req['baseLabel']) and 'pre-release' in req['headLabel']:
+            entry.IsRC = True
+
+        entry.Title = req['title']
+        entry.body = req['body']
+
+        entry.changes = req['additions'] + req['deletions']
+        entry.Pull = entry.PR + f" ({req['additions']} additions, {req['deletions']} deletions, {req['changedFiles']} files changed)"
+
+        # Detect JIRA entry
+        if entry.Branch.lower().startswith('slaclab/es'):
+            entry.Jira = 'https://jira.slac.stanford.edu/issues/{}'.format(entry.Branch.split('/')[1])
+        else:
+            entry.Jira = None
+
+        if req['labels']:
+            entry.Labels = ', '.join([lbl.lower() for lbl in req['labels']])
+        else:
+            entry.Labels = None
+
+        # Attempt to locate any issues mentioned in the body and comments.
+        # Look for the pattern '#\d+' in the bodies of the PR and all its
+        # comments, avoiding duplications
+        issues = None
+        for body in [entry.body] + req['comments']:
+            for issue in ISSUE_PATTERN.findall(body):
+                if issues is None:
+                    issues = issue
+                elif issue not in issues:
+                    issues += ', ' + issue
+
+        entry.Issues = issues
+
+        # Add both to details list and sectioned summary list
+        found = False
+        if entry.Labels is not None:
+            for label in records.keys():
+
+                if label.lower() in entry.Labels:
+                    records[label].append(entry)
+                    found = True
+
+        if not found:
+            records['Unlabeled'].append(entry)
+
+        details.append(entry)
+
+    md = io.StringIO()
 
     # Generate summary text
-    md = f'# Pull Requests Since {oldTag}\n'
+    md.write(f'# Pull Requests Since {oldTag}\n')
 
     # Summary list is sectioned
     for label in ['Interface-change', 'Bug', 'Enhancement', 'Documentation', 'Unlabeled']:
-        subLab = ""
 
         # Sort by changes
-        entries = sorted(records[label], key=lambda v: v['changes'], reverse=True)
+        entries = [e for e in sorted(records[label], key=lambda v: v.changes, reverse=True) if not e.IsRC]
 
-        for entry in entries:
-            if 'IsRC' not in entry:
-                subLab += f" 1. {entry['PR']} - {entry['Title']}\n"
+        if entries:
+            md.write(f"### {label}\n")
 
-        if len(subLab) > 0:
-            md += f"### {label}\n" + subLab
+            for entry in entries:
+                md.write(f" 1. {entry.PR} - {entry.Title}\n")
 
     # Detailed list
-    det = '# Pull Request Details\n'
+    md.write('# Pull Request Details\n')
 
     # Sort records by pull request number
-    details = sorted(details, key=lambda v: v['PR'], reverse=False)
+    details = sorted(details, key=lambda v: v.PR, reverse=False)
 
     # Generate detailed PR notes
     for entry in details:
-        if 'IsRC' not in entry: # Don't generate output for Release Candidate PRs
-            det += f"### {entry['Title']}"
-            det += '\n|||\n|---:|:---|\n'
+        if not entry.IsRC: # Don't generate output for Release Candidate PRs
+            md.write(f"### {entry.Title}")
+            md.write('\n|||\n|---:|:---|\n')
 
             for i in ['Author', 'Date', 'Pull', 'Branch', 'Issues', 'Jira', 'Labels']:
-                if entry[i] is not None:
-                    det += f'|**{i}:**|{entry[i]}|\n'
-
-            det += '\n**Notes:**\n'
-            for line in entry['body'].splitlines():
-                det += '> ' + line + '\n'
-            det += '\n-------\n'
-            det += '\n\n'
-
+                if getattr(entry, i) is not None:
+                    md.write(f'|**{i}:**|{getattr(entry, i)}|\n')
 
-    # Include details
-    md += det
+            md.write('\n**Notes:**\n')
+            for line in entry.body.splitlines():
+                md.write('> ' + line + '\n')
+            md.write('\n-------\n')
+            md.write('\n\n')
 
-    return md
+    return md.getvalue()
 
 
 def getCompareUrl(remRepo, oldTag, newTag):
@@ -167,11 +398,129 @@ def getCompareUrl(remRepo, oldTag, newTag):
 
     return f"\n**Full Changelog**: https://github.com/{remRepo.full_name}/compare/{oldTag}...{newTag}\n"
 
-if __name__ == "__main__":
-    import os
+def getSubmoduleChanges(locRepo, oldTag, newTag, subDir='submodules'):
+    """Return a list of (path, oldSha, newSha) for the submodules changed between the tags"""
+
+    def tree(tag):
+        ret = {}
+        for line in locRepo.ls_tree(tag, '--', subDir.rstrip('/') + '/').splitlines():
+            info, path = line.split('\t', 1)
+            mode, kind, sha = info.split()
+            if kind == 'commit':
+                ret[path] = sha
+        return ret
+
+    old = tree(oldTag)
+    new = tree(newTag)
+
+    return [(path, old[path], new[path]) for path in sorted(new) if path in old and old[path] != new[path]]
+
+
+def getSubmoduleNotes(locRepo, oldTag, newTag, getRepo, client=None, cache=None, offline=False, jobs=4, subDir='submodules'):
+    """Release notes of the submodules (i.e. surf, ruckus) bumped between the tags.
 
-    import git   # https://gitpython.readthedocs.io/en/stable/tutorial.html
-    from github import Github # https://pygithub.readthedocs.io/en/latest/introduction.html
+    The submodules are processed in parallel. getRepo(fullName) returns the
+    remote repository object for a 'owner/name' string (i.e. Github.get_repo).
+    Submodules that are not checked out locally are skipped.
+    """
+    changes = getSubmoduleChanges(locRepo, oldTag, newTag, subDir)
+
+    def notes(path, oldSha, newSha):
+        subRepo = git.Git(os.path.join(locRepo.working_dir, path))
+
+        try:
+            url  = subRepo.remote('get-url', 'origin')
+            name = re.compile(r'github\.com[:/](?P<name>[^/]+/[^/]+?)(\.git)?/?$').search(url).group('name')
+            subOld = subRepo.describe('--tags', '--always', oldSha)
+            subNew = subRepo.describe('--tags', '--always', newSha)
+        except (git.GitCommandError, AttributeError) as e:
+            print(f"Skipping submodule {path} release notes: {e}")
+            return ''
+
+        remRepo = getRepo(name)
+
+        md  = f'# Submodule {path}: {subOld} -> {subNew}\n'
+        md += getReleaseNotes(subRepo, remRepo, subOld, subNew, client, cache, offline)
+        md += getCompareUrl(remRepo, oldSha, newSha)
+
+        return md + '\n'
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        futs = [pool.submit(notes, *c) for c in changes]
+
+        return ''.join([f.result() for f in futs])
+
+
+if __name__ == "__main__":
+    import argparse
+    import types
+
+    import githubClient
+    import releaseNotesCache
+
+    # Set the argument parser
+    parser = argparse.ArgumentParser('Release Notes')
+
+    parser.add_argument(
+        "--rest",
+        action   = 'store_true',
+        required = False,
+        default  = False,
+        help     = "Fetch the pull requests one at a time with the REST API instead of batched GraphQL queries"
+    )
+
+    parser.add_argument(
+        "--record",
+        type     = str,
+        required = False,
+        default  = None,
+        help     = "Record the GraphQL responses to this JSON file"
+    )
+
+    parser.add_argument(
+        "--replay",
+        type     = str,
+        required = False,
+        default  = None,
+        help     = "Generate the notes offline from a file written with --record"
+    )
+
+    parser.add_argument(
+        "--cache",
+        type     = str,
+        required = False,
+        default  = releaseNotesCache.DEFAULT_CACHE_FILE,
+        help     = "Pull request cache file"
+    )
+
+    parser.add_argument(
+        "--noCache",
+        action   = 'store_true',
+        required = False,
+        default  = False,
+        help     = "Do not use the pull request cache"
+    )
+
+    parser.add_argument(
+        "--offline",
+        action   = 'store_true',
+        required = False,
+        default  = False,
+        help     = "Generate the notes from the pull request cache only, without connecting to github"
+    )
+
+    parser.add_argument(
+        "--submodules",
+        action   = 'store_true',
+        required = False,
+        default  = False,
+        help     = "Append the release notes of the submodules/ bumped in the tag range"
+    )
+
+    args = parser.parse_args()
+
+    if args.offline and args.noCache:
+        parser.error("--offline requires the pull request cache")
 
     # Get most recent and previous tag
     newTag = git.Git('.').describe('--tags')
@@ -188,28 +537,51 @@ if __name__ == "__main__":
 
     project = re.compile(r'slaclab/(?P<name>.*?).git').search(url).group('name')
 
-    # Connect to the Git server
-    token = os.environ.get('GITHUB_TOKEN')
+    cache = None if args.noCache else releaseNotesCache.PullCache(args.cache)
+
+    if args.offline or args.replay is not None:
+        # Only the repository name is needed
+        def getRepo(name):
+            return types.SimpleNamespace(full_name=name)
 
-    if token is None:
-        print("Enter your github token. If you do no have one you can generate it here:")
-        print("    https://github.com/settings/tokens")
-        print("You may set it in your environment as GITHUB_TOKEN")
-        token = input("\nGithub token: ")
+        remRepo = getRepo(f'slaclab/{project}')
+        client  = None if args.offline else githubClient.ReplayClient(args.replay)
 
     else:
-        print("Using github token from user's environment.")
+        # Connect to the Git server
+        token = githubClient.getToken()
+
+        github  = githubClient.connect(token)
+        getRepo = github.get_repo
 
-    github = Github(token)
+        # Get the repo information
+        remRepo = getRepo(f'slaclab/{project}')
 
-    # Get the repo information
-    remRepo = github.get_repo(f'slaclab/{project}')
+        if args.rest:
+            client = None
+        elif args.record is not None:
+            client = githubClient.RecordingClient(githubClient.RestClient(token), args.record)
+        else:
+            client = githubClient.RestClient(token)
 
     md = getReleaseNotes(
         locRepo  = locRepo,
         remRepo  = remRepo,
         oldTag   = oldTag,
-        newTag   = newTag)
+        newTag   = newTag,
+        client   = client,
+        cache    = cache,
+        offline  = args.offline)
+
+    if args.submodules:
+        md += '\n' + getSubmoduleNotes(
+            locRepo  = locRepo,
+            oldTag   = oldTag,
+            newTag   = newTag,
+            getRepo  = getRepo,
+            client   = client,
+            cache    = cache,
+            offline  = args.offline)
 
     md += getCompareUrl(remRepo, oldTag, newTag)
 
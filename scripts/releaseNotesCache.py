@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+#-----------------------------------------------------------------------------
+# Title      : Release notes pull request cache
+# ----------------------------------------------------------------------------
+# This file is part of the 'SLAC Firmware Standard Library'. It is subject to
+# the license terms in the LICENSE.txt file found in the top-level directory
+# of this distribution and at:
+#    https://confluence.slac.stanford.edu/display/ppareg/LICENSE.html.
+# No part of the 'SLAC Firmware Standard Library', including this file, may be
+# copied, modified, propagated, or distributed except according to the terms
+# contained in the LICENSE.txt file.
+# ----------------------------------------------------------------------------
+
+##
+# @file releaseNotesCache.py
+# SQLite store of the normalized pull request records used by releaseNotes.py.
+#
+# Records are keyed by (repo, PR number) and hold the PR 'updated_at' time.
+# A cached record is reused as long as the PR 'updated_at' is unchanged
+# (editing the description, relabeling or commenting all update it), so
+# overlapping release note ranges (release candidates, the final release and
+# the CI releaseGen.py run) only fetch the new or changed pull requests.
+
+import os
+import json
+import sqlite3
+import threading
+
+DEFAULT_CACHE_FILE = os.path.join(os.environ.get('RUCKUS_GITHUB_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'ruckus', 'github')), 'pulls.sqlite')
+
+
+class PullCache(object):
+    """Persistent cache of pull request records"""
+
+    VERSION = 1
+
+    def __init__(self, path=DEFAULT_CACHE_FILE):
+        self.path   = path
+        self.hits   = 0
+        self.misses = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Shared by the submodule release notes threads
+        self.lock = threading.Lock()
+        self.db   = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS pulls ('
+                        'repo TEXT NOT NULL, number INTEGER NOT NULL, version INTEGER NOT NULL, '
+                        'updated_at TEXT NOT NULL, record TEXT NOT NULL, PRIMARY KEY (repo, number))')
+        self.db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get(self, repo, number):
+        """Return the cached record or None"""
+        with self.lock:
+            row = self.db.execute('SELECT version, record FROM pulls WHERE repo = ? AND number = ?',
+                                  (repo.lower(), int(number))).fetchone()
+
+        if row is None or row[0] != self.VERSION:
+            return None
+
+        return json.loads(row[1])
+
+    def lookup(self, repo, number, updatedAt):
+        """Return the cached record if it is still current, None otherwise"""
+        rec = self.get(repo, number)
+
+        with self.lock:
+            if rec is not None and rec.get('updatedAt') == updatedAt:
+                self.hits += 1
+                return rec
+
+            self.misses += 1
+            return None
+
+    def put(self, repo, number, record):
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO pulls (repo, number, version, updated_at, record) VALUES (?, ?, ?, ?, ?)',
+                            (repo.lower(), int(number), self.VERSION, record['updatedAt'], json.dumps(record)))
+
+    def commit(self):
+        with self.lock:
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            if self.db is not None:
+                self.db.commit()
+                self.db.close()
+                self.db = None
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+#-----------------------------------------------------------------------------
+# Title      : Release packaging engine
+# ----------------------------------------------------------------------------
+# This file is part of the 'SLAC Firmware Standard Library'. It is subject to
+# the license terms in the LICENSE.txt file found in the top-level directory
+# of this distribution and at:
+#    https://confluence.slac.stanford.edu/display/ppareg/LICENSE.html.
+# No part of the 'SLAC Firmware Standard Library', including this file, may be
+# copied, modified, propagated, or distributed except according to the terms
+# contained in the LICENSE.txt file.
+# ----------------------------------------------------------------------------
+
+##
+# @file releasePackager.py
+# Zip writer used by firmwareRelease.py. Source files are opened and read on
+# a bounded thread pool ahead of the (single) writer so that NFS latency is
+# overlapped, while entries are still written in the order they were added.
+#
+# An optional PackageCache keeps a manifest of (source, mtime, size) per
+# archive entry. Entries whose source is unchanged since the previous run are
+# copied raw (local header and data) from the previous archive instead of
+# being read from the source tree and written again.
+
+import os
+import copy
+import json
+import time
+import struct
+import shutil
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Files larger than this are streamed by the writer instead of being read
+# into memory by the pool. This bounds the read-ahead memory to roughly
+# (readAhead * PRELOAD_LIMIT) bytes.
+PRELOAD_LIMIT = 16 * 1024 * 1024
+
+# Copy buffer used when streaming large files into the archive
+COPY_BUFSIZE  = 1024 * 1024
+
+
+def defaultJobs():
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+def fmtBytes(n):
+    for unit in ['B', 'kB', 'MB', 'GB']:
+        if n < 1024.0 or unit == 'GB':
+            return f'{n:.1f} {unit}'
+        n /= 1024.0
+
+
+class PhaseTimer(object):
+    """Accumulate wall clock time per named phase, in the order first seen"""
+
+    def __init__(self):
+        self.phases = {}
+
+    def start(self, name):
+        self._name  = name
+        self._start = time.monotonic()
+
+    def stop(self):
+        self.add(self._name, time.monotonic() - self._start)
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def report(self, indent='    '):
+        width = max([len(k) for k in self.phases] + [1])
+        for name, sec in self.phases.items():
+            print(f'{indent}{name:<{width}} : {sec:8.3f} s')
+
+
+def copyRange(src, dst, offset, length):
+    """Copy length bytes starting at offset of file object src to dst"""
+    src.seek(offset)
+    while length > 0:
+        buf = src.read(min(length, COPY_BUFSIZE))
+        if not buf:
+            raise Exception(f'Unexpected end of file while copying from {src.name}')
+        dst.write(buf)
+        length -= len(buf)
+
+
+def reuseArchive(prev, new):
+    """Copy a previous archive to a new name.
+
+    The file name stored in a gzip header (FNAME) is updated to match the
+    new archive name, everything after the header is copied unchanged.
+    """
+    if os.path.abspath(prev) == os.path.abspath(new):
+        return
+
+    with open(prev, 'rb') as src, open(new, 'wb') as dst:
+        hdr = src.read(10)
+
+        # gzip member with FNAME and without a header CRC (FHCRC)
+        if hdr[0:3] == b'\x1f\x8b\x08' and hdr[3] & 0x08 and not hdr[3] & 0x02:
+            dst.write(hdr)
+
+            if hdr[3] & 0x04:
+                xlen = src.read(2)
+                dst.write(xlen)
+                dst.write(src.read(struct.unpack('<H', xlen)[0]))
+
+            while src.read(1) not in (b'\x00', b''):
+                pass
+
+            fname = os.path.basename(new)
+            if fname.endswith('.gz'):
+                fname = fname[:-3]
+            dst.write(fname.encode('latin-1') + b'\x00')
+
+        else:
+            dst.write(hdr)
+
+        shutil.copyfileobj(src, dst, COPY_BUFSIZE)
+
+
+class PackageCache(object):
+    """Persistent manifest of the entries written to a release archive.
+
+    The manifest is stored as <cacheDir>/<key>.json and records the archive
+    that was written along with [src, size, mtime_ns] for each entry. An entry
+    is reused while its source size and mtime are unchanged, like make does.
+    The previous archive is only trusted if its own size and mtime still match
+    the manifest.
+    """
+
+    VERSION = 2
+
+    def __init__(self, cacheDir, key):
+        self.path    = os.path.join(cacheDir, f'{key}.json')
+        self.prev    = {}
+        self.archive = None
+        self.entries = {}
+        self.reused  = 0
+        self.reusedBytes = 0
+
+        try:
+            with open(self.path) as f:
+                man = json.load(f)
+
+            st = os.stat(man['archive'])
+
+            if man['version'] == self.VERSION and st.st_size == man['size'] and st.st_mtime_ns == man['mtime']:
+                self.archive = man['archive']
+                self.prev    = man['entries']
+
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def lookup(self, dst, src, st):
+        """Return the previous manifest entry if src is unchanged, else None"""
+        ent = self.prev.get(dst)
+
+        if ent is not None and ent[0] == src and ent[1] == st.st_size and ent[2] == st.st_mtime_ns:
+            return ent
+
+        return None
+
+    def record(self, dst, src, st):
+        self.entries[dst] = [src, st.st_size, st.st_mtime_ns]
+
+    def unchanged(self, dstList):
+        """True if every (dst, src) pair is unchanged and nothing was removed"""
+        if self.archive is None or len(dstList) != len(self.prev):
+            return False
+
+        for dst, src in dstList:
+            try:
+                st = os.stat(src)
+            except OSError:
+                return False
+
+            ent = self.lookup(dst, src, st)
+
+            if ent is None:
+                return False
+
+            self.entries[dst] = ent
+
+        return True
+
+    def save(self, archive):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        st  = os.stat(archive)
+        man = {'version': self.VERSION,
+               'archive': os.path.abspath(archive),
+               'size':    st.st_size,
+               'mtime':   st.st_mtime_ns,
+               'entries': self.entries}
+
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(man, f)
+        os.replace(tmp, self.path)
+
+
+class ZipPackager(object):
+    """Ordered zip writer with a read-ahead thread pool.
+
+    addFile() only queues an entry. The queued entries are read by the pool
+    and written to the archive, in queue order, by flush() (called on exit).
+    Entries use the archive compression (ZIP_STORED for the Rogue zipfile).
+    """
+
+    def __init__(self, zipName, jobs=None, readAhead=None, timer=None, cache=None,
+                 compression=zipfile.ZIP_STORED, compresslevel=None):
+        self.zipName   = zipName
+        self.jobs      = jobs if jobs else defaultJobs()
+        self.readAhead = readAhead if readAhead else 4 * self.jobs
+        self.timer     = timer if timer is not None else PhaseTimer()
+        self.cache     = cache
+        self.names     = set()
+        self.nBytes    = 0
+        self.nEntries  = 0
+        self._queue    = []
+        self._readTime = 0.0
+        self._prevZip  = None
+        self._prevTmp  = None
+
+        if cache is not None and cache.archive is not None:
+            prev = cache.archive
+
+            # Re-generating the same archive name, keep the old one aside
+            if os.path.abspath(prev) == os.path.abspath(zipName):
+                self._prevTmp = prev = zipName + '.prev'
+                os.replace(zipName, prev)
+
+            self._prevZip = zipfile.ZipFile(prev, 'r')
+
+        self.zf = zipfile.ZipFile(file=zipName, mode='w', compression=compression, compresslevel=compresslevel)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.flush()
+        finally:
+            self.zf.close()
+
+            if self._prevZip is not None:
+                self._prevZip.close()
+
+            # Restore the previous archive if this one failed
+            if self._prevTmp is not None:
+                if exc_type is None:
+                    os.remove(self._prevTmp)
+                else:
+                    os.replace(self._prevTmp, self.zipName)
+
+        if exc_type is None and self.cache is not None:
+            self.cache.save(self.zipName)
+
+    def __contains__(self, dst):
+        return dst in self.names
+
+    def addFile(self, src, dst):
+        """Queue the file (or folder) src for the archive path dst"""
+        if dst in self.names:
+            raise Exception(f'Duplicate zipfile entry: {dst}')
+        self.names.add(dst)
+        self._queue.append((src, dst))
+
+    def open(self, dst, mode='w'):
+        """Open an in-memory generated entry, after all queued files"""
+        self.flush()
+        self.names.add(dst)
+        return self.zf.open(dst, mode)
+
+    def _prevInfo(self, dst, src, st):
+        """ZipInfo of dst in the previous archive if it can be copied raw"""
+        if self._prevZip is None or self.cache.lookup(dst, src, st) is None:
+            return None
+
+        try:
+            pinfo = self._prevZip.getinfo(dst)
+        except KeyError:
+            return None
+
+        # Entries written with a data descriptor are not copied raw
+        if pinfo.compress_type != self.zf.compression or pinfo.flag_bits & 0x08:
+            return None
+
+        return pinfo
+
+    def _read(self, src, dst):
+        start = time.monotonic()
+        zinfo = zipfile.ZipInfo.from_file(src, dst)
+        kind  = 'dir'
+        data  = None
+        st    = None
+
+        if not zinfo.is_dir():
+            st    = os.stat(src)
+            pinfo = self._prevInfo(dst, src, st)
+
+            if pinfo is not None:
+                return 'raw', pinfo, None, st, time.monotonic() - start
+
+            # Large files are streamed by the writer (ZipFile.write)
+            if zinfo.file_size > PRELOAD_LIMIT:
+                kind = 'stream'
+            else:
+                kind = 'data'
+                with open(src, 'rb') as fd:
+                    data = fd.read()
+
+        return kind, zinfo, data, st, time.monotonic() - start
+
+    def _copyRaw(self, pinfo):
+        """Copy the local header and data of pinfo from the previous archive"""
+        pfp = self._prevZip.fp
+        pfp.seek(pinfo.header_offset)
+        hdr = pfp.read(zipfile.sizeFileHeader)
+
+        if hdr[0:4] != zipfile.stringFileHeader:
+            raise Exception(f'Bad local file header for {pinfo.filename} in {self._prevZip.filename}')
+
+        nameLen, extraLen = struct.unpack('<HH', hdr[26:30])
+        length = zipfile.sizeFileHeader + nameLen + extraLen + pinfo.compress_size
+
+        zinfo = copy.copy(pinfo)
+        zinfo.header_offset = self.zf.fp.tell()
+
+        copyRange(pfp, self.zf.fp, pinfo.header_offset, length)
+
+        self.zf.filelist.append(zinfo)
+        self.zf.NameToInfo[zinfo.filename] = zinfo
+        self.zf.start_dir = self.zf.fp.tell()
+
+    def _write(self, src, kind, zinfo, data, st):
+        dst = zinfo.filename
+
+        if kind == 'dir':
+            self.zf.write(src, dst)
+
+        elif kind == 'raw':
+            self._copyRaw(zinfo)
+            self.cache.entries[dst] = self.cache.prev[dst]
+            self.cache.reused += 1
+            self.cache.reusedBytes += zinfo.file_size
+            self.nBytes += zinfo.file_size
+
+        else:
+            if kind == 'data':
+                self.zf.writestr(zinfo, data, compress_type=self.zf.compression, compresslevel=self.zf.compresslevel)
+            else:
+                self.zf.write(src, dst)
+            self.nBytes += zinfo.file_size
+
+            if self.cache is not None:
+                self.cache.record(dst, src, st)
+
+        self.nEntries += 1
+
+    def flush(self):
+        """Read and write all queued entries, preserving the queue order"""
+        if not self._queue:
+            return
+
+        queue = self._queue
+        self._queue = []
+        pending = deque()
+        waitTime = 0.0
+        start = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            it = iter(queue)
+
+            # Prime the read-ahead window
+            for src, dst in it:
+                pending.append((src, pool.submit(self._read, src, dst)))
+                if len(pending) >= self.readAhead:
+                    break
+
+            while pending:
+                src, fut = pending.popleft()
+
+                t = time.monotonic()
+                kind, zinfo, data, st, readTime = fut.result()
+                waitTime += time.monotonic() - t
+                self._readTime += readTime
+
+                # Keep the window full before writing this entry
+                for nsrc, ndst in it:
+                    pending.append((nsrc, pool.submit(self._read, nsrc, ndst)))
+                    break
+
+                self._write(src, kind, zinfo, data, st)
+
+        total = time.monotonic() - start
+        self.timer.add('read (pool, cumulative)', self._readTime)
+        self.timer.add('writer wait', waitTime)
+        self.timer.add('write', total - waitTime)
+        self._readTime = 0.0
+
+    def report(self, elapsed):
+        rate = self.nBytes / elapsed if elapsed > 0 else 0.0
+        print(f'\nWrote {self.nEntries} entries, {fmtBytes(self.nBytes)} to {self.zipName} '
+              f'in {elapsed:.3f} s ({fmtBytes(rate)}/s, {self.jobs} read threads)')
+        if self.cache is not None:
+            print(f'    Reused {self.cache.reused} unchanged entries ({fmtBytes(self.cache.reusedBytes)}) from the previous archive')
+        self.timer.report()
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+#-----------------------------------------------------------------------------
+# Title      : Release asset upload
+# ----------------------------------------------------------------------------
+# This file is part of the 'SLAC Firmware Standard Library'. It is subject to
+# the license terms in the LICENSE.txt file found in the top-level directory
+# of this distribution and at:
+#    https://confluence.slac.stanford.edu/display/ppareg/LICENSE.html.
+# No part of the 'SLAC Firmware Standard Library', including this file, may be
+# copied, modified, propagated, or distributed except according to the terms
+# contained in the LICENSE.txt file.
+# ----------------------------------------------------------------------------
+
+##
+# @file releaseUpload.py
+# Concurrent, resumable upload of GitHub release assets.
+#
+# Assets already attached to the release with a matching size are skipped,
+# stale or partial ones (size mismatch or not in the 'uploaded' state) are
+# deleted and uploaded again. Each upload is retried with exponential backoff.
+#
+# Only plain REST calls are used, so the uploader can be pointed at a local
+# HTTP stand-in of the GitHub API with --apiUrl and --uploadUrl, i.e.
+# releaseUploadStandin.py, which also scripts 5xx/429/partial upload failures.
+# A stand-in must serve:
+#   GET    {apiUrl}/repos/{repo}/releases/tags/{tag}   -> {"url": ..., "upload_url": ...}
+#   GET    {release url}/assets                        -> [{"name", "size", "state", "url"}, ...]
+#   POST   {upload_url}?name={name}                    -> 201
+#   DELETE {asset url}                                 -> 204
+#
+# Can be run standalone to resume the uploads of an existing release:
+#   python3 releaseUpload.py --repo slaclab/my-project --tag v1.2.3 rogue_v1.2.3.zip ...
+
+import os
+import time
+import random
+import argparse
+import mimetypes
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_API_URL = 'https://api.github.com'
+
+# HTTP status codes worth retrying
+RETRY_STATUS = (408, 429, 500, 502, 503, 504)
+
+
+class UploadError(Exception):
+    pass
+
+
+class AssetUploader(object):
+    """Upload files to a release on a pool of worker threads"""
+
+    def __init__(self, releaseUrl, uploadUrl, token, jobs=4, retries=5, backoff=2.0, session=None):
+        self.releaseUrl = releaseUrl
+        self.uploadUrl  = uploadUrl.split('{')[0]
+        self.jobs       = jobs
+        self.retries    = retries
+        self.backoff    = backoff
+        self.headers    = {'Authorization': f'token {token}',
+                           'Accept': 'application/vnd.github+json'}
+        self.lock       = threading.Lock()
+
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=max(jobs, 1))
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+
+        self.session = session
+
+    def listAssets(self):
+        """Return {name: asset} for the assets currently on the release"""
+        ret = {}
+        url = f'{self.releaseUrl}/assets?per_page=100'
+
+        while url is not None:
+            resp = self.session.get(url, headers=self.headers, timeout=60)
+            resp.raise_for_status()
+
+            for a in resp.json():
+                ret[a['name']] = a
+
+            url = resp.links.get('next', {}).get('url')
+
+        return ret
+
+    def _delete(self, asset):
+        resp = self.session.delete(asset['url'], headers=self.headers, timeout=60)
+        if resp.status_code not in (204, 404):
+            resp.raise_for_status()
+
+    def _sleep(self, attempt, resp=None):
+        delay = self.backoff * (2 ** attempt) * (1.0 + 0.25 * random.random())
+
+        if resp is not None and 'Retry-After' in resp.headers:
+            try:
+                delay = max(delay, float(resp.headers['Retry-After']))
+            except ValueError:
+                pass
+
+        time.sleep(delay)
+
+    def _upload(self, path, asset):
+        name = os.path.basename(path)
+        size = os.path.getsize(path)
+
+        # Already uploaded
+        if asset is not None and asset['size'] == size and asset.get('state', 'uploaded') == 'uploaded':
+            return name, size, 0, 'skipped'
+
+        if asset is not None:
+            self._delete(asset)
+
+        headers = dict(self.headers)
+        headers['Content-Type']   = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        headers['Content-Length'] = str(size)
+
+        start = time.monotonic()
+        error = None
+
+        for attempt in range(self.retries + 1):
+            resp = None
+
+            try:
+                with open(path, 'rb') as f:
+                    resp = self.session.post(self.uploadUrl, params={'name': name}, data=f,
+                                             headers=headers, timeout=(60, 3600))
+
+                if resp.status_code == 201:
+                    return name, size, time.monotonic() - start, 'uploaded'
+
+                # A previous attempt may have created the asset before failing
+                if resp.status_code == 422:
+                    prev = self.listAssets().get(name)
+
+                    if prev is not None and prev['size'] == size and prev.get('state', 'uploaded') == 'uploaded':
+                        return name, size, time.monotonic() - start, 'uploaded'
+
+                    if prev is not None:
+                        self._delete(prev)
+
+                elif resp.status_code not in RETRY_STATUS:
+                    raise UploadError(f'{name}: HTTP {resp.status_code} {resp.text[:200]}')
+
+                error = f'HTTP {resp.status_code}'
+
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = str(e)
+
+            if attempt < self.retries:
+                with self.lock:
+                    print(f'    {name}: upload failed ({error}), retry {attempt+1}/{self.retries}')
+                self._sleep(attempt, resp)
+
+        raise UploadError(f'{name}: upload failed after {self.retries+1} attempts ({error})')
+
+    def upload(self, files):
+        """Upload the list of files, raises UploadError if any of them failed"""
+        names = [os.path.basename(f) for f in files]
+
+        if len(set(names)) != len(names):
+            raise UploadError(f'Duplicate asset names in upload list: {names}')
+
+        assets  = self.listAssets()
+        start   = time.monotonic()
+        results = []
+        errors  = []
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            futs = [(f, pool.submit(self._upload, f, assets.get(os.path.basename(f)))) for f in files]
+
+            for f, fut in futs:
+                try:
+                    name, size, elapsed, status = fut.result()
+                    results.append((name, size, elapsed, status))
+
+                    with self.lock:
+                        if status == 'skipped':
+                            print(f'    {name}: already on release, skipped')
+                        else:
+                            print(f'    {name}: {size/1e6:.1f} MB in {elapsed:.1f} s ({size/1e6/max(elapsed,1e-9):.1f} MB/s)')
+
+                except Exception as e:
+                    errors.append(str(e))
+
+        elapsed = time.monotonic() - start
+        nBytes  = sum([r[1] for r in results if r[3] == 'uploaded'])
+        nUp     = len([r for r in results if r[3] == 'uploaded'])
+        nSkip   = len([r for r in results if r[3] == 'skipped'])
+
+        print(f'\nUploaded {nUp} assets ({nBytes/1e6:.1f} MB) in {elapsed:.1f} s '
+              f'({nBytes/1e6/max(elapsed,1e-9):.1f} MB/s, {self.jobs} workers), '
+              f'skipped {nSkip}, failed {len(errors)}')
+
+        if errors:
+            raise UploadError('Failed to upload release assets:\n    ' + '\n    '.join(errors))
+
+        return results
+
+
+if __name__ == "__main__":
+
+    # Set the argument parser
+    parser = argparse.ArgumentParser('Release Upload')
+
+    parser.add_argument(
+        "files",
+        nargs    = '+',
+        help     = "Files to attach to the release"
+    )
+
+    parser.add_argument(
+        "--repo",
+        type     = str,
+        required = True,
+        help     = "Repository name, e.g. 'slaclab/my-project'"
+    )
+
+    parser.add_argument(
+        "--tag",
+        type     = str,
+        required = True,
+        help     = "Release tag"
+    )
+
+    parser.add_argument(
+        "--jobs",
+        type     = int,
+        required = False,
+        default  = 4,
+        help     = "Number of concurrent uploads"
+    )
+
+    parser.add_argument(
+        "--retries",
+        type     = int,
+        required = False,
+        default  = 5,
+        help     = "Number of retries per asset"
+    )
+
+    parser.add_argument(
+        "--backoff",
+        type     = float,
+        required = False,
+        default  = 2.0,
+        help     = "Delay before the first retry in seconds, doubled at each retry"
+    )
+
+    parser.add_argument(
+        "--apiUrl",
+        type     = str,
+        required = False,
+        default  = DEFAULT_API_URL,
+        help     = "GitHub API base URL (i.e. a local stand-in for testing)"
+    )
+
+    parser.add_argument(
+        "--uploadUrl",
+        type     = str,
+        required = False,
+        default  = None,
+        help     = "Override the upload URL reported by the release"
+    )
+
+    args = parser.parse_args()
+
+    token = os.environ.get('GITHUB_TOKEN')
+    if token is None:
+        raise ValueError("GITHUB_TOKEN environment variable not set.")
+
+    resp = requests.get(f'{args.apiUrl}/repos/{args.repo}/releases/tags/{args.tag}',
+                        headers={'Authorization': f'token {token}'}, timeout=60)
+    resp.raise_for_status()
+    rel = resp.json()
+
+    uploader = AssetUploader(
+        releaseUrl = rel['url'],
+        uploadUrl  = args.uploadUrl if args.uploadUrl is not None else rel['upload_url'],
+        token      = token,
+        jobs       = args.jobs,
+        retries    = args.retries,
+        backoff    = args.backoff,
+    )
+
+    print(f"\nUploading attachments to {args.repo} {args.tag} ...")
+    uploader.upload(args.files)
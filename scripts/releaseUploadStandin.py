@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+#-----------------------------------------------------------------------------
+# Title      : Local stand-in of the GitHub release asset API
+# ----------------------------------------------------------------------------
+# This file is part of the 'SLAC Firmware Standard Library'. It is subject to
+# the license terms in the LICENSE.txt file found in the top-level directory
+# of this distribution and at:
+#    https://confluence.slac.stanford.edu/display/ppareg/LICENSE.html.
+# No part of the 'SLAC Firmware Standard Library', including this file, may be
+# copied, modified, propagated, or distributed except according to the terms
+# contained in the LICENSE.txt file.
+# ----------------------------------------------------------------------------
+
+##
+# @file releaseUploadStandin.py
+# Serve the release asset endpoints used by releaseUpload.py on localhost,
+# with scripted failures, to exercise the uploader without GitHub.
+#
+# One release is served for any repo and tag. An upload of an asset name that
+# is already on the release is rejected with 422, as GitHub does. --fail
+# lists the answers to the successive upload attempts of each asset before
+# it is accepted:
+#   503, 429, ...  reply with that status (429 with Retry-After: 1)
+#   partial        keep a half size asset in the 'starter' state, reply 502,
+#                  so the next attempt gets the 422 and has to delete it
+# --asset NAME:SIZE puts an uploaded asset on the release at start-up (a
+# matching local file is skipped, a different size is replaced).
+#
+#   python3 releaseUploadStandin.py --port 8765 --fail 503 --fail 429 --fail partial \
+#       --asset old.bit:1234 &
+#   GITHUB_TOKEN=x python3 releaseUpload.py --apiUrl http://127.0.0.1:8765 \
+#       --repo test/test --tag v1 --backoff 0.1 old.bit new.bit
+#
+# The assets on the release and the attempts per asset are printed on exit
+# (Ctrl-C) and served as JSON at GET /state.
+
+import sys
+import json
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Release(object):
+    """Assets of the served release and the scripted upload failures"""
+
+    def __init__(self, faults):
+        self.faults   = faults
+        self.assets   = {}
+        self.attempts = {}
+        self.nextId   = 1
+        self.lock     = threading.Lock()
+
+    def add(self, name, size, state='uploaded'):
+        self.assets[name] = {'id': self.nextId, 'name': name, 'size': size, 'state': state}
+        self.nextId += 1
+
+    def state(self):
+        with self.lock:
+            return {'assets': sorted(self.assets.values(), key=lambda a: a['name']), 'attempts': dict(self.attempts)}
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self, status, body=None, headers=None):
+        data = b'' if body is None else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _base(self):
+        return f'http://{self.headers.get("Host", "127.0.0.1")}'
+
+    def _asset(self, a):
+        return dict(a, url=f'{self._base()}/repos/release/assets/{a["id"]}')
+
+    def do_GET(self):
+        rel  = self.server.release
+        path = urlparse(self.path).path
+
+        if path == '/state':
+            self._reply(200, rel.state())
+
+        elif path.endswith('/assets'):
+            with rel.lock:
+                self._reply(200, [self._asset(a) for a in rel.assets.values()])
+
+        elif '/releases/tags/' in path:
+            self._reply(200, {'url': f'{self._base()}/repos/release',
+                              'upload_url': f'{self._base()}/uploads/release/assets{{?name,label}}'})
+
+        else:
+            self._reply(404, {'message': 'Not Found'})
+
+    def do_POST(self):
+        rel  = self.server.release
+        url  = urlparse(self.path)
+        name = parse_qs(url.query).get('name', [None])[0]
+        size = len(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+
+        if not url.path.startswith('/uploads/') or name is None:
+            self._reply(404, {'message': 'Not Found'})
+            return
+
+        with rel.lock:
+            attempt = rel.attempts.get(name, 0)
+            rel.attempts[name] = attempt + 1
+            fault = rel.faults[attempt] if attempt < len(rel.faults) else None
+
+            if name in rel.assets:
+                self._reply(422, {'message': 'Validation Failed', 'errors': [{'code': 'already_exists'}]})
+
+            elif fault == 'partial':
+                rel.add(name, size // 2, 'starter')
+                self._reply(502, {'message': 'Bad Gateway'})
+
+            elif fault is not None:
+                self._reply(int(fault), {'message': 'scripted failure'},
+                            {'Retry-After': '1'} if fault == '429' else None)
+
+            else:
+                rel.add(name, size)
+                self._reply(201, self._asset(rel.assets[name]))
+
+    def do_DELETE(self):
+        rel = self.server.release
+
+        with rel.lock:
+            ident = urlparse(self.path).path.rsplit('/', 1)[-1]
+            match = [n for n, a in rel.assets.items() if str(a['id']) == ident]
+
+            for n in match:
+                del rel.assets[n]
+
+            self._reply(204 if match else 404)
+
+
+if __name__ == "__main__":
+
+    # Set the argument parser
+    parser = argparse.ArgumentParser('Release Upload Stand-in')
+
+    parser.add_argument(
+        "--port",
+        type     = int,
+        required = False,
+        default  = 8765,
+        help     = "Port to listen on (127.0.0.1)"
+    )
+
+    parser.add_argument(
+        "--fail",
+        action   = 'append',
+        default  = [],
+        help     = "Answer to the next upload attempt of each asset: an HTTP status or 'partial' (repeatable)"
+    )
+
+    parser.add_argument(
+        "--asset",
+        action   = 'append',
+        default  = [],
+        help     = "NAME:SIZE asset already on the release (repeatable)"
+    )
+
+    args = parser.parse_args()
+
+    for f in args.fail:
+        if f != 'partial' and not f.isdigit():
+            parser.error(f'--fail {f}: expected an HTTP status or partial')
+
+    release = Release(args.fail)
+    for a in args.asset:
+        name, _, size = a.rpartition(':')
+        release.add(name, int(size))
+
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), Handler)
+    server.release = release
+    print(f'Serving the release stand-in on http://127.0.0.1:{args.port}', flush=True)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+    json.dump(release.state(), sys.stdout, indent=1)
+    print()
@@ -0,0 +1,133 @@
+#-----------------------------------------------------------------------------
+# Title      : Stand-in of the Vitis Unified python module
+# ----------------------------------------------------------------------------
+# This file is part of the 'SLAC Firmware Standard Library'. It is subject to
+# the license terms in the LICENSE.txt file found in the top-level directory
+# of this distribution and at:
+#    https://confluence.slac.stanford.edu/display/ppareg/LICENSE.html.
+# No part of the 'SLAC Firmware Standard Library', including this file, may be
+# copied, modified, propagated, or distributed except according to the terms
+# contained in the LICENSE.txt file.
+# ----------------------------------------------------------------------------
+
+##
+# @file vitis.py
+# Minimal stand-in of the vitis module, for running the HLS flow scripts
+# (vitis/hls/create_proj.py and build.py, through hlsBuild.py and hlsSweep.py)
+# without Vitis installed. Nothing is compiled: the client start-up and each
+# component stage sleep, print a few lines and write placeholder outputs
+# where build.py expects them (csim, syn/verilog with a csynth.xml report
+# derived from the cfg clock, sim/report, the IP .zip, impl/report).
+#
+#   PYTHONPATH=$RUCKUS_DIR/scripts/vitisStandin \
+#       python3 $RUCKUS_DIR/scripts/hlsBuild.py --vitis python3 --vivado true proj_a proj_b
+#
+# Environment:
+#   VITIS_STANDIN_STARTUP  seconds of the client start-up (default 1)
+#   VITIS_STANDIN_STAGE    seconds of each component stage (default 2)
+#   VITIS_STANDIN_FAIL     stage name that raises an error (i.e. SYNTHESIS)
+
+import os
+import time
+import zipfile
+
+STARTUP = float(os.getenv('VITIS_STANDIN_STARTUP', '1'))
+STAGE   = float(os.getenv('VITIS_STANDIN_STAGE', '2'))
+
+# Output directory of each stage, relative to <workspace>/<comp>/<comp>
+STAGE_DIRS = {
+    'C_SIMULATION'   : 'hls/csim',
+    'SYNTHESIS'      : 'hls/syn/verilog',
+    'CO_SIMULATION'  : 'hls/sim/report',
+    'IMPLEMENTATION' : 'hls/impl/report',
+}
+
+CSYNTH = ('<profile><PerformanceEstimates>'
+          '<SummaryOfTimingAnalysis><EstimatedClockPeriod>{period:.3f}</EstimatedClockPeriod></SummaryOfTimingAnalysis>'
+          '<SummaryOfOverallLatency><Best-caseLatency>{latency}</Best-caseLatency>'
+          '<Worst-caseLatency>{worst}</Worst-caseLatency><Interval-max>1</Interval-max></SummaryOfOverallLatency>'
+          '</PerformanceEstimates><AreaEstimates><Resources>'
+          '<BRAM_18K>2</BRAM_18K><DSP>4</DSP><FF>{ff}</FF><LUT>{lut}</LUT><URAM>0</URAM>'
+          '</Resources></AreaEstimates></profile>\n')
+
+COMPONENT_XML = ('<?xml version="1.0" encoding="UTF-8"?>\n<spirit:component>\n'
+                 '<xilinx:family xilinx:lifeCycle="Production">kintexu</xilinx:family>\n</spirit:component>\n')
+
+
+def _cfgClock(path):
+    """clock= of the hls_config.cfg in ns (default 4)"""
+    try:
+        with open(path) as f:
+            for line in f:
+                key, _, value = line.partition('=')
+                if key.strip() == 'clock':
+                    return float(value.strip().rstrip('ns'))
+    except (OSError, ValueError):
+        pass
+    return 4.0
+
+
+class Component(object):
+
+    def __init__(self, workspace, name):
+        self.name    = name
+        self.workDir = os.path.join(workspace, name, name)
+
+    def report(self):
+        print(f'Component {self.name} (stand-in)')
+
+    def run(self, operation):
+        print(f'INFO: [stand-in] {operation} started', flush=True)
+        time.sleep(STAGE)
+
+        if operation == os.getenv('VITIS_STANDIN_FAIL'):
+            raise RuntimeError(f'[stand-in] {operation} failed (VITIS_STANDIN_FAIL)')
+
+        if operation in STAGE_DIRS:
+            out = os.path.join(self.workDir, STAGE_DIRS[operation])
+            os.makedirs(out, exist_ok=True)
+            with open(os.path.join(out, 'stand_in.txt'), 'w') as f:
+                f.write(f'{operation}\n')
+
+        if operation == 'SYNTHESIS':
+            clock  = _cfgClock(os.path.join(os.getenv('PROJ_DIR', ''), 'hls_config.cfg'))
+            report = os.path.join(self.workDir, 'hls', 'syn', 'report')
+            os.makedirs(report, exist_ok=True)
+            with open(os.path.join(report, 'csynth.xml'), 'w') as f:
+                f.write(CSYNTH.format(period=0.9 * clock, latency=int(40 / clock), worst=int(40 / clock) + 2,
+                                      ff=int(1000 / clock), lut=int(900 / clock)))
+
+        if operation == 'PACKAGE':
+            zipName = os.getenv('SYNTOP') or self.name
+            with zipfile.ZipFile(os.path.join(self.workDir, f'{zipName}.zip'), 'w', zipfile.ZIP_DEFLATED) as z:
+                z.writestr('component.xml', COMPONENT_XML)
+                z.writestr(f'hdl/verilog/{zipName}.v', f'module {zipName}();\nendmodule\n')
+
+        print(f'INFO: [stand-in] {operation} finished', flush=True)
+
+
+class Client(object):
+
+    def __init__(self):
+        self.workspace = None
+
+    def set_workspace(self, path):
+        self.workspace = path
+        os.makedirs(path, exist_ok=True)
+
+    def create_hls_component(self, name, cfg_file=None, **kwargs):
+        os.makedirs(os.path.join(self.workspace, name, name), exist_ok=True)
+        return Component(self.workspace, name)
+
+    def get_component(self, name):
+        return Component(self.workspace, name)
+
+
+def create_client():
+    print('INFO: [stand-in] starting the vitis server', flush=True)
+    time.sleep(STARTUP)
+    return Client()
+
+
+def dispose():
+    print('INFO: [stand-in] vitis server stopped', flush=True)
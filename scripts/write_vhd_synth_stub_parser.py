@@ -33,6 +33,14 @@
 #
 # Note: I recommend running EMACS beatify afterwards.
 #
+# The Verilog stub ("write_verilog -mode synth_stub", <name>_stub.v) is
+# accepted as well and produces the same port map.
+#
+# Batch mode converts every stub of a directory on a process pool:
+#        write_vhd_synth_stub_parser.py --batch <dir> [--jobs N] [--force]
+# The sha256 of each stub is kept in <dir>/.vho_stub_hashes.json, stubs that
+# did not change since their .vho was written are skipped.
+#
 #-----------------------------------------------------------------------------
 # This file is part of 'SLAC Firmware Standard Library'.
 # It is subject to the license terms in the LICENSE.txt file found in the
@@ -47,86 +55,246 @@
 # This script is designed to parse the Vivado "write_vhdl -mode synth_stub"
 # output file back into the user friendly record types.
 
-import sys
+import os
 import re
+import sys
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 
-def proc(line):
-    """Function that processes a line of the VHDL synth_stub file"""
-    # Get the port name
-    port = line.split(":")[0]
-
-    # check for record type
-    if re.search(r'\\', line):
-        retVar = (port + "=> ")
-        # strip off the \ char
-        convt  = port.replace('\\','')
-        # strip off the ] char
-        convt  = convt.replace(']','')
-        # separate the delimiters
-        convt = convt.split("[")
-        # loop through the array
-        for i in range(len(convt)):
-            # strip off the space char
-            convt[i] = convt[i].replace(' ','')
-            # Check for first element
-            if (i==0):
-                retVar += convt[0]
-            else:
-                # Check if array index
-                if convt[i].isdigit():
-                    retVar += ('('+convt[i]+')')
-                else:
-                    retVar += ('.'+convt[i])
-    else:
-        retVar = (port + "=> " + port.replace(' ','') )
+# Bumped when the emitted .vho changes, invalidates the batch hashes
+PARSER_VERSION = 2
+
+HASH_FILE = '.vho_stub_hashes.json'
+
+# VHDL stub: entity name, start and end of the port clause, one port per line
+VHDL_ENTITY_RE = re.compile(r'^\s*entity\s+(\w+)\s+is\b', re.I | re.M)
+VHDL_PORTS_RE  = re.compile(r'^\s*Port\s*\(\s*?\n', re.I | re.M)
+VHDL_END_RE    = re.compile(r'^\s*\);', re.M)
+VHDL_PORT_RE   = re.compile(r'^([ \t]*)(\\[^\\\n]+\\|\w+)[ \t]*:[ \t]*(\w+)[ \t]+([^;\n]*)', re.M)
+
+# Verilog stub: module name and the port declarations (escaped identifiers end with a space)
+VLOG_MODULE_RE = re.compile(r'^\s*module\s+(\w+)', re.M)
+VLOG_PORT_RE   = re.compile(r'^\s*(input|output|inout)\s+(?:wire\s+)?(\[[^\]]*\])?\s*((?:\\\S+\s*|\w+\s*)(?:,\s*(?:\\\S+\s*|\w+\s*))*);', re.M)
+VLOG_NAME_RE   = re.compile(r'\\(\S+)|(\w+)')
+
+VLOG_DIRECTION = {'input': 'in', 'output': 'out', 'inout': 'inout'}
+
+
+class Port(object):
+    """Port of a synth_stub entity"""
+    __slots__ = ('name', 'direction', 'type', 'indent')
+
+    def __init__(self, name, direction, type, indent='    '):
+        self.name      = name
+        self.direction = direction
+        self.type      = type
+        self.indent    = indent
+
+    @property
+    def escaped(self):
+        return self.name.startswith('\\')
+
+
+def actual(port):
+    """Record expression of a flattened port: \\dataIn[1][tData]\\ -> dataIn(1).tData"""
+    if not port.escaped:
+        return port.name
+
+    fields = port.name.strip('\\').replace(' ', '').replace(']', '').split('[')
+    return fields[0] + ''.join([f'({f})' if f.isdigit() else f'.{f}' for f in fields[1:]])
+
+
+def parseVhdl(text):
+    """Returns (entity, ports) of a write_vhdl synth_stub"""
+    m = VHDL_ENTITY_RE.search(text)
+    if m is None:
+        raise ValueError('no entity declaration')
+
+    entity = m.group(1)
+
+    m = VHDL_PORTS_RE.search(text, m.end())
+    if m is None:
+        raise ValueError(f'{entity}: no port clause')
+
+    start = m.end()
+    m = VHDL_END_RE.search(text, start)
+    end = m.start() if m is not None else len(text)
+
+    ports = [Port(name, direction.lower(), vtype.rstrip(), indent)
+             for indent, name, direction, vtype in VHDL_PORT_RE.findall(text, start, end)]
+
+    return entity, ports
+
+
+def parseVerilog(text):
+    """Returns (entity, ports) of a write_verilog synth_stub"""
+    m = VLOG_MODULE_RE.search(text)
+    if m is None:
+        raise ValueError('no module declaration')
+
+    entity = m.group(1)
+    ports  = []
+
+    for p in VLOG_PORT_RE.finditer(text, m.end()):
+        direction = VLOG_DIRECTION[p.group(1)]
+        rng = p.group(2)
+
+        if rng:
+            hi, lo = [r.strip() for r in rng[1:-1].split(':')]
+            vtype = f'STD_LOGIC_VECTOR ( {hi} {"downto" if int(hi) >= int(lo) else "to"} {lo} )'
+        else:
+            vtype = 'STD_LOGIC'
+
+        for n in VLOG_NAME_RE.finditer(p.group(3)):
+            name = f'\\{n.group(1)}\\' if n.group(1) else n.group(2)
+            ports.append(Port(name, direction, vtype))
+
+    return entity, ports
+
+
+def parseStub(path):
+    """Parse a .vhd or .v synth_stub file, returns (entity, ports)"""
+    with open(path) as f:
+        text = f.read()
+
+    if path.endswith('.v'):
+        return parseVerilog(text)
+
+    return parseVhdl(text)
 
-    # Check if last port mapping
-    if re.search(r';', line):
-        retVar += ",\n"
-    else:
-        retVar += ");\n"
 
-    # Return the results
-    return retVar
+def emit(entity, ports):
+    """Returns the port map instantiation text"""
+    out = [f'U_Core: entity work.{entity}\n', '  port map (\n']
+    last = len(ports) - 1
+
+    for i, port in enumerate(ports):
+        out.append(f'{port.indent}{port.name} => {actual(port)}{");" if i == last else ","}\n')
+
+    return ''.join(out)
+
+
+def vhoPath(path):
+    return os.path.splitext(path)[0] + '.vho'
+
 
 def vho(arg):
-    """Function that writes a .vho file from the VHDL synth_stub file"""
-    # common define
-    entity  = ''
-    line    = ''
-    fname = arg.replace('.vhd','') + '.vho'
-
-    # Open the input/output files
-    ifd = open(arg)
-    ofd = open(fname, 'w')
-
-    # strip out the input files header
-    while (not re.search('Port', line)):
-        line = ifd.readline()
-        if re.search('entity', line):
-            entity = line.replace('entity','')
-            entity = entity.replace('is','')
-            entity = entity.replace(' ','')
-            entity = entity.replace('\n','')
-
-    # Output file header
-    ofd.write('U_Core: entity work.'+entity+'\n')
-    ofd.write('  port map (\n')
-
-    # Loop through the ports
-    line = ifd.readline()
-    while (not re.match("  \);", line)):
-        # Process the line and write to file
-        ofd.write(proc(line))
-        # Read the file
-        line = ifd.readline()
-
-    # Close the files
-    ifd.close()
-    ofd.close()
-
-    # # Print the output files
-    # os.system('cat ' + fname)
+    """Function that writes a .vho file from the VHDL (or Verilog) synth_stub file"""
+    entity, ports = parseStub(arg)
+
+    with open(vhoPath(arg), 'w') as ofd:
+        ofd.write(emit(entity, ports))
+
+    return len(ports)
+
+
+def stubHash(path):
+    h = hashlib.sha256(f'{PARSER_VERSION}\n'.encode())
+    with open(path, 'rb') as f:
+        h.update(f.read())
+    return h.hexdigest()
+
+
+def _batchOne(path):
+    try:
+        return path, vho(path), None
+    except (OSError, ValueError) as e:
+        return path, 0, str(e)
+
+
+def findStubs(dirPath):
+    """Synth stub files of a directory, the .vhd stub is preferred over the .v stub"""
+    stubs = {}
+    for name in sorted(os.listdir(dirPath)):
+        root, ext = os.path.splitext(name)
+        if ext in ('.vhd', '.v') and root.endswith('_stub'):
+            if ext == '.vhd' or root not in stubs:
+                stubs[root] = os.path.join(dirPath, name)
+    return list(stubs.values())
+
+
+def batch(dirPath, jobs=None, force=False):
+    """Convert the stubs of a directory, skipping the ones unchanged since their .vho"""
+    hashFile = os.path.join(dirPath, HASH_FILE)
+
+    try:
+        with open(hashFile) as f:
+            hashes = json.load(f)
+    except (OSError, ValueError):
+        hashes = {}
+
+    stubs   = findStubs(dirPath)
+    current = {s: stubHash(s) for s in stubs}
+    todo    = [s for s in stubs if force or hashes.get(os.path.basename(s)) != current[s] or not os.path.exists(vhoPath(s))]
+    errors  = 0
+
+    print(f'{len(stubs)} stubs, {len(stubs) - len(todo)} unchanged')
+
+    if todo:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            for path, nPorts, error in pool.map(_batchOne, todo, chunksize=4):
+                name = os.path.basename(path)
+
+                if error is None:
+                    hashes[name] = current[path]
+                    print(f'{name}: {nPorts} ports -> {os.path.basename(vhoPath(path))}')
+                else:
+                    hashes.pop(name, None)
+                    errors += 1
+                    print(f'{name}: ERROR {error}')
+
+        with open(hashFile + '.tmp', 'w') as f:
+            json.dump(hashes, f, indent=1, sort_keys=True)
+        os.replace(hashFile + '.tmp', hashFile)
+
+    return errors
+
 
 if __name__ == '__main__':
-    vho(sys.argv[1])
+
+    parser = argparse.ArgumentParser('Synth Stub Parser')
+
+    parser.add_argument(
+        "stub",
+        nargs    = '?',
+        default  = None,
+        help     = "synth_stub file (.vhd or .v)"
+    )
+
+    parser.add_argument(
+        "--batch",
+        type     = str,
+        required = False,
+        default  = None,
+        help     = "Directory of synth_stub files"
+    )
+
+    parser.add_argument(
+        "--jobs",
+        type     = int,
+        required = False,
+        default  = None,
+        help     = "Number of worker processes (default: number of CPUs)"
+    )
+
+    parser.add_argument(
+        "--force",
+        action   = 'store_true',
+        default  = False,
+        help     = "Convert all stubs, ignoring the stored hashes"
+    )
+
+    args = parser.parse_args()
+
+    if args.batch is None and args.stub is not None and os.path.isdir(args.stub):
+        args.batch = args.stub
+
+    if args.batch is not None:
+        sys.exit(1 if batch(args.batch, args.jobs, args.force) else 0)
+
+    if args.stub is None:
+        parser.error('A stub file or --batch directory is required')
+
+    vho(args.stub)
@@ -193,11 +193,23 @@ x86sim : proj
 	$(call ACTION_HEADER,"Vitis AIE x86sim")
 	@cd $(OUT_DIR); vitis -s $(RUCKUS_DIR)/vitis/aie/build.py --x86sim
 
+###############################################################
+#### Vitis AIE hw + x86sim Builds in Parallel #################
+###############################################################
+.PHONY : build_all
+# The orchestrator only spawns the per-target `vitis -s build.py` builds,
+# so it runs with plain python3 (no Vitis server of its own).
+build_all : proj
+	$(call ACTION_HEADER,"Vitis AIE Build (target=hw + x86sim)")
+	@cd $(OUT_DIR); python3 $(RUCKUS_DIR)/vitis/aie/build.py --all
+
 ###############################################################
 #### Package — wraps libadf.a + XSA into dynamic PDI ##########
 ###############################################################
+# `make build_all package` packages the libadf.a of build_all instead of
+# rerunning the hw build.
 .PHONY : package
-package : build
+package : $(if $(filter build_all,$(MAKECMDGOALS)),build_all,build)
 	$(call ACTION_HEADER,"Vitis AIE Package")
 	@if [ -z "$(VIVADO_XSA_DIR)" ]; then \
 	  echo "ERROR: VIVADO_XSA_DIR not set — define the directory containing the Vivado-built .xsa"; \
@@ -33,6 +33,11 @@ ifndef SKIP_COSIM
 export SKIP_COSIM = 0
 endif
 
+# Specifies if the HLS stages with unchanged inputs are reused
+ifndef HLS_STAGE_CACHE
+export HLS_STAGE_CACHE = 1
+endif
+
 # Build System Variables
 # VIVADO_VERSION feeds BUILD_STRING in system_shared.mk ("Vivado v...").
 export VIVADO_VERSION := $(shell vivado -version | grep -Po "v(\d+\.)+\d+" | cut -c2-)
@@ -61,6 +66,7 @@ test:
 	@echo RUCKUS_DIR: $(RUCKUS_DIR)
 	@echo SKIP_CSIM: $(SKIP_CSIM)
 	@echo SKIP_COSIM: $(SKIP_COSIM)
+	@echo HLS_STAGE_CACHE: $(HLS_STAGE_CACHE)
 	@echo BUILD_STRING: $${BUILD_STRING}
 	@echo GIT_HASH_LONG: $(GIT_HASH_LONG)
 	@echo GIT_HASH_SHORT: $(GIT_HASH_SHORT)
@@ -136,6 +136,15 @@ export RUCKUS_QUIET_FLAG = -quiet
 # Images Directory
 export IMAGES_DIR = $(abspath $(PROJ_DIR)/images)
 
+# Record the step times of each Vivado build (scripts/buildTelemetry.py)
+ifndef BUILD_TELEMETRY
+export BUILD_TELEMETRY = 1
+endif
+ifndef BUILD_TELEMETRY_DB
+export BUILD_TELEMETRY_DB = $(HOME)/.cache/ruckus/build_telemetry.sqlite
+endif
+BUILD_TELEMETRY_COLLECT = if [ "$(BUILD_TELEMETRY)" != "0" ]; then python3 $(RUCKUS_DIR)/scripts/buildTelemetry.py collect --status $$rc || true; fi
+
 # Project Build Directory
 export OUT_DIR  = $(abspath $(TOP_DIR)/build/$(PROJECT))
 export SYN_DIR  = $(OUT_DIR)/$(VIVADO_PROJECT).runs/synth_1
@@ -185,6 +194,19 @@ else
    endif
 endif
 
+# Rebuild the Vitis platform component instead of reusing it
+ifndef VITIS_CLEAN
+   export VITIS_CLEAN = 0
+endif
+
+# Shared .ELF cache directory (empty: disabled) and its size limit
+ifndef VITIS_ELF_CACHE
+   export VITIS_ELF_CACHE =
+endif
+ifndef VITIS_ELF_CACHE_MAX_GB
+   export VITIS_ELF_CACHE_MAX_GB = 2
+endif
+
 # Check if SDK_SRC_PATH defined but VITIS_SRC_PATH not (legacy support)
 ifdef SDK_SRC_PATH
    ifndef VITIS_SRC_PATH
@@ -281,6 +303,7 @@ test:
 	@echo GIT_HASH_LONG: $(GIT_HASH_LONG)
 	@echo GIT_HASH_SHORT: $(GIT_HASH_SHORT)
 	@echo IMAGENAME: $(IMAGENAME)
+	@echo BUILD_TELEMETRY_DB: $(BUILD_TELEMETRY_DB)
 	@echo BUILD_STRING: $${BUILD_STRING}
 	@echo EMBED_PROC: $(EMBED_PROC)
 	@echo EMBED_TYPE: $(EMBED_TYPE)
@@ -330,7 +353,7 @@ gui : $(SOURCE_DEPEND)
 .PHONY : bit mcs prom pdi
 bit mcs prom pdi : $(SOURCE_DEPEND)
 	$(call ACTION_HEADER,"Vivado Batch Build for .bit/.mcs")
-	@cd $(OUT_DIR); vivado -mode batch -source $(RUCKUS_DIR)/vivado/build.tcl
+	@cd $(OUT_DIR); vivado -mode batch -source $(RUCKUS_DIR)/vivado/build.tcl; rc=$$?; $(BUILD_TELEMETRY_COLLECT); exit $$rc
 
 ###############################################################
 #### Vivado Synthesis Only ####################################
@@ -338,7 +361,7 @@ bit mcs prom pdi : $(SOURCE_DEPEND)
 .PHONY : syn
 syn : $(SOURCE_DEPEND)
 	$(call ACTION_HEADER,"Vivado Synthesis Only")
-	@cd $(OUT_DIR); export SYNTH_ONLY=1; vivado -mode batch -source $(RUCKUS_DIR)/vivado/build.tcl
+	@cd $(OUT_DIR); export SYNTH_ONLY=1; vivado -mode batch -source $(RUCKUS_DIR)/vivado/build.tcl; rc=$$?; $(BUILD_TELEMETRY_COLLECT); exit $$rc
 
 ###############################################################
 #### Vivado Synthesis DCP  ####################################
@@ -346,7 +369,15 @@ syn : $(SOURCE_DEPEND)
 .PHONY : dcp
 dcp : $(SOURCE_DEPEND)
 	$(call ACTION_HEADER,"Vivado Synthesis DCP")
-	@cd $(OUT_DIR); export SYNTH_DCP=1; vivado -mode batch -source $(RUCKUS_DIR)/vivado/build.tcl
+	@cd $(OUT_DIR); export SYNTH_DCP=1; vivado -mode batch -source $(RUCKUS_DIR)/vivado/build.tcl; rc=$$?; $(BUILD_TELEMETRY_COLLECT); exit $$rc
+
+###############################################################
+#### Build Telemetry Report ###################################
+###############################################################
+.PHONY : telemetry
+telemetry :
+	$(call ACTION_HEADER,"Vivado Build Telemetry")
+	@python3 $(RUCKUS_DIR)/scripts/buildTelemetry.py report --project $(PROJECT)
 
 ###############################################################
 #### Vivado Interactive #######################################
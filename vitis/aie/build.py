@@ -13,23 +13,143 @@
 # Defaults to target='hw' (production libadf.a); pass --x86sim for the
 # simulator build (analog of HLS csim).
 #
+# --all builds hw and x86sim in parallel. The component sources are
+# snapshotted once (without build/) to $(OUT_DIR)/.targets/snapshot and
+# cloned into one workspace per target ($(OUT_DIR)/.targets/<target>/),
+# where `$VITIS_CMD build.py [--x86sim]` (default `vitis -s`) runs with its
+# own Vitis server. Each target's output is streamed with a [target] prefix
+# and logged to $(OUT_DIR)/build_<target>.log. The <comp>/build/<target>/
+# tree of each clone is copied back into the main workspace, where
+# package.sh and emit_partition_conf.sh look for libadf.a and
+# Work/arch/aie_partition.json.
+#
 # Required env vars (set by system_vitis_aie.mk):
 #   OUT_DIR   workspace root (must be the cwd; system_vitis_aie.mk does cd)
 #   PROJECT   AIE component name
+#
+# The --all orchestrator does not use the vitis module and runs with plain
+# python3 (system_vitis_unified_aie.mk); vitis is imported after it, for the
+# single target builds.
 
-import vitis
 import os
+import sys
+import time
+import shlex
+import shutil
 import argparse
+import threading
+import subprocess
+
+TARGETS = ['hw', 'x86sim']
 
 parser = argparse.ArgumentParser(prog="Vitis AIE build script")
 parser.add_argument("--x86sim", default=False, action="store_true",
                     help="Build for x86 simulator instead of hardware.")
+parser.add_argument("--all", default=False, action="store_true",
+                    help="Build hw and x86sim in parallel, in cloned workspaces.")
 args = parser.parse_args()
 
 target    = "x86sim" if args.x86sim else "hw"
 workspace = os.getenv("OUT_DIR")
 comp_name = os.getenv("PROJECT")
 
+print_lock = threading.Lock()
+
+
+def snapshot(src, dst):
+    """Copy the component sources (not its build/ outputs) to dst"""
+    if os.path.isdir(dst):
+        shutil.rmtree(dst)
+    shutil.copytree(src, dst, symlinks=True,
+                    ignore=lambda d, names: ['build'] if os.path.samefile(d, src) and 'build' in names else [])
+
+
+def clone(snap_dir, target_ws):
+    """Refresh the target workspace from the snapshot, keeping its previous build/ outputs"""
+    comp_dir = os.path.join(target_ws, comp_name)
+    os.makedirs(comp_dir, exist_ok=True)
+    for name in os.listdir(comp_dir):
+        if name != 'build':
+            path = os.path.join(comp_dir, name)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+    shutil.copytree(snap_dir, comp_dir, symlinks=True, dirs_exist_ok=True)
+
+    # The component references its cfg as ../aie_config.generated.cfg
+    cfg = os.path.join(workspace, 'aie_config.generated.cfg')
+    if os.path.isfile(cfg):
+        shutil.copy2(cfg, os.path.join(target_ws, 'aie_config.generated.cfg'))
+
+
+def run_target(tgt, target_ws, results):
+    start = time.monotonic()
+    cmd   = shlex.split(os.getenv('VITIS_CMD', 'vitis -s')) + [os.path.abspath(__file__)]
+    if tgt == 'x86sim':
+        cmd.append('--x86sim')
+
+    env = dict(os.environ)
+    env['OUT_DIR'] = target_ws
+
+    with open(os.path.join(workspace, f'build_{tgt}.log'), 'w') as log:
+        try:
+            proc = subprocess.Popen(cmd, cwd=target_ws, env=env, stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT, text=True, errors='replace')
+        except OSError as e:
+            log.write(f'ERROR: {e}\n')
+            with print_lock:
+                print(f'[{tgt}] ERROR: {e}', flush=True)
+            results[tgt] = (-1, time.monotonic() - start)
+            return
+
+        for line in proc.stdout:
+            log.write(line)
+            with print_lock:
+                print(f'[{tgt}] {line.rstrip()}', flush=True)
+        rc = proc.wait()
+
+    results[tgt] = (rc, time.monotonic() - start)
+
+
+if args.all:
+    comp_dir    = os.path.join(workspace, comp_name)
+    targets_dir = os.path.join(workspace, '.targets')
+    snap_dir    = os.path.join(targets_dir, 'snapshot')
+
+    # One snapshot of the sources, so both targets build the same files
+    snapshot(comp_dir, snap_dir)
+
+    results = {}
+    threads = []
+    for tgt in TARGETS:
+        target_ws = os.path.join(targets_dir, tgt)
+        clone(snap_dir, target_ws)
+        threads.append(threading.Thread(target=run_target, args=(tgt, target_ws, results)))
+
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    print('\nAIE build summary:')
+    for tgt in TARGETS:
+        rc, seconds = results.get(tgt, (-1, 0.0))
+        print(f'   {tgt:8} {"ok" if rc == 0 else f"FAILED ({rc})":12} {seconds:10.1f} s   log: {workspace}/build_{tgt}.log')
+
+    # Put the outputs where the single target builds leave them (package.sh, emit_partition_conf.sh)
+    for tgt in TARGETS:
+        out = os.path.join(targets_dir, tgt, comp_name, 'build', tgt)
+        if results.get(tgt, (-1,))[0] == 0 and os.path.isdir(out):
+            dest = os.path.join(comp_dir, 'build', tgt)
+            if os.path.isdir(dest):
+                shutil.rmtree(dest)
+            shutil.copytree(out, dest, symlinks=True)
+
+    sys.exit(0 if all([results.get(t, (-1,))[0] == 0 for t in TARGETS]) else 1)
+
+import vitis  # noqa: E402
+
 client = vitis.create_client()
 client.set_workspace(workspace)
 
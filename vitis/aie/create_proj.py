@@ -10,9 +10,13 @@
 ##############################################################################
 #
 # create_proj.py — idempotent Vitis Unified IDE workspace + AIE component
-# bootstrap. Driven by system_vitis_unified_aie.mk. Skipped silently if the
-# component already exists (so `make build` / `make gui` can call `make proj`
-# as a cheap no-op prereq).
+# bootstrap. Driven by system_vitis_unified_aie.mk. If the component already
+# exists, the component is synced incrementally instead: a manifest of the
+# expanded AIE_SOURCES (with content hashes) records what was imported, only
+# added or changed files are imported again, deleted ones are removed, and
+# aie_config.generated.cfg is rewritten only when its content changes. When
+# nothing changed the Vitis server is not started at all, so `make build` /
+# `make gui` can call `make proj` as a cheap prereq.
 #
 # Required env vars (set by system_vitis_unified_aie.mk):
 #   OUT_DIR              workspace root
@@ -44,6 +48,9 @@
 
 import vitis
 import os
+import json
+import shutil
+import hashlib
 from collections import defaultdict
 
 SRC_EXTENSIONS = ('.cpp', '.cc', '.h', '.hpp')
@@ -72,16 +79,61 @@ aie_config_user  = os.path.join(proj_dir, 'aie_config.cfg')
 aie_config_generated     = os.path.join(workspace, 'aie_config.generated.cfg')
 aie_config_generated_rel = '../aie_config.generated.cfg'
 
+# Manifest of the imported sources: {'<dest_subdir>/<name>': {'src', 'sha256',
+# 'size', 'mtime_ns'}} plus the top-level file. Lives next to the component.
+comp_dir      = f'{workspace}/{comp_name}'
+manifest_file = os.path.join(workspace, '.aie_sources_manifest.json')
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for buf in iter(lambda: f.read(1024*1024), b''):
+            h.update(buf)
+    return h.hexdigest()
+
+
+def source_entry(path, old):
+    """Manifest entry of a source file, the hash is reused while size and mtime match"""
+    st = os.stat(path)
+    if old and old['src'] == path and old['size'] == st.st_size and old['mtime_ns'] == st.st_mtime_ns:
+        sha = old['sha256']
+    else:
+        sha = file_sha256(path)
+    return {'src': path, 'sha256': sha, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def write_if_changed(path, text):
+    """Write text to path only if it differs, so an unchanged file keeps its timestamp"""
+    if os.path.isfile(path):
+        with open(path, 'r') as f:
+            if f.read() == text:
+                return False
+    with open(path + '.tmp', 'w') as f:
+        f.write(text)
+    os.replace(path + '.tmp', path)
+    return True
+
+
+def import_groups(aie_comp, items):
+    """import_files() once per (source dir, dest_subdir) pair"""
+    groups = defaultdict(list)
+    for path, dest_subdir in items:
+        groups[(os.path.dirname(path), dest_subdir)].append(os.path.basename(path))
+
+    for (from_loc, dest_subdir), basenames in groups.items():
+        if dest_subdir:
+            aie_comp.import_files(from_loc=from_loc, files=basenames,
+                                  dest_dir_in_cmp=dest_subdir)
+        else:
+            aie_comp.import_files(from_loc=from_loc, files=basenames)
+
+
 if not aie_sources:
     raise SystemExit("create_proj: AIE_SOURCES is empty — list the files "
                      "and/or directories in the consuming Makefile, e.g. "
                      "AIE_SOURCES = $(CURDIR)/aie $(CURDIR)/aie/kernels")
 
-# Idempotent — skip if the component is already realized in the workspace.
-if os.path.isdir(f'{workspace}/{comp_name}'):
-    print(f'AIE component "{comp_name}" already exists at {workspace}/{comp_name} — skipping create_proj.')
-    raise SystemExit(0)
-
 # Expand each AIE_SOURCES entry. Each entry is `path[:dest_subdir]` —
 # files are taken as-is; directories are globbed non-recursively for
 # SRC_EXTENSIONS. Missing entries error loudly. `dest_subdir` (optional)
@@ -108,46 +160,26 @@ if not expanded:
     raise SystemExit(f"create_proj: AIE_SOURCES expanded to zero files "
                      f"(looked for extensions {SRC_EXTENSIONS}).")
 
-client = vitis.create_client()
-client.set_workspace(workspace)
-
-# create_aie_component accepts either platform=<xpfm> or part=<device-id>
-# (the Makefile guarantees exactly one is set).
-if aie_platform:
-    aie_comp = client.create_aie_component(
-        name     = comp_name,
-        platform = aie_platform,
-        template = "empty",
-    )
-else:
-    aie_comp = client.create_aie_component(
-        name     = comp_name,
-        part     = aie_part,
-        template = "empty",
-    )
-
-# Group expanded paths by (parent dir, dest_subdir) so we issue one
-# import_files() call per (source dir, destination) pair. Files with no
-# dest_subdir land flat at the component root.
-groups = defaultdict(list)
-for path, dest_subdir in expanded:
-    groups[(os.path.dirname(path), dest_subdir)].append(os.path.basename(path))
+# Expected component contents, keyed by the in-component path
+try:
+    with open(manifest_file, 'r') as f:
+        manifest = json.load(f)
+except (OSError, ValueError):
+    manifest = {}
 
-for (from_loc, dest_subdir), basenames in groups.items():
-    if dest_subdir:
-        aie_comp.import_files(from_loc=from_loc, files=basenames,
-                              dest_dir_in_cmp=dest_subdir)
-    else:
-        aie_comp.import_files(from_loc=from_loc, files=basenames)
-
-aie_comp.update_top_level_file(top_level_file=aie_top_level_file)
+old_files = manifest.get('files', {})
+new_files = {}
+for path, dest_subdir in expanded:
+    # A later entry importing the same in-component path wins, as import_files() did
+    key = os.path.join(dest_subdir, os.path.basename(path))
+    new_files[key] = source_entry(path, old_files.get(key))
 
-# Synthesize PROJ_DIR/aie_config.generated.cfg from auto-derived
-# include= directives + the user's aie_config.cfg. Include paths are
-# relative to v++'s working directory (<comp>/build/<target>/), so
-# `../..` is the component root and `../../<subdir>` reaches each
-# AIE_SOURCES dest_subdir. The component root is always added so that
-# graph.h / kernels.h are discoverable.
+# Synthesize aie_config.generated.cfg from auto-derived include=
+# directives + the user's aie_config.cfg. Include paths are relative to
+# v++'s working directory (<comp>/build/<target>/), so `../..` is the
+# component root and `../../<subdir>` reaches each AIE_SOURCES
+# dest_subdir. The component root is always added so that graph.h /
+# kernels.h are discoverable.
 unique_dests = sorted({d for _, d in expanded if d})
 include_lines = ['include=../..']
 include_lines += [f'include=../../{d}' for d in unique_dests]
@@ -157,22 +189,91 @@ if os.path.isfile(aie_config_user):
         user_body = f.read()
 else:
     user_body = ''
-with open(aie_config_generated, 'w') as f:
-    f.write('# Auto-generated by ruckus vitis/aie/create_proj.py — DO NOT EDIT.\n')
-    f.write('# Edits to aie_config.cfg are merged on every `make proj`.\n')
-    f.write('# include= paths are derived from AIE_SOURCES dest_subdirs.\n\n')
-    f.write(header)
-    f.write(user_body)
+generated = ('# Auto-generated by ruckus vitis/aie/create_proj.py — DO NOT EDIT.\n'
+             '# Edits to aie_config.cfg are merged on every `make proj`.\n'
+             '# include= paths are derived from AIE_SOURCES dest_subdirs.\n\n'
+             + header + user_body)
 
-# Vitis 2025.2 attaches a default cfg file at component creation; AIE
-# components reject a second cfg file. Strip whatever is already attached
-# so add_cfg_file() below installs the generated cfg cleanly.
-existing_cfg = aie_comp.report().get('cfg_files', []) or []
-for cfg in existing_cfg:
-    aie_comp.remove_cfg_file(cfg)
+if not os.path.isdir(comp_dir):
 
-aie_comp.add_cfg_file(aie_config_generated_rel)
+    client = vitis.create_client()
+    client.set_workspace(workspace)
 
-aie_comp.report()
+    # create_aie_component accepts either platform=<xpfm> or part=<device-id>
+    # (the Makefile guarantees exactly one is set).
+    if aie_platform:
+        aie_comp = client.create_aie_component(
+            name     = comp_name,
+            platform = aie_platform,
+            template = "empty",
+        )
+    else:
+        aie_comp = client.create_aie_component(
+            name     = comp_name,
+            part     = aie_part,
+            template = "empty",
+        )
+
+    # Files with no dest_subdir land flat at the component root.
+    import_groups(aie_comp, expanded)
+
+    aie_comp.update_top_level_file(top_level_file=aie_top_level_file)
+
+    write_if_changed(aie_config_generated, generated)
+
+    # Vitis 2025.2 attaches a default cfg file at component creation; AIE
+    # components reject a second cfg file. Strip whatever is already attached
+    # so add_cfg_file() below installs the generated cfg cleanly.
+    existing_cfg = aie_comp.report().get('cfg_files', []) or []
+    for cfg in existing_cfg:
+        aie_comp.remove_cfg_file(cfg)
+
+    aie_comp.add_cfg_file(aie_config_generated_rel)
+
+    aie_comp.report()
+
+    vitis.dispose()
+
+else:
+    # Incremental sync of the existing component
+    added   = [k for k in new_files if k not in old_files or not os.path.isfile(os.path.join(comp_dir, k))]
+    changed = [k for k in new_files if k not in added and new_files[k]['sha256'] != old_files[k]['sha256']]
+    removed = [k for k in old_files if k not in new_files]
+    top_changed = manifest.get('top_level_file') != aie_top_level_file
+
+    # Changed files are copied over their imported copy in place
+    for key in changed:
+        dest = os.path.join(comp_dir, key)
+        shutil.copyfile(new_files[key]['src'], dest + '.tmp')
+        os.replace(dest + '.tmp', dest)
+
+    for key in removed:
+        dest = os.path.join(comp_dir, key)
+        if os.path.isfile(dest):
+            os.remove(dest)
+
+    cfg_changed = write_if_changed(aie_config_generated, generated)
+
+    # Added files and a new top-level file need the Vitis API
+    if added or top_changed:
+        client = vitis.create_client()
+        client.set_workspace(workspace)
+        aie_comp = client.get_component(comp_name)
+
+        import_groups(aie_comp, [(new_files[k]['src'], os.path.dirname(k)) for k in added])
+
+        if top_changed:
+            aie_comp.update_top_level_file(top_level_file=aie_top_level_file)
+
+        vitis.dispose()
+
+    if added or changed or removed or top_changed or cfg_changed:
+        print(f'AIE component "{comp_name}" synced: {len(added)} added, {len(changed)} changed, '
+              f'{len(removed)} removed{", top-level file updated" if top_changed else ""}'
+              f'{", aie_config.generated.cfg updated" if cfg_changed else ""}.')
+    else:
+        print(f'AIE component "{comp_name}" is up to date with AIE_SOURCES.')
 
-vitis.dispose()
+# Save the manifest last, an interrupted sync is redone on the next run
+write_if_changed(manifest_file, json.dumps({'top_level_file': aie_top_level_file, 'files': new_files},
+                                           indent=1, sort_keys=True) + '\n')
@@ -11,14 +11,236 @@
 
 import vitis
 import os
+import re
+import copy
+import json
+import time
 import shutil
+import struct
+import hashlib
+import shlex
 import zipfile
 import argparse
 
+XIL_FAMILY = """
+<xilinx:family xilinx:lifeCycle="Production">artix7</xilinx:family>
+<xilinx:family xilinx:lifeCycle="Production">kintex7</xilinx:family>
+<xilinx:family xilinx:lifeCycle="Production">virtex7</xilinx:family>
+<xilinx:family xilinx:lifeCycle="Production">zynq</xilinx:family>
+<xilinx:family xilinx:lifeCycle="Production">kintexu</xilinx:family>
+<xilinx:family xilinx:lifeCycle="Production">virtexu</xilinx:family>
+<xilinx:family xilinx:lifeCycle="Production">kintexuplus</xilinx:family>
+<xilinx:family xilinx:lifeCycle="Production">virtexuplus</xilinx:family>
+<xilinx:family xilinx:lifeCycle="Production">virtexuplusHBM</xilinx:family>
+<xilinx:family xilinx:lifeCycle="Production">zynquplus</xilinx:family>
+<xilinx:family xilinx:lifeCycle="Production">zynquplusRFSOC</xilinx:family>
+<xilinx:family xilinx:lifeCycle="Production">versal</xilinx:family>
+"""
+
+def set_all_families(xml):
+    """Replace the xilinx:family lines of component.xml with the list of all families"""
+    out = []
+    done = False
+    for line in xml.decode().splitlines(keepends=True):
+        if 'xilinx:family' in line:
+            if not done:
+                out.append(XIL_FAMILY)
+                done = True
+        else:
+            out.append(line)
+    return ''.join(out).encode()
+
+def copy_raw_member(fin, info, zout):
+    """Copy a zip member without decompressing it (compressed data copied as is)"""
+    # Skip the local file header of the member in the source zip
+    fin.seek(info.header_offset)
+    header = fin.read(30)
+    name_len, extra_len = struct.unpack('<HH', header[26:30])
+    fin.seek(info.header_offset + 30 + name_len + extra_len)
+
+    # New local header with the sizes and CRC in place of a data descriptor
+    zinfo = copy.copy(info)
+    zinfo.flag_bits &= ~0x08
+    zinfo.header_offset = zout.fp.tell()
+    zout.fp.write(zinfo.FileHeader(zinfo.compress_size > zipfile.ZIP64_LIMIT or zinfo.file_size > zipfile.ZIP64_LIMIT))
+
+    remaining = info.compress_size
+    while remaining > 0:
+        buf = fin.read(min(remaining, 1024*1024))
+        if not buf:
+            raise zipfile.BadZipFile(f'{info.filename}: truncated member')
+        zout.fp.write(buf)
+        remaining -= len(buf)
+
+    # Register the member for the central directory written on close
+    zout.filelist.append(zinfo)
+    zout.NameToInfo[zinfo.filename] = zinfo
+    zout.start_dir = zout.fp.tell()
+    zout._didModify = True
+
+def hash_path(h, path):
+    """Add the contents of a file, or of all the files below a directory, to the hash"""
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                hash_path(h, os.path.join(root, name))
+    else:
+        h.update(f'{path}\n'.encode())
+        with open(path, 'rb') as f:
+            for buf in iter(lambda: f.read(1024*1024), b''):
+                h.update(buf)
+
+def cfg_sources(cfg_text, key, search_dirs):
+    """Files listed with key (syn.file, tb.file) in hls_config.cfg, None for a file not found"""
+    ret = []
+    for line in cfg_text.splitlines():
+        line = line.split('#')[0].strip()
+        if '=' not in line or line.split('=', 1)[0].strip() != key:
+            continue
+        value = line.split('=', 1)[1].strip()
+        for src in [os.path.join(d, value) for d in search_dirs] + [value]:
+            if os.path.exists(src):
+                ret.append(os.path.abspath(src))
+                break
+        else:
+            print(f'Stage cache: {value} not found, stages using it are not reused')
+            ret.append(None)
+    return ret
+
+INCLUDE_RE = re.compile(rb'^[ \t]*#[ \t]*include[ \t]*([<"])([^">\r\n]+)[">]', re.M)
+
+def cfg_include_dirs(cfg_text, keys, search_dirs):
+    """-I/-iquote/-isystem directories of the cflags keys (syn.cflags, tb.cflags, ...)"""
+    ret = []
+    for line in cfg_text.splitlines():
+        line = line.split('#')[0].strip()
+        if '=' not in line or line.split('=', 1)[0].strip() not in keys:
+            continue
+        tokens = shlex.split(line.split('=', 1)[1])
+        for i, tok in enumerate(tokens):
+            for flag in ['-I', '-iquote', '-isystem']:
+                if tok == flag and i + 1 < len(tokens):
+                    path = tokens[i + 1]
+                elif tok.startswith(flag) and len(tok) > len(flag):
+                    path = tok[len(flag):]
+                else:
+                    continue
+                for d in [os.path.join(b, path) for b in search_dirs] + [path]:
+                    if os.path.isdir(d):
+                        ret.append(os.path.abspath(d))
+                        break
+                break
+    return ret
+
+def include_closure(sources, include_dirs):
+    """Sources plus every file they #include (transitively) that resolves to a file.
+
+    Quoted includes are looked up next to the including file, then in the
+    include directories; angle includes only in the include directories, so
+    the tool headers (ap_int.h, hls_stream.h, ...) are covered by the tool
+    version instead. Every #include line counts, also in inactive #if blocks.
+    """
+    seen  = set()
+    stack = [s for s in sources if s is not None]
+    while stack:
+        path = stack.pop()
+        if path in seen:
+            continue
+        seen.add(path)
+        if os.path.isdir(path):
+            continue
+        with open(path, 'rb') as f:
+            text = f.read()
+        for m in INCLUDE_RE.finditer(text):
+            name = m.group(2).decode(errors='replace').strip()
+            dirs = ([os.path.dirname(path)] if m.group(1) == b'"' else []) + include_dirs
+            for d in dirs:
+                inc = os.path.normpath(os.path.join(d, name))
+                if os.path.isfile(inc):
+                    stack.append(inc)
+                    break
+    return sorted(seen) + [None for s in sources if s is None]
+
+def outputs_digest(paths):
+    """Hash of the stage outputs, None if none of them exist"""
+    h = hashlib.sha256()
+    found = False
+    for path in paths:
+        if os.path.exists(path):
+            hash_path(h, path)
+            found = True
+    return h.hexdigest() if found else None
+
+def run_stage(stage, inputs, outputs, upstream=()):
+    """Run a component stage unless the stamp of the same inputs is still valid.
+
+    inputs is the list of input files (None for a missing input, never reused),
+    outputs the files/directories the stage writes, upstream the stages whose
+    output digests are part of the key.
+    """
+    h = hashlib.sha256(f'{stage}\n{tool_version}\n'.encode())
+    h.update(cfg_text.encode())
+    reuse = stage_cache and None not in inputs
+    for path in inputs:
+        if path is not None:
+            hash_path(h, path)
+    for up in upstream:
+        h.update(f'{up}={stage_digest.get(up)}\n'.encode())
+    key = h.hexdigest()
+
+    stamp_file = f'{stamp_dir}/{stage}.json'
+    try:
+        with open(stamp_file) as f:
+            stamp = json.load(f)
+    except (OSError, ValueError):
+        stamp = {}
+
+    if reuse and stamp.get('key') == key and stamp.get('outputs') is not None and outputs_digest(outputs) == stamp['outputs']:
+        stage_digest[stage] = stamp['outputs']
+        stage_summary.append((stage, 'reused', stamp.get('seconds', 0.0)))
+        print(f'Stage cache: {stage} inputs unchanged, reusing the outputs')
+        return
+
+    start = time.monotonic()
+    get_component().run(stage)
+    seconds = time.monotonic() - start
+
+    stage_digest[stage] = outputs_digest(outputs)
+    stage_summary.append((stage, 'ran', seconds))
+
+    os.makedirs(stamp_dir, exist_ok=True)
+    with open(stamp_file + '.tmp', 'w') as f:
+        json.dump({'key': key, 'outputs': stage_digest[stage], 'seconds': seconds, 'time': time.time()}, f)
+    os.replace(stamp_file + '.tmp', stamp_file)
+
+def get_component():
+    """Create the vitis client on first use, not at all if every stage is reused"""
+    global client, hls_test_comp
+    if hls_test_comp is None:
+        # Create a client object
+        client = vitis.create_client()
+
+        # Set workspace
+        client.set_workspace(workspace)
+
+        # Set the component
+        hls_test_comp = client.get_component(comp_name)
+    return hls_test_comp
+
+def print_summary():
+    saved = sum([sec for stage, status, sec in stage_summary if status == 'reused'])
+    print('\nStage cache summary:')
+    for stage, status, sec in stage_summary:
+        print(f'   {stage:16} {status:8} {sec:10.1f} s')
+    print(f'   Time saved by reused stages: {saved:.1f} s')
+
+
 parser = argparse.ArgumentParser(
     prog="Vitis HLS build script"
 )
 parser.add_argument("-c", "--csim",default=False,action="store_true")
+parser.add_argument("-s", "--synth",default=False,action="store_true",help="Only run the synthesis")
 args = parser.parse_args()
 
 # Project variables
@@ -32,87 +254,81 @@ if not syn_top:
 else:
     zip_name = syn_top
 
-proj_zip  = f'{workspace}/{comp_name}/{comp_name}/{zip_name}.zip'
-build_zip = f'{os.getenv("PROJ_DIR")}/ip/{zip_name}.zip'
-
-# Create a client object
-client = vitis.create_client()
+proj_dir  = os.getenv("PROJ_DIR")
+comp_dir  = f'{workspace}/{comp_name}'
+work_dir  = f'{comp_dir}/{comp_name}'
+proj_zip  = f'{work_dir}/{zip_name}.zip'
+build_zip = f'{proj_dir}/ip/{zip_name}.zip'
 
-# Set workspace
-client.set_workspace(workspace)
+# Stage cache: a stage is skipped when its inputs match the stamp of its last run
+stage_cache   = os.getenv('HLS_STAGE_CACHE', '1') != '0'
+stamp_dir     = f'{comp_dir}/.stage_stamps'
+tool_version  = f'{os.getenv("XILINX_VITIS", "")} {os.getenv("VIVADO_VERSION", "")}'
+cfg_text      = open(f'{proj_dir}/hls_config.cfg').read()
+syn_sources   = cfg_sources(cfg_text, 'syn.file', [proj_dir, comp_dir])
+tb_sources    = cfg_sources(cfg_text, 'tb.file', [proj_dir, comp_dir])
+syn_includes  = cfg_include_dirs(cfg_text, ['syn.cflags'], [proj_dir, comp_dir])
+tb_includes   = cfg_include_dirs(cfg_text, ['tb.cflags', 'csim.cflags'], [proj_dir, comp_dir])
+stage_digest  = {}
+stage_summary = []
 
-# Set the component
-hls_test_comp = client.get_component(comp_name)
+client        = None
+hls_test_comp = None
 
 # Run c-simulation on the component if not explicitly skipped
-if os.getenv('SKIP_CSIM', '0') == '0':
-   hls_test_comp.run('C_SIMULATION')
+if os.getenv('SKIP_CSIM', '0') == '0' and not args.synth:
+    run_stage('C_SIMULATION', include_closure(syn_sources + tb_sources, syn_includes + tb_includes), [f'{work_dir}/hls/csim'])
 
 if args.csim:
-    vitis.dispose()
+    print_summary()
+    if hls_test_comp is not None:
+        vitis.dispose()
     exit()
 
 # Run synthesis on the component
-hls_test_comp.run('SYNTHESIS')
+run_stage('SYNTHESIS', include_closure(syn_sources, syn_includes), [f'{work_dir}/hls/syn/verilog', f'{work_dir}/hls/syn/vhdl'])
+
+if args.synth:
+    print_summary()
+    if hls_test_comp is not None:
+        vitis.dispose()
+    exit()
 
 # Run co-simulation on the component if not explicitly skipped
 if os.getenv('SKIP_COSIM', '0') == '0':
-   hls_test_comp.run('CO_SIMULATION')
+    run_stage('CO_SIMULATION', include_closure(tb_sources, syn_includes + tb_includes), [f'{work_dir}/hls/sim/report'], ['SYNTHESIS'])
 
 # Run package on the component
-hls_test_comp.run('PACKAGE')
+run_stage('PACKAGE', [], [proj_zip], ['SYNTHESIS'])
 
 # Run implementation on the component
-if 'vivado.syn_dcp=1' in open(f'{os.getenv("PROJ_DIR")}/hls_config.cfg').read():
-    hls_test_comp.run('IMPLEMENTATION')
+if 'vivado.syn_dcp=1' in cfg_text:
+    run_stage('IMPLEMENTATION', [], [f'{work_dir}/hls/impl/verilog', f'{work_dir}/hls/impl/vhdl', f'{work_dir}/hls/impl/report'], ['PACKAGE'])
 else:
     print("vivado.syn_dcp=1 not detected in hls.cfg")
 
+print_summary()
+
 # Close the client connection and terminate the vitis server
-vitis.dispose()
+if hls_test_comp is not None:
+    vitis.dispose()
 
 # Check if ALL_XIL_FAMILY is enabled
 if int(os.getenv("ALL_XIL_FAMILY")) > 0:
 
-    # Over the .ZIP file and decompress it
-    ip_path = f'{workspace}/ip'
-    os.system( f'rm -rf {ip_path}' )
-    os.system( f'mkdir {ip_path}' )
-    os.system( f'unzip {proj_zip} -d {ip_path}' )
-
-    # Read and modify component.xml
-    component_path = f'{ip_path}/component.xml'
-    temp_path = f'{ip_path}/component.temp'
-    with open(component_path, 'r') as infile, open(temp_path, 'w') as outfile:
-        xil_family = """
-<xilinx:family xilinx:lifeCycle="Production">artix7</xilinx:family>
-<xilinx:family xilinx:lifeCycle="Production">kintex7</xilinx:family>
-<xilinx:family xilinx:lifeCycle="Production">virtex7</xilinx:family>
-<xilinx:family xilinx:lifeCycle="Production">zynq</xilinx:family>
-<xilinx:family xilinx:lifeCycle="Production">kintexu</xilinx:family>
-<xilinx:family xilinx:lifeCycle="Production">virtexu</xilinx:family>
-<xilinx:family xilinx:lifeCycle="Production">kintexuplus</xilinx:family>
-<xilinx:family xilinx:lifeCycle="Production">virtexuplus</xilinx:family>
-<xilinx:family xilinx:lifeCycle="Production">virtexuplusHBM</xilinx:family>
-<xilinx:family xilinx:lifeCycle="Production">zynquplus</xilinx:family>
-<xilinx:family xilinx:lifeCycle="Production">zynquplusRFSOC</xilinx:family>
-<xilinx:family xilinx:lifeCycle="Production">versal</xilinx:family>
-"""
-        for line in infile:
-            if 'xilinx:family' in line:
-                outfile.write(xil_family)
-            else:
-                outfile.write(line)
-
-    # Replace the original component.xml with the modified one
-    shutil.move(temp_path, component_path)
-
     # Remove stale zip to prevent "Zip file structure invalid" error on rebuild
     if os.path.exists(build_zip):
         os.remove(build_zip)
 
-    # Compress the modified IP directory to the target's image directory
-    os.system( f'bash -c "cd {ip_path}; zip -r {build_zip} *"' )
+    # Stream the IP .ZIP file to the target's image directory with the modified component.xml
+    tmp_zip = f'{build_zip}.tmp'
+    with zipfile.ZipFile(proj_zip, 'r') as zin, open(proj_zip, 'rb') as fin, zipfile.ZipFile(tmp_zip, 'w') as zout:
+        for info in zin.infolist():
+            if info.filename == 'component.xml':
+                zout.writestr(info, set_all_families(zin.read(info)), compress_type=zipfile.ZIP_DEFLATED)
+            else:
+                copy_raw_member(fin, info, zout)
+    os.replace(tmp_zip, build_zip)
 
 else:
     # Copy the .ZIP file to the local ip/ directory